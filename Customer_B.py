@@ -1,3 +1,5 @@
+from extraction_rules import FieldRule
+
 sold_to_info = {
     "sold_to_num": "bsp_222"  
 }
@@ -11,6 +13,28 @@ ship_to_info = {
 
 
 
+# Labels used in extract_prompt mapped to the canonical field names
+field_map = {
+    "PO Number": "Purchase Order Number",
+    "QUANTITY": "Quantity",
+    "PROMISED  DELIVERY": "Required Delivery Date",
+    "ITEM NUMBER": "Material Number",
+    "SHIP TO": "Deliver to",
+}
+
+# Extract the canonical fields with one JSON-constrained call instead of extract + refine
+single_pass = False
+
+# Deterministic patterns tried on the PDF text before the LLM, keyed by canonical field name.
+# Fields resolved here with high confidence are not taken from the LLM output.
+extract_rules = {
+    "Purchase Order Number": FieldRule(r'PO Number\D{0,20}?\b(\d{6,8})\b'),
+    "Quantity": FieldRule(r'QUANTITY\D{0,20}?(\d[\d,]*(?:\.\d+)?\s*(?:KG|LB))\b'),
+    "Required Delivery Date": FieldRule(r'PROMISED\s+DELIVERY\D{0,40}?(\d{2}/\d{2}/\d{4})'),
+    "Material Number": FieldRule(r'ITEM NUMBER\D{0,20}?\b(\d{5,8})\b(?!\s*(?:KG|LB))'),
+}
+
+
 def extract_prompt(retrieved_text):
     return f"""
     You are an expert at reading purchase orders. From the text below, extract **only the exact content** from the document without paraphrasing or summarizing.
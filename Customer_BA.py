@@ -1,3 +1,5 @@
+from extraction_rules import FieldRule
+
 sold_to_info = {
     "sold_to_num": "basp_567"  
 }
@@ -10,6 +12,31 @@ ship_to_info = {
 }
 
 
+# Labels used in extract_prompt mapped to the canonical field names
+field_map = {
+    "Order No": "Purchase Order Number",
+    "QUANTITY": "Quantity",
+    "Delivery Date": "Required Delivery Date",
+    "Material No.": "Material Number",
+    "Delivery Address": "Deliver to",
+}
+
+# Extract the canonical fields with one JSON-constrained call instead of extract + refine
+single_pass = False
+
+# Only the first 2 pages hold the order, everything after is the appendix
+page_selection = {"first_pages": 2}
+
+# Deterministic patterns tried on the PDF text before the LLM, keyed by canonical field name.
+# Fields resolved here with high confidence are not taken from the LLM output.
+extract_rules = {
+    "Purchase Order Number": FieldRule(r'Order No\.?\D{0,10}?\b(\d{4,12})\b'),
+    "Quantity": FieldRule(r'Quantity\D{0,10}?(\d[\d,]*(?:\.\d+)?\s*(?:KG|LB))\b'),
+    "Required Delivery Date": FieldRule(r'Delivery Date\D{0,20}?(\d{2}/\d{2}/\d{4})'),
+    "Material Number": FieldRule(r'Material No\.?\D{0,10}?\b(\d{3,12})\b'),
+}
+
+
 def extract_prompt(retrieved_text):
     return f"""
     You are an expert at reading purchase orders. From the text below, extract **only the exact content** from the document without paraphrasing or summarizing.
@@ -10,6 +10,22 @@ ship_to_info = {
 
 
 
+# Labels used in extract_prompt mapped to the canonical field names
+field_map = {
+    "Purchase Order Number": "Purchase Order Number",
+    "Quantity": "Quantity",
+    "Required Delivery Date": "Required Delivery Date",
+    "Material Number": "Material Number",
+    "Deliver to": "Deliver to",
+}
+
+# Extract the canonical fields with one JSON-constrained call instead of extract + refine
+single_pass = False
+
+# Customer-specific rules added to the single-pass prompt
+single_pass_instructions = '- **Quantity**: keeps value whose unit of measure is "kg"'
+
+
 def extract_prompt(retrieved_text):
     return f"""
     You are an expert at reading purchase orders. From the text below, extract **only the exact content** from the document without paraphrasing or summarizing.
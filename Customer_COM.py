@@ -1,3 +1,5 @@
+from extraction_rules import FieldRule, day_month_year_to_us, pounds_to_lb
+
 sold_to_info = {
     "sold_to_num": "cosp_222"  
 }
@@ -9,6 +11,28 @@ ship_to_info = {
 }
 
 
+# Labels used in extract_prompt mapped to the canonical field names
+field_map = {
+    "Purchase Order:": "Purchase Order Number",
+    "Order Qty": "Quantity",
+    "Delivery date": "Required Delivery Date",
+    "Material": "Material Number",
+    "Ship To": "Deliver to",
+}
+
+# Extract the canonical fields with one JSON-constrained call instead of extract + refine
+single_pass = False
+
+# Deterministic patterns tried on the PDF text before the LLM, keyed by canonical field name.
+# Fields resolved here with high confidence are not taken from the LLM output.
+extract_rules = {
+    "Purchase Order Number": FieldRule(r'Purchase Order\D{0,40}?\b(8\d{5,11})\b'),
+    "Quantity": FieldRule(r'Order Qty\D{0,20}?(\d[\d,]*\.\d{3}\s*(?:KG|LB|Pound\(s\)))', transform=pounds_to_lb),
+    "Required Delivery Date": FieldRule(r'Delivery date\W{0,10}(\d{1,2}/[A-Za-z]+/\d{4})', transform=day_month_year_to_us),
+    "Material Number": FieldRule(r'Material\W{0,5}(\d{4,7}(?:-\d{1,2})?)\b'),
+}
+
+
 def extract_prompt(retrieved_text):
     return f"""
     You are an expert at reading purchase orders. From the text below, extract **only the exact content** from the document without paraphrasing or summarizing.
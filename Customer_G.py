@@ -1,3 +1,5 @@
+from extraction_rules import FieldRule
+
 
 sold_to_info = {
     "sold_to_num": "gsp_123"  
@@ -10,6 +12,30 @@ ship_to_info = {
 }
 
 
+# Labels used in extract_prompt mapped to the canonical field names
+field_map = {
+    "Document Number": "Purchase Order Number",
+    "Quantity": "Quantity",
+    "Delivery Date": "Required Delivery Date",
+    "Material/Description": "Material Number",
+    "Shipping Address": "Deliver to",
+}
+
+# Extract the canonical fields with one JSON-constrained call instead of extract + refine
+single_pass = False
+
+# Customer-specific rules added to the single-pass prompt
+single_pass_instructions = "- **Quantity**: the unit of measure is KG"
+
+# Deterministic patterns tried on the PDF text before the LLM, keyed by canonical field name.
+# Fields resolved here with high confidence are not taken from the LLM output.
+extract_rules = {
+    "Purchase Order Number": FieldRule(r'Document Number\D{0,10}?\b(\d{4,12})\b'),
+    "Quantity": FieldRule(r'Quantity\D{0,20}?(\d[\d,]*(?:\.\d+)?\s*KG)\b'),
+    "Required Delivery Date": FieldRule(r'Delivery Date\D{0,20}?(\d{2}/\d{2}/\d{4})'),
+}
+
+
 def extract_prompt(retrieved_text):
     return f"""
     You are an expert at reading purchase orders. From the text below, extract **only the exact content** from the document without paraphrasing or summarizing.
@@ -1,9 +1,8 @@
 import streamlit as st
-import PyPDF2
 import json
-import re
 from openai import OpenAI
 import uuid  # Used to generate unique keys
+from pdf_processing import extract_text
 
 # Set Streamlit Page Layout
 st.set_page_config(page_title="📄 LLM-Powered Purchase Order Extractor", layout="wide")
@@ -61,21 +60,13 @@ with st.sidebar:
         if st.button("Process Files"):
             st.session_state.processed = True  # Set processing flag
 
-# Function to extract text from PDF
+# Function to extract normalized text from PDF
 def extract_text_from_pdf(pdf_file):
-    text = ""
     try:
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
+        return extract_text(pdf_file.getvalue(), normalize=True)
     except Exception as e:
         st.error(f"Error reading PDF: {e}")
-    return text
-
-# Function to fix number formatting issues
-def fix_number_format(text):
-    text = re.sub(r'(\d{1,3}),(\d{3}\.\d+)', r'\1\2', text)  # Convert "41,976.050" → "41976.050"
-    return text
+        return ""
 
 # Define system message for OpenAI
 system_message = (
@@ -106,7 +97,6 @@ if st.session_state.api_key_valid and st.session_state.uploaded_files_list and s
 
         # Extract and clean text from PDF
         pdf_text = extract_text_from_pdf(pdf_file)
-        pdf_text = fix_number_format(pdf_text)
 
         # Create prompt for OpenAI
         user_prompt = f"Extract relevant details from the following purchase order:\n{pdf_text}"
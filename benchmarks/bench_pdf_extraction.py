@@ -0,0 +1,76 @@
+"""
+Compare the text extraction backends of pdf_processing.
+
+Generates a corpus of synthetic purchase order PDFs and extracts every page
+with each backend in a fresh process, reporting pages/sec and peak memory.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_pdf_extraction --docs 50 --pages 8
+"""
+import argparse
+import multiprocessing
+import sys
+import time
+import tracemalloc
+from benchmarks.synthetic_pdfs import make_po_pdf
+from pdf_processing import PDF_BACKENDS, extract_pages
+
+def peak_rss_mb():
+    """Peak resident set size of this process, None where the resource module is missing."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def run_backend(backend, corpus, results):
+    # Import the backend before measuring so import cost is not counted
+    extract_pages(corpus[0], backend, max_pages=1)
+    rss_before = peak_rss_mb()
+    tracemalloc.start()
+    start = time.perf_counter()
+    pages = sum(len(extract_pages(pdf, backend, normalize=True)) for pdf in corpus)
+    elapsed = time.perf_counter() - start
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = peak_rss_mb()
+    results[backend] = {
+        'pages': pages,
+        'seconds': elapsed,
+        'python_peak_mb': python_peak / (1024 * 1024),
+        'rss_growth_mb': None if rss_before is None else rss_after - rss_before,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=50, help="Number of synthetic PDFs")
+    parser.add_argument('--pages', type=int, default=8, help="Pages per PDF")
+    parser.add_argument('--backends', nargs='+', default=list(PDF_BACKENDS), choices=list(PDF_BACKENDS))
+    args = parser.parse_args()
+
+    corpus = [make_po_pdf(pages=args.pages, seed=seed) for seed in range(args.docs)]
+
+    # Each backend runs in a fresh process so peak memory is not shared
+    context = multiprocessing.get_context('spawn')
+    manager = context.Manager()
+    results = manager.dict()
+    for backend in args.backends:
+        process = context.Process(target=run_backend, args=(backend, corpus, results))
+        process.start()
+        process.join()
+
+    print(f"{args.docs} documents x {args.pages} pages")
+    print(f"{'backend':<10} {'pages/sec':>10} {'python peak MB':>15} {'RSS growth MB':>14}")
+    for backend in args.backends:
+        if backend not in results:
+            print(f"{backend:<10} failed")
+            continue
+        result = results[backend]
+        rss = 'n/a' if result['rss_growth_mb'] is None else f"{result['rss_growth_mb']:.1f}"
+        print(f"{backend:<10} {result['pages'] / result['seconds']:>10.1f} {result['python_peak_mb']:>15.1f} {rss:>14}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""
+Offline benchmark of the Ollama and OpenAI purchase order pipelines.
+
+Synthetic PDFs in each customer's layout are run through
+po_processor.process_purchase_order_file and standard_via_openai.extract_po_data
+against the local mock servers in benchmarks/mock_servers.py. Reports per-stage
+latency, documents/sec and memory. Save a baseline and compare later runs
+against it; a regression beyond the tolerance exits with status 1.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_pipeline --docs 20 --latency 0.2 --save-baseline bench_baseline.json
+    python -m benchmarks.bench_pipeline --docs 20 --latency 0.2 --compare bench_baseline.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.mock_servers import MockServer, OllamaHandler, OpenAIHandler
+from benchmarks.synthetic_pdfs import make_customer_po_pdf
+
+CUSTOMERS = ['B', 'BA', 'C', 'COM', 'G', 'N']
+
+# Stage timings below this many milliseconds are too noisy to compare
+MIN_COMPARABLE_MS = 2.0
+
+class StageTimer:
+    """Record the latency of module-level functions by wrapping them."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def wrap(self, owner, name, stage):
+        func = getattr(owner, name)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.samples[stage].append((time.perf_counter() - start) * 1000)
+
+        setattr(owner, name, timed)
+
+    def report(self):
+        report = {}
+        for stage, values in self.samples.items():
+            ordered = sorted(values)
+            report[stage] = {
+                'calls': len(values),
+                'mean_ms': round(statistics.mean(values), 3),
+                'p50_ms': round(ordered[len(ordered) // 2], 3),
+                'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+            }
+        return report
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+def run_documents(process, documents, concurrency):
+    """Run process over the documents and return the elapsed seconds and the failures."""
+    failures = []
+
+    def run_one(document):
+        try:
+            process(document)
+        except Exception as e:
+            failures.append(str(e))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(run_one, documents))
+    return time.perf_counter() - start, failures
+
+def bench_ollama(documents, concurrency):
+    from werkzeug.datastructures import FileStorage
+    import po_processor
+    from customer_handler import get_customer_module
+
+    timer = StageTimer()
+    for name, stage in [
+        ('extract_text_from_pdf', 'parse'), ('apply_customer_rules', 'rules'), ('split_text', 'split'),
+        ('retrieve_relevant_text', 'retrieval'), ('extract_information_with_llm', 'llm_extract'),
+        ('refine_extracted_information', 'llm_refine'), ('extract_structured_information', 'llm_single_pass'),
+        ('post_process_extracted_info', 'post_process'),
+    ]:
+        timer.wrap(po_processor, name, stage)
+
+    def process(document):
+        customer, pdf_bytes = document
+        file = FileStorage(stream=io.BytesIO(pdf_bytes), filename=f"{customer}.pdf")
+        po_processor.process_purchase_order_file(file, get_customer_module(customer), 'uploads')
+
+    elapsed, failures = run_documents(process, documents, concurrency)
+    return elapsed, failures, timer.report()
+
+def bench_openai(documents, concurrency):
+    import standard_via_openai
+    from openai_scheduler import openai_scheduler
+
+    timer = StageTimer()
+    timer.wrap(standard_via_openai, 'extract_text_from_pdf', 'parse')
+    timer.wrap(openai_scheduler, 'create_chat_completion', 'llm_chat')
+    timer.wrap(standard_via_openai, 'format_results_for_frontend', 'post_process')
+
+    def process(document):
+        _, pdf_bytes = document
+        if not standard_via_openai.extract_po_data(pdf_bytes):
+            raise RuntimeError("No data extracted")
+
+    elapsed, failures = run_documents(process, documents, concurrency)
+    return elapsed, failures, timer.report()
+
+def compare(results, baseline, tolerance):
+    """Return the regressions of results against a baseline."""
+    regressions = []
+    for pipeline in ('ollama', 'openai'):
+        if pipeline not in results or pipeline not in baseline:
+            continue
+        result = results[pipeline]
+        base = baseline[pipeline]
+        if result['docs_per_sec'] < base['docs_per_sec'] * (1 - tolerance):
+            regressions.append(f"{pipeline}: {result['docs_per_sec']} docs/sec, baseline {base['docs_per_sec']}")
+        for stage, stats in result['stages'].items():
+            base_stats = base['stages'].get(stage)
+            if not base_stats or max(stats['p50_ms'], base_stats['p50_ms']) < MIN_COMPARABLE_MS:
+                continue
+            if stats['p50_ms'] > base_stats['p50_ms'] * (1 + tolerance):
+                regressions.append(f"{pipeline}/{stage}: p50 {stats['p50_ms']} ms, baseline {base_stats['p50_ms']} ms")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=10, help="Documents per customer")
+    parser.add_argument('--pages', type=int, default=3, help="Pages per document")
+    parser.add_argument('--latency', type=float, default=0.2, help="Mock model latency in seconds")
+    parser.add_argument('--concurrency', type=int, default=1, help="Documents processed at the same time")
+    parser.add_argument('--pipelines', nargs='+', default=['ollama', 'openai'], choices=['ollama', 'openai'])
+    parser.add_argument('--with-rules', action='store_true', help="Let the rule pre-extractor skip the LLM")
+    parser.add_argument('--verbose', action='store_true', help="Show the pipeline's own output")
+    parser.add_argument('--save-baseline', help="Write the results to this JSON file")
+    parser.add_argument('--compare', help="Compare against this baseline JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    with MockServer(OllamaHandler, latency=args.latency) as ollama, MockServer(OpenAIHandler, latency=args.latency) as openai:
+        # The pipeline modules read their configuration at import time
+        os.environ['OLLAMA_BASE_URL'] = ollama.url
+        os.environ['OPENAI_BASE_URL'] = f"{openai.url}/v1"
+        os.environ['OPENAI_API_KEY'] = 'mock'
+        os.environ['RESULT_CACHE_ENABLED'] = '0'
+        os.environ['EMBEDDING_CACHE_ENABLED'] = '0'
+        # The mock server has no rate limits, the scheduler must not add any
+        os.environ['OPENAI_RPM_LIMIT'] = os.environ['OPENAI_TPM_LIMIT'] = str(10 ** 9)
+        if not args.with_rules:
+            os.environ['RULE_CONFIDENCE_THRESHOLD'] = '2'
+        os.makedirs('uploads', exist_ok=True)
+
+        # Measure steady-state processing, not the first request's imports
+        from preload import preload_backends
+        preload_backends()
+
+        results = {}
+        tracemalloc.start()
+        for pipeline in args.pipelines:
+            customers = CUSTOMERS if pipeline == 'ollama' else ['DEFAULT']
+            documents = [
+                (customer, make_customer_po_pdf(customer, args.pages, seed)[0])
+                for seed in range(args.docs) for customer in customers
+            ]
+            bench = bench_ollama if pipeline == 'ollama' else bench_openai
+            output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+            with output:
+                elapsed, failures, stages = bench(documents, args.concurrency)
+            results[pipeline] = {
+                'documents': len(documents),
+                'failures': len(failures),
+                'seconds': round(elapsed, 3),
+                'docs_per_sec': round(len(documents) / elapsed, 3),
+                'stages': stages,
+            }
+            if failures:
+                print(f"{pipeline}: {len(failures)} failures, first: {failures[0]}")
+        _, python_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    results['memory'] = {'python_peak_mb': round(python_peak / (1024 * 1024), 1), 'peak_rss_mb': peak_rss_mb()}
+    results['config'] = vars(args)
+
+    for pipeline in args.pipelines:
+        result = results[pipeline]
+        print(f"\n{pipeline}: {result['documents']} docs in {result['seconds']} s, {result['docs_per_sec']} docs/sec, {result['failures']} failures")
+        print(f"  {'stage':<16} {'calls':>6} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+        for stage, stats in result['stages'].items():
+            print(f"  {stage:<16} {stats['calls']:>6} {stats['mean_ms']:>9.2f} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f}")
+    print(f"\nmemory: python peak {results['memory']['python_peak_mb']} MB, peak RSS {results['memory']['peak_rss_mb']} MB")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark ship-to matching with the n-gram index against the full SequenceMatcher scan.
+
+Builds synthetic ship-to master data of each size and matches noisy variants of
+its addresses. Reports the index build time and memory, the query latency of
+both methods and how often the index returns the same key as the full scan.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_ship_to_index --sizes 10000 100000 --queries 200
+"""
+import argparse
+import random
+import statistics
+import time
+from difflib import SequenceMatcher
+from ship_to_index import ShipToIndex
+
+STREETS = ['Industrial', 'Commerce', 'Harbor', 'Airport', 'Railroad', 'Valley', 'Lakeside', 'Pine', 'Oak', 'Maple', 'Cedar', 'River']
+SUFFIXES = ['Way', 'Road', 'Street', 'Avenue', 'Boulevard', 'Parkway', 'Drive', 'Lane']
+CITIES = [
+    ('Houston', 'TX'), ('Dallas', 'TX'), ('Memphis', 'TN'), ('Atlanta', 'GA'), ('Chicago', 'IL'), ('Columbus', 'OH'),
+    ('Newark', 'NJ'), ('Reno', 'NV'), ('Ontario', 'CA'), ('Louisville', 'KY'), ('Indianapolis', 'IN'), ('Denver', 'CO'),
+]
+SITES = ['Distribution Center', 'Warehouse', 'Plant', 'DC', 'Logistics Hub', 'Terminal']
+
+def make_ship_to_info(size, seed=0):
+    """Synthetic ship_to_info with size entries."""
+    rng = random.Random(seed)
+    ship_info = {}
+    for index in range(size):
+        city, state = rng.choice(CITIES)
+        ship_info[f"ST{index:06d}"] = (
+            f"{city.upper()[:4]}{rng.randint(1, 99)} {rng.choice(SITES)}, {rng.randint(1, 9999)} "
+            f"{rng.choice(STREETS)} {rng.choice(SUFFIXES)}, {city}, {state} {rng.randint(10000, 99999)}"
+        )
+    return ship_info
+
+def make_query(address, rng):
+    """A delivery address as an LLM might extract it: case changes, dropped and swapped characters."""
+    chars = list(address.upper() if rng.random() < 0.3 else address)
+    for _ in range(rng.randint(0, 3)):
+        position = rng.randrange(len(chars) - 1)
+        if rng.random() < 0.5:
+            del chars[position]
+        else:
+            chars[position], chars[position + 1] = chars[position + 1], chars[position]
+    return ''.join(chars).replace(',', '' if rng.random() < 0.5 else ',')
+
+def full_scan(deliver_to, ship_info, threshold=0.3):
+    """The matching of utils.find_best_match without the index."""
+    best_match = None
+    highest_ratio = 0.0
+    for key, value in ship_info.items():
+        ratio = SequenceMatcher(None, deliver_to, value).ratio()
+        if ratio > highest_ratio:
+            highest_ratio = ratio
+            best_match = key
+    return "N/A" if highest_ratio < threshold else best_match
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--queries', type=int, default=200, help="Queries against the index")
+    parser.add_argument('--scan-queries', type=int, default=10, help="Queries also run as a full scan, which is slow")
+    parser.add_argument('--candidates', type=int, default=20, help="Index candidates re-ranked per query")
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        ship_info = make_ship_to_info(size)
+        rng = random.Random(size)
+        keys = rng.sample(list(ship_info), args.queries)
+        queries = [(key, make_query(ship_info[key], rng)) for key in keys]
+
+        start = time.perf_counter()
+        index = ShipToIndex(ship_info)
+        build_seconds = time.perf_counter() - start
+        index_bytes = index.posting_docs.nbytes + index.posting_weights.nbytes + index.term_offsets.nbytes + index.idf.nbytes
+
+        latencies = []
+        hits = 0
+        matches = {}
+        for key, query in queries:
+            start = time.perf_counter()
+            matches[query] = index.find_best_match(query, k=args.candidates)
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += matches[query] == key
+
+        scan_latencies = []
+        agreement = 0
+        for _, query in queries[:args.scan_queries]:
+            start = time.perf_counter()
+            expected = full_scan(query, ship_info)
+            scan_latencies.append((time.perf_counter() - start) * 1000)
+            agreement += expected == matches[query]
+
+        latencies.sort()
+        print(f"\n{size} ship-to entries")
+        print(f"  index build        {build_seconds:.2f} s, {len(index.vocabulary)} n-grams, {index_bytes / (1024 * 1024):.1f} MB of postings")
+        print(f"  index query        p50 {latencies[len(latencies) // 2]:.2f} ms, p95 {latencies[int(len(latencies) * 0.95)]:.2f} ms")
+        print(f"  full scan query    mean {statistics.mean(scan_latencies):.1f} ms over {len(scan_latencies)} queries")
+        print(f"  speedup            {statistics.mean(scan_latencies) / statistics.mean(latencies):.0f}x")
+        print(f"  correct key        {hits / len(queries):.1%} of {len(queries)} noisy queries")
+        print(f"  same as full scan  {agreement}/{len(scan_latencies)}")
+
+if __name__ == '__main__':
+    main()
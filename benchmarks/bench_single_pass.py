@@ -0,0 +1,86 @@
+"""
+Compare the single-pass extraction with the two-pass extract + refine flow.
+
+Each PDF in the corpus directory needs a JSON file with the same name holding
+the expected final output (after post-processing), e.g. po_1.pdf and po_1.json:
+
+    {"Purchase Order Number": "123456", "Quantity": "1000", "Unit": "KG",
+     "Required Delivery Date": "2025-03-15", "Material Number": "182111",
+     "Deliver to": "bsh_1"}
+
+Usage (from the repository root, with Ollama running):
+
+    python -m benchmarks.bench_single_pass --customer B --corpus path/to/pos
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import time
+from customer_handler import get_customer_module
+from pdf_processing import extract_text_from_pdf, split_text
+from po_processor import extract_fields
+from retrieval import retrieve_relevant_text
+from utils import post_process_extracted_info
+
+QUERY = "Purchase Order Number, Quantity in kg, Required Delivery Date, Material Number, deliver to"
+
+def normalize(value):
+    return " ".join(str(value).split()).lower()
+
+def run_mode(relevant_text, customer_module, single_pass):
+    """Run one extraction and return its latency and post-processed output."""
+    start = time.perf_counter()
+    try:
+        info = post_process_extracted_info(extract_fields(relevant_text, customer_module, single_pass), customer_module)
+    except (ValueError, AttributeError) as e:
+        print(f"  {'single-pass' if single_pass else 'two-pass'} failed: {e}")
+        info = {}
+    return time.perf_counter() - start, info
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--customer', required=True, help="Customer code, e.g. B")
+    parser.add_argument('--corpus', required=True, help="Directory of PDFs with expected JSON files")
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per document and mode")
+    args = parser.parse_args()
+
+    customer_module = get_customer_module(args.customer)
+    if not customer_module or not hasattr(customer_module, 'field_map'):
+        parser.error(f"Customer {args.customer} does not support single-pass extraction")
+
+    modes = {'two-pass': False, 'single-pass': True}
+    latencies = {mode: [] for mode in modes}
+    correct = {mode: 0 for mode in modes}
+    total_fields = 0
+
+    for pdf_path in sorted(glob.glob(os.path.join(args.corpus, '*.pdf'))):
+        expected_path = f"{os.path.splitext(pdf_path)[0]}.json"
+        if not os.path.exists(expected_path):
+            print(f"Skipping {pdf_path}: no expected output")
+            continue
+        with open(expected_path, 'r') as f:
+            expected = json.load(f)
+
+        text = extract_text_from_pdf(pdf_path, getattr(customer_module, 'page_selection', None))
+        relevant_text, _ = retrieve_relevant_text(split_text(text), QUERY)
+        print(os.path.basename(pdf_path))
+        total_fields += len(expected) * args.repeat
+
+        for mode, single_pass in modes.items():
+            for _ in range(args.repeat):
+                latency, info = run_mode(relevant_text, customer_module, single_pass)
+                latencies[mode].append(latency)
+                correct[mode] += sum(1 for field, value in expected.items() if normalize(info.get(field, "")) == normalize(value))
+
+    if not total_fields:
+        parser.error("No documents with expected output found")
+
+    print(f"\n{'mode':<12} {'mean s':>8} {'p50 s':>8} {'max s':>8} {'field accuracy':>15}")
+    for mode in modes:
+        values = latencies[mode]
+        print(f"{mode:<12} {statistics.mean(values):>8.2f} {statistics.median(values):>8.2f} {max(values):>8.2f} {correct[mode] / total_fields:>15.1%}")
+
+if __name__ == '__main__':
+    main()
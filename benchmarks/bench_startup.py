@@ -0,0 +1,87 @@
+"""
+Report the import time and memory of a po_app worker.
+
+Each mode imports po_app in a fresh interpreter:
+
+- lazy: the default, heavy backends are imported by the first request that needs them
+- preload: PRELOAD_BACKENDS=1, everything is imported at startup as before lazy loading
+
+For the lazy mode the cost moved to the first request is measured as well, and
+the slowest imports of each mode are listed from python -X importtime.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_startup --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import po_app
+startup = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+loaded = [name for name in %r if name in sys.modules]
+start = time.perf_counter()
+from preload import preload_backends
+preload_backends()
+deferred = time.perf_counter() - start
+print(json.dumps({
+    'startup_seconds': startup,
+    'rss_mb': rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024,
+    'deferred_seconds': deferred,
+    'loaded': loaded,
+}))
+"""
+
+HEAVY_PACKAGES = ('fitz', 'numpy', 'openai', 'langchain', 'langchain_ollama', 'faiss')
+
+def run_probe(preload, importtime=False):
+    env = dict(os.environ, MODEL_WARM_UP='0', PRELOAD_BACKENDS='1' if preload else '0')
+    # Only the import of po_app is probed when listing the slowest imports
+    code = "import po_app" if importtime else PROBE % (HEAVY_PACKAGES,)
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', code]
+    completed = subprocess.run(command, env=env, capture_output=True, text=True, check=True)
+    if importtime:
+        return completed.stderr
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def slowest_imports(importtime_output, top):
+    """Top-level packages sorted by cumulative import time."""
+    packages = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        # Nesting depth is shown by indentation, keep the outermost import of each package
+        package = name.strip().split('.')[0]
+        packages[package] = max(packages.get(package, 0), int(cumulative))
+    return sorted(packages.items(), key=lambda item: -item[1])[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3, help="Fresh interpreters per mode")
+    parser.add_argument('--top', type=int, default=8, help="Slowest imports listed per mode")
+    args = parser.parse_args()
+
+    for mode, preload in (('lazy', False), ('preload', True)):
+        probes = [run_probe(preload) for _ in range(args.runs)]
+        print(f"\n{mode}")
+        print(f"  startup         {statistics.median(p['startup_seconds'] for p in probes):.2f} s (median of {args.runs})")
+        print(f"  RSS after start {statistics.median(p['rss_mb'] for p in probes):.0f} MB")
+        if not preload:
+            print(f"  first requests  {statistics.median(p['deferred_seconds'] for p in probes):.2f} s of deferred imports")
+        print(f"  heavy packages  {', '.join(probes[0]['loaded']) or 'none'} loaded at startup")
+        print("  slowest imports " + ", ".join(
+            f"{package} {microseconds / 1000:.0f} ms" for package, microseconds in slowest_imports(run_probe(preload, True), args.top)
+        ))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""
+Load test of the Flask server (po_app.py) against the async server (po_asgi_app.py).
+
+Both servers run in their own process against the mock Ollama and OpenAI
+servers from benchmarks/mock_servers.py, so the model latency is fixed and
+the difference comes from how each server waits on it. Every concurrency
+level sends that many simultaneous uploads and reports the throughput, the
+latency percentiles, the errors and the server's peak RSS and thread count.
+
+Usage (from the repository root):
+
+    python -m benchmarks.load_test --route customer --concurrency 10 50 200 --latency 2
+    python -m benchmarks.load_test --route default --servers asgi --concurrency 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import aiohttp
+from benchmarks.mock_servers import MockServer, OllamaHandler, OpenAIHandler
+from benchmarks.synthetic_pdfs import make_customer_po_pdf
+
+SERVER_COMMANDS = {
+    # The development server po_app.py runs, one thread per request
+    'flask': "from po_app import app; app.run(port={port}, threaded=True)",
+    'asgi': "import uvicorn; uvicorn.run('po_asgi_app:app', port={port}, log_level='warning', backlog=2048)",
+}
+
+ROUTES = {
+    'customer': ('/api/process-purchase-order', 'BA'),
+    'default': ('/api/process-default-purchase-order', 'DEFAULT'),
+}
+
+def process_stats(pid):
+    """Return the resident memory in MB and the thread count of a process, from /proc."""
+    stats = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    stats['rss_mb'] = round(int(line.split()[1]) / 1024, 1)
+                elif line.startswith('Threads:'):
+                    stats['threads'] = int(line.split()[1])
+    except OSError:
+        pass
+    return stats
+
+class ServerProcess:
+    """Run one of the servers in a subprocess pointed at the mock model servers."""
+
+    def __init__(self, name, port, env):
+        self.name = name
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.process = subprocess.Popen(
+            [sys.executable, '-c', SERVER_COMMANDS[name].format(port=port)],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+
+    async def wait_ready(self, session, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.name} server exited with status {self.process.returncode}")
+            try:
+                async with session.get(f"{self.url}/api/customers") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+        raise RuntimeError(f"{self.name} server did not start within {timeout} seconds")
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+async def upload(session, url, customer, pdf_bytes, filename):
+    form = aiohttp.FormData()
+    form.add_field('file', pdf_bytes, filename=filename, content_type='application/pdf')
+    form.add_field('customer', customer)
+    start = time.perf_counter()
+    try:
+        async with session.post(url, data=form) as response:
+            body = await response.json(content_type=None)
+            ok = response.status == 200 and bool(body) and 'error' not in body
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        ok = False
+    return time.perf_counter() - start, ok
+
+async def run_level(server, route, documents, concurrency):
+    """Send concurrency simultaneous uploads and sample the server process while they run."""
+    path, customer = ROUTES[route]
+    samples = []
+
+    async def sample():
+        while True:
+            samples.append(process_stats(server.process.pid))
+            await asyncio.sleep(0.1)
+
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=600)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        sampler = asyncio.create_task(sample())
+        start = time.perf_counter()
+        results = await asyncio.gather(*[
+            upload(session, f"{server.url}{path}", customer, *documents[index % len(documents)])
+            for index in range(concurrency)
+        ])
+        elapsed = time.perf_counter() - start
+        sampler.cancel()
+
+    latencies = sorted(latency for latency, ok in results if ok)
+    return {
+        'requests': concurrency,
+        'errors': sum(1 for _, ok in results if not ok),
+        'elapsed_s': round(elapsed, 2),
+        'requests_per_sec': round(len(latencies) / elapsed, 2),
+        'p50_s': round(latencies[len(latencies) // 2], 2) if latencies else None,
+        'p95_s': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2) if latencies else None,
+        'mean_s': round(statistics.mean(latencies), 2) if latencies else None,
+        'peak_rss_mb': max((s.get('rss_mb', 0) for s in samples), default=None),
+        'peak_threads': max((s.get('threads', 0) for s in samples), default=None),
+    }
+
+async def run(args, env):
+    customer = ROUTES[args.route][1]
+    documents = [
+        (make_customer_po_pdf(customer, pages=args.pages, seed=seed)[0], f"{customer}-{seed}.pdf")
+        for seed in range(20)
+    ]
+    results = {}
+    for index, name in enumerate(args.servers):
+        server = ServerProcess(name, args.port + index, env)
+        try:
+            async with aiohttp.ClientSession() as session:
+                await server.wait_ready(session)
+            # Warm up first, so imports, thread pools and connection pools are not measured
+            await run_level(server, args.route, documents, args.warmup)
+            results[name] = {}
+            for concurrency in args.concurrency:
+                level = await run_level(server, args.route, documents, concurrency)
+                results[name][concurrency] = level
+                print(f"{name:6} c={concurrency:<5} {level['requests_per_sec']:8.2f} req/s  "
+                      f"p50 {level['p50_s']}s  p95 {level['p95_s']}s  errors {level['errors']}  "
+                      f"rss {level['peak_rss_mb']} MB  threads {level['peak_threads']}")
+        finally:
+            server.stop()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--servers', nargs='+', choices=sorted(SERVER_COMMANDS), default=['flask', 'asgi'])
+    parser.add_argument('--route', choices=sorted(ROUTES), default='customer')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--latency', type=float, default=2.0, help="Seconds per mock generate/chat call")
+    parser.add_argument('--warmup', type=int, default=50, help="Concurrent requests sent before measuring")
+    parser.add_argument('--pages', type=int, default=3, help="Pages per synthetic PDF")
+    parser.add_argument('--port', type=int, default=5100, help="Port of the first server, the next ones count up")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    with MockServer(OllamaHandler, latency=args.latency) as ollama, \
+            MockServer(OpenAIHandler, latency=args.latency) as openai:
+        env = dict(
+            os.environ,
+            OLLAMA_BASE_URL=ollama.url,
+            OPENAI_BASE_URL=f"{openai.url}/v1",
+            OPENAI_API_KEY='mock',
+            RESULT_CACHE_ENABLED='0',
+            EMBEDDING_CACHE_ENABLED='0',
+            # The mock server has no rate limits, the OpenAI scheduler must not add any
+            OPENAI_RPM_LIMIT=str(10 ** 9),
+            OPENAI_TPM_LIMIT=str(10 ** 9),
+            OPENAI_MAX_CONCURRENCY='1000',
+            MODEL_WARM_UP='0',
+            LOG_LEVEL='WARNING',
+            # Every document goes to the LLM instead of being resolved by the rules
+            RULE_CONFIDENCE_THRESHOLD='2',
+        )
+        results = asyncio.run(run(args, env))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
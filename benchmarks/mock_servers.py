@@ -0,0 +1,362 @@
+"""
+Local stand-ins for the Ollama and OpenAI HTTP APIs with configurable latency.
+
+They return canned purchase order JSON so the pipelines can be benchmarked
+offline. Run them standalone to point a development server at them:
+
+    python -m benchmarks.mock_servers --ollama-port 11435 --openai-port 8089 --latency 0.5
+
+    OLLAMA_BASE_URL=http://localhost:11435 OPENAI_BASE_URL=http://localhost:8089/v1 \\
+        OPENAI_API_KEY=mock python po_app.py
+"""
+import argparse
+import email
+import email.policy
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMBEDDING_DIM = 64
+
+CANNED_FIELDS = {
+    "Purchase Order Number": "1234567",
+    "Quantity": "1000 KG",
+    "Required Delivery Date": "03/15/2025",
+    "Material Number": "182111",
+    "Deliver to": "MAGA1 Distribution Center, 100 Industrial Way, Houston, TX 77001",
+}
+
+CANNED_OPENAI_ORDER = {
+    "Customer Name": "Example Customer",
+    "Purchase Order Number": "1234567",
+    "Required Delivery Date": "2025-03-15",
+    "Delivery Address": "MAGA1 Distribution Center, 100 Industrial Way, Houston, TX 77001",
+    "Order Lines": [
+        {"Material Number": "182111", "Order Quantity in kg": 1000},
+        {"Material Number": "182112", "Order Quantity in kg": 2000},
+    ],
+}
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Shared request plumbing, subclasses set the routes and the latency."""
+
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+    jitter = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def wait(self, fraction=1.0):
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay * fraction)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}') if length else {}
+
+    def send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def start_stream(self, content_type, headers=None):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+def fake_embedding(text):
+    """Deterministic pseudo-embedding of a text."""
+    rng = random.Random(text)
+    return [rng.uniform(-1, 1) for _ in range(EMBEDDING_DIM)]
+
+class OllamaHandler(MockHandler):
+    """Emulates /api/generate, /api/embed, /api/embeddings and /api/tags."""
+
+    model = 'llama3.1:latest'
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self.send_json({'models': [{'name': self.model, 'model': self.model}]})
+        else:
+            self.send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        payload = self.read_json()
+        if self.path == '/api/generate':
+            self.generate(payload)
+        elif self.path == '/api/embed':
+            inputs = payload.get('input', [])
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            self.wait(0.1)
+            self.send_json({'model': payload.get('model'), 'embeddings': [fake_embedding(text) for text in inputs]})
+        elif self.path == '/api/embeddings':
+            self.wait(0.1)
+            self.send_json({'embedding': fake_embedding(payload.get('prompt', ''))})
+        else:
+            self.send_json({'error': 'not found'}, 404)
+
+    def generate(self, payload):
+        model = payload.get('model', self.model)
+        # A request without a prompt only loads the model
+        response = json.dumps(CANNED_FIELDS) if payload.get('prompt') else ""
+        if response:
+            self.wait()
+        final = {
+            'model': model, 'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ'), 'response': "",
+            'done': True, 'done_reason': 'stop', 'total_duration': 0, 'eval_count': len(response),
+        }
+        if payload.get('stream', True) is False:
+            final['response'] = response
+            self.send_json(final)
+            return
+        self.start_stream('application/x-ndjson')
+        for index in range(0, len(response), 16):
+            chunk = {'model': model, 'created_at': final['created_at'], 'response': response[index:index + 16], 'done': False}
+            self.write_chunk(json.dumps(chunk).encode() + b"\n")
+        self.write_chunk(json.dumps(final).encode() + b"\n")
+        self.end_stream()
+
+def chat_completion_body(model):
+    """A canned, non-streamed chat completion."""
+    content = json.dumps(CANNED_OPENAI_ORDER)
+    return {
+        'id': f"chatcmpl-mock{random.randint(0, 10 ** 9)}", 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': 1000, 'completion_tokens': len(content) // 4, 'total_tokens': 1000 + len(content) // 4},
+    }
+
+class OpenAIHandler(MockHandler):
+    """Emulates /v1/models, /v1/chat/completions (with and without streaming), /v1/files and /v1/batches.
+
+    Batches move from 'validating' to 'completed' once the latency has passed,
+    with one canned chat completion per input line.
+    """
+
+    # Uploaded files and batches, one store per MockServer
+    store = None
+    # Chat completions allowed per minute before answering 429, None for no limit
+    rpm_limit = None
+
+    def rate_limit(self):
+        """
+        Count a chat completion against rpm_limit.
+
+        Returns:
+            tuple: The x-ratelimit headers, and the seconds until a slot frees
+            up if the request is over the limit, else None
+        """
+        if self.rpm_limit is None:
+            return {}, None
+        with self.store['lock']:
+            window = self.store['requests']
+            now = time.monotonic()
+            while window and now - window[0] >= 60:
+                window.popleft()
+            retry_after = 60 - (now - window[0]) if len(window) >= self.rpm_limit else None
+            if retry_after is None:
+                window.append(now)
+            headers = {
+                'x-ratelimit-limit-requests': str(self.rpm_limit),
+                'x-ratelimit-remaining-requests': str(self.rpm_limit - len(window)),
+                'x-ratelimit-reset-requests': f"{60 - (now - window[0]):.3f}s",
+            }
+        return headers, retry_after
+
+    def do_GET(self):
+        path = self.path.rstrip('/')
+        parts = path.split('/')
+        if path == '/v1/models':
+            self.send_json({'object': 'list', 'data': [{'id': 'gpt-4o', 'object': 'model', 'created': 0, 'owned_by': 'mock'}]})
+        elif len(parts) == 5 and parts[2] == 'files' and parts[4] == 'content' and parts[3] in self.store['files']:
+            self.send_content(self.store['files'][parts[3]]['content'])
+        elif len(parts) == 4 and parts[2] == 'files' and parts[3] in self.store['files']:
+            self.send_json(self.store['files'][parts[3]]['object'])
+        elif len(parts) == 4 and parts[2] == 'batches' and parts[3] in self.store['batches']:
+            self.send_json(self.advance_batch(parts[3]))
+        else:
+            self.send_json({'error': {'message': 'not found'}}, 404)
+
+    def do_POST(self):
+        path = self.path.rstrip('/')
+        if path == '/v1/files':
+            self.upload_file()
+            return
+        payload = self.read_json()
+        if path == '/v1/chat/completions':
+            self.chat_completion(payload)
+        elif path == '/v1/batches':
+            self.create_batch(payload)
+        else:
+            self.send_json({'error': {'message': 'not found'}}, 404)
+
+    def send_content(self, content):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def add_file(self, filename, purpose, content):
+        file_id = f"file-mock{len(self.store['files']) + 1}"
+        self.store['files'][file_id] = {
+            'content': content,
+            'object': {
+                'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+                'filename': filename, 'purpose': purpose, 'status': 'processed',
+            },
+        }
+        return self.store['files'][file_id]['object']
+
+    def upload_file(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        header = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode()
+        message = email.message_from_bytes(header + self.rfile.read(length), policy=email.policy.HTTP)
+        fields = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            fields[name] = (part.get_filename(), part.get_payload(decode=True))
+        filename, content = fields.get('file', ('upload.jsonl', b''))
+        purpose = (fields.get('purpose') or (None, b'batch'))[1].decode()
+        self.send_json(self.add_file(filename, purpose, content))
+
+    def create_batch(self, payload):
+        input_file = self.store['files'].get(payload.get('input_file_id'))
+        if input_file is None:
+            self.send_json({'error': {'message': 'input file not found'}}, 400)
+            return
+        batch_id = f"batch_mock{len(self.store['batches']) + 1}"
+        batch = {
+            'id': batch_id, 'object': 'batch', 'endpoint': payload.get('endpoint'),
+            'input_file_id': payload['input_file_id'], 'completion_window': payload.get('completion_window', '24h'),
+            'status': 'validating', 'created_at': int(time.time()), 'output_file_id': None, 'error_file_id': None,
+            'metadata': payload.get('metadata'),
+            'request_counts': {'total': len(input_file['content'].splitlines()), 'completed': 0, 'failed': 0},
+        }
+        self.store['batches'][batch_id] = {'object': batch, 'started': time.monotonic()}
+        self.send_json(batch)
+
+    def advance_batch(self, batch_id):
+        entry = self.store['batches'][batch_id]
+        batch = entry['object']
+        if batch['status'] == 'completed':
+            return batch
+        if time.monotonic() - entry['started'] < self.latency:
+            batch['status'] = 'in_progress'
+            return batch
+        output_lines = []
+        for line in self.store['files'][batch['input_file_id']]['content'].splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            output_lines.append(json.dumps({
+                'id': f"batch_req_mock{len(output_lines) + 1}", 'custom_id': request['custom_id'],
+                'response': {'status_code': 200, 'request_id': 'mock', 'body': chat_completion_body(request['body'].get('model', 'gpt-4o'))},
+                'error': None,
+            }))
+        output = self.add_file(f"{batch_id}_output.jsonl", 'batch_output', ("\n".join(output_lines) + "\n").encode())
+        batch.update(status='completed', output_file_id=output['id'], completed_at=int(time.time()))
+        batch['request_counts'].update(completed=len(output_lines))
+        return batch
+
+    def chat_completion(self, payload):
+        headers, retry_after = self.rate_limit()
+        if retry_after is not None:
+            headers['retry-after'] = f"{retry_after:.3f}"
+            error = {'message': 'Rate limit reached for requests', 'type': 'requests', 'code': 'rate_limit_exceeded'}
+            self.send_json({'error': error}, 429, headers)
+            return
+        content = json.dumps(CANNED_OPENAI_ORDER)
+        completion_id = f"chatcmpl-mock{random.randint(0, 10 ** 9)}"
+        model = payload.get('model', 'gpt-4o')
+        if not payload.get('stream'):
+            self.wait()
+            self.send_json(chat_completion_body(model), headers=headers)
+            return
+        # Spread the latency over the streamed chunks like a model generating tokens
+        pieces = [content[index:index + 8] for index in range(0, len(content), 8)]
+        self.start_stream('text/event-stream', headers)
+        for piece in pieces:
+            self.wait(1 / len(pieces))
+            chunk = {
+                'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}],
+            }
+            self.write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+        done = {
+            'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+            'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}],
+        }
+        self.write_chunk(f"data: {json.dumps(done)}\n\n".encode())
+        self.write_chunk(b"data: [DONE]\n\n")
+        self.end_stream()
+
+class _Server(ThreadingHTTPServer):
+    # Load tests open hundreds of connections at once
+    request_queue_size = 1024
+
+class MockServer:
+    """Run a mock handler on a local port in a background thread."""
+
+    def __init__(self, handler, port=0, latency=0.0, jitter=0.0, **attributes):
+        handler_class = type(handler.__name__, (handler,), {
+            'latency': latency, 'jitter': jitter,
+            'store': {'files': {}, 'batches': {}, 'requests': deque(), 'lock': threading.Lock()},
+            **attributes,
+        })
+        self.server = _Server(('127.0.0.1', port), handler_class)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ollama-port', type=int, default=11435)
+    parser.add_argument('--openai-port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.5, help="Seconds per generate/chat call")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Random extra seconds per call")
+    parser.add_argument('--rpm-limit', type=int, help="Chat completions per minute before the mock OpenAI answers 429")
+    args = parser.parse_args()
+
+    with MockServer(OllamaHandler, args.ollama_port, args.latency, args.jitter) as ollama, \
+            MockServer(OpenAIHandler, args.openai_port, args.latency, args.jitter, rpm_limit=args.rpm_limit) as openai:
+        print(f"Mock Ollama at {ollama.url}, mock OpenAI at {openai.url}/v1 (Ctrl+C to stop)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    main()
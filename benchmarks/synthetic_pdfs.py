@@ -0,0 +1,104 @@
+"""
+Synthetic purchase order PDFs for the benchmarks.
+"""
+import random
+import fitz
+
+LOREM = (
+    "The seller shall deliver the goods in accordance with the terms and conditions of this "
+    "purchase order. Any deviation requires the prior written consent of the buyer. "
+)
+
+MONTHS = ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"]
+
+def _render(header_lines, pages):
+    """Render the header lines on the first page and T&C text on the others."""
+    document = fitz.open()
+    page = document.new_page()
+    y = 72
+    for text in header_lines:
+        page.insert_text((36, y), text, fontsize=9)
+        y += 14
+    for _ in range(pages - 1):
+        page = document.new_page()
+        page.insert_textbox(fitz.Rect(36, 36, 576, 756), "TERMS AND CONDITIONS\n" + LOREM * 40, fontsize=8)
+    return document.tobytes()
+
+def make_po_pdf(pages=3, lines=5, seed=0):
+    """Build a purchase order PDF with a header, a line item table and T&C pages."""
+    rng = random.Random(seed)
+    header = [
+        f"PURCHASE ORDER    PO Number: {rng.randint(1000000, 9999999)}",
+        f"PO Date: {rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/2025",
+        "SHIP TO: MAGA1 Distribution Center, 100 Industrial Way, Houston, TX 77001",
+        "Vendor: Example Resins Inc., PO Box 42, Pittsfield, MA 01201",
+        "",
+        "Item   Material No.   Description            Quantity        Delivery Date",
+    ]
+    for line_num in range(1, lines + 1):
+        header.append(
+            f"{line_num * 10:<6} {rng.randint(100000, 999999):<14} Polymer resin grade {line_num:<3} "
+            f"{rng.randint(1, 40):,},{rng.randint(0, 999):03d}.000 KG   "
+            f"{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/2025"
+        )
+    return _render(header, pages)
+
+def make_customer_po_pdf(customer, pages=3, seed=0):
+    """
+    Build a purchase order PDF in a customer's layout.
+    
+    Args:
+        customer: The customer code, e.g. 'B' or 'DEFAULT'
+        pages: The number of pages, the pages after the first hold T&C text
+        seed: The random seed of the field values
+        
+    Returns:
+        tuple: The PDF bytes and the canonical field values written into it
+    """
+    rng = random.Random(f"{customer}:{seed}")
+    month, day = rng.randint(1, 12), rng.randint(1, 28)
+    quantity = rng.randint(1, 40) * 1000
+    material = str(rng.randint(100000, 999999))
+    address = "MAGA1 Distribution Center, 100 Industrial Way, Houston, TX 77001"
+    po_number = str(rng.randint(1000000, 9999999))
+    us_date = f"{month:02d}/{day:02d}/2025"
+
+    customer = customer.upper()
+    if customer == 'B':
+        header = [
+            f"PO Number {po_number}", f"PROMISED  DELIVERY {us_date}",
+            f"ITEM NUMBER {material}", f"QUANTITY {quantity:,} KG", f"SHIP TO {address}",
+        ]
+    elif customer == 'BA':
+        header = [
+            f"Order No {po_number}", f"Delivery Date {us_date}", f"Material No. {material}",
+            f"Quantity {quantity:,} KG", f"Delivery Address {address}",
+        ]
+    elif customer == 'COM':
+        po_number = "8" + po_number
+        material = f"{material}-1"
+        header = [
+            f"Purchase Order {po_number}", f"PO Date 01/{MONTHS[0]}/2025",
+            f"Material: {material}", f"Order Qty {quantity:,}.000 KG",
+            f"Delivery date: {day:02d}/{MONTHS[month - 1]}/2025", f"Ship To {address}",
+        ]
+    elif customer == 'G':
+        header = [
+            f"Document Number {po_number}", f"Delivery Date {us_date}",
+            f"Description {material}", f"Quantity {quantity:,} KG", f"Shipping Address {address}",
+        ]
+    else:
+        header = [
+            "PURCHASE ORDER", f"Purchase Order Number: {po_number}", f"Required Delivery Date: {us_date}",
+            f"Material Number: {material}", f"Order Qty: {quantity:,}.000 KG", f"SHIP TO: {address}",
+            "Vendor: Example Resins Inc., PO Box 42, Pittsfield, MA 01201",
+        ]
+
+    expected = {
+        "Purchase Order Number": po_number,
+        "Quantity": f"{quantity} KG",
+        "Required Delivery Date": us_date,
+        "Material Number": material,
+        "Deliver to": address,
+    }
+    return _render(header, pages), expected
@@ -0,0 +1,211 @@
+"""
+Cascade extraction: the local Ollama pipeline first, gpt-4o only for the
+documents whose local result fails validation.
+"""
+import json
+import logging
+import os
+import statistics
+import threading
+import time
+from collections import Counter, deque
+from werkzeug.utils import secure_filename
+import metrics
+from llm_processing import single_pass_prompt, canonical_fields
+from model_clients import client_manager
+from openai_scheduler import openai_scheduler
+from po_processor import parse_purchase_order, select_model_input, extract_fields, finish_purchase_order, unresolved_fields
+from prompt_assembly import token_budget, truncate_to_tokens
+from result_cache import result_cache, make_key, prompt_version
+from single_flight import single_flight
+from validation import failed_fields
+
+logger = logging.getLogger(__name__)
+
+# Model the documents failing validation are escalated to
+CASCADE_OPENAI_MODEL = os.environ.get('CASCADE_OPENAI_MODEL', 'gpt-4o')
+# Latency samples kept per tier for the percentiles in the stats
+CASCADE_LATENCY_SAMPLES = int(os.environ.get('CASCADE_LATENCY_SAMPLES', 1000))
+
+LOCAL = 'local'
+OPENAI = 'openai'
+TIERS = (LOCAL, OPENAI)
+
+ESCALATION_OPTIONS = {
+    "temperature": 0,
+    "response_format": {"type": "json_object"},
+}
+
+def extract_fields_openai(text, customer_module):
+    """Extract the canonical fields with one JSON call to the escalation model, using the customer's prompt."""
+    openai_client = client_manager.get_openai_client()
+    if openai_client is None:
+        raise RuntimeError("OPENAI_API_KEY not found in .env file")
+    prompt = single_pass_prompt(
+        text,
+        customer_module.extract_prompt,
+        customer_module.field_map,
+        getattr(customer_module, 'single_pass_instructions', ""),
+    )
+    response = openai_scheduler.create_chat_completion(
+        openai_client, model=CASCADE_OPENAI_MODEL, messages=[{"role": "user", "content": prompt}], **ESCALATION_OPTIONS
+    )
+    return canonical_fields(json.loads(response.choices[0].message.content), customer_module.field_map)
+
+class CascadeStats:
+    """Per-tier attempts, acceptance, failed checks and latency of the cascade."""
+
+    def __init__(self, samples=CASCADE_LATENCY_SAMPLES):
+        self._lock = threading.Lock()
+        self.documents = 0
+        self.tiers = {
+            tier: {'attempts': 0, 'accepted': 0, 'errors': 0, 'failed_checks': Counter(), 'latencies': deque(maxlen=samples)}
+            for tier in TIERS
+        }
+
+    def record_document(self):
+        with self._lock:
+            self.documents += 1
+
+    def record(self, tier, seconds, failures=None, error=False):
+        outcome = 'error' if error else 'rejected' if failures else 'accepted'
+        metrics.CASCADE_RESULTS.inc(tier=tier, outcome=outcome)
+        for check in failures or ():
+            metrics.CASCADE_FAILED_CHECKS.inc(tier=tier, check=check)
+        with self._lock:
+            stats = self.tiers[tier]
+            stats['attempts'] += 1
+            stats['latencies'].append(seconds * 1000)
+            if error:
+                stats['errors'] += 1
+            elif not failures:
+                stats['accepted'] += 1
+            stats['failed_checks'].update(failures or ())
+
+    def snapshot(self):
+        """Return the share of documents each tier settled and its latency percentiles."""
+        with self._lock:
+            tiers = {}
+            for tier, stats in self.tiers.items():
+                latencies = sorted(stats['latencies'])
+                tiers[tier] = {
+                    'attempts': stats['attempts'],
+                    'accepted': stats['accepted'],
+                    'errors': stats['errors'],
+                    'acceptance_rate': stats['accepted'] / stats['attempts'] if stats['attempts'] else 0.0,
+                    'hit_rate': stats['accepted'] / self.documents if self.documents else 0.0,
+                    'failed_checks': dict(stats['failed_checks']),
+                    'mean_ms': round(statistics.mean(latencies), 2) if latencies else None,
+                    'p50_ms': round(latencies[len(latencies) // 2], 2) if latencies else None,
+                    'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2) if latencies else None,
+                }
+            escalated = self.tiers[OPENAI]['attempts']
+            return {
+                'documents': self.documents,
+                'escalation_rate': escalated / self.documents if self.documents else 0.0,
+                'tiers': tiers,
+            }
+
+cascade_stats = CascadeStats()
+
+def _run_tier(tier, extract, rule_info, customer_module, filename, raw_text=None):
+    """Run one tier and validate its result, returning the final info (None on error) and the failed fields."""
+    start = time.perf_counter()
+    try:
+        refined_info_dict = extract()
+    except Exception as e:
+        seconds = time.perf_counter() - start
+        logger.warning("Cascade tier %s failed for %s: %s", tier, filename, e)
+        metrics.observe_stage(f"cascade_{tier}", seconds, error=True)
+        cascade_stats.record(tier, seconds, error=True)
+        return None, [f"{tier}_error"]
+
+    refined_info_dict.update(rule_info)
+    # The ship-to check compares against the address the repair produced, if Deliver to was repaired
+    extracted = {}
+    final_info = finish_purchase_order(refined_info_dict, customer_module, filename, raw_text, extracted)
+    failures = failed_fields(final_info, customer_module, extracted)
+    seconds = time.perf_counter() - start
+    metrics.observe_stage(f"cascade_{tier}", seconds)
+    cascade_stats.record(tier, seconds, failures)
+    return final_info, failures
+
+def cascade_purchase_order(pdf_bytes, customer_module, upload_folder, filename):
+    """
+    Extract a purchase order with the local pipeline, and again with the
+    escalation model if the local result fails validation.
+
+    Args:
+        pdf_bytes: The PDF file content
+        customer_module: The customer module to use for processing
+        upload_folder: The folder to spool large files to
+        filename: The uploaded file name, for logging
+
+    Returns:
+        dict: The extracted and processed information of the first tier that
+        passed validation, else of the escalation model, else the local one
+    """
+    cascade_stats.record_document()
+    parsed = parse_purchase_order(pdf_bytes, customer_module, upload_folder)
+    rule_info, relevant_text = select_model_input(parsed, customer_module, filename)
+
+    def extract_local():
+        if relevant_text is None:
+            return {}
+        return extract_fields(relevant_text, customer_module, fields=unresolved_fields(rule_info))
+
+    # Local fields failing validation are repaired first, a repair is cheaper than an escalation
+    local_info, failures = _run_tier(LOCAL, extract_local, rule_info, customer_module, filename, parsed['raw_text'])
+    if local_info is not None and not failures:
+        metrics.annotate(cascade_tier=LOCAL)
+        return local_info
+
+    # The escalation model reads all selected pages, not only the retrieved chunks the local model missed on
+    def extract_openai():
+        text = truncate_to_tokens(parsed['raw_text'], token_budget(customer_module))
+        return extract_fields_openai(text, customer_module)
+
+    logger.info("Escalating %s to %s, local checks failed: %s", filename, CASCADE_OPENAI_MODEL, failures)
+    openai_info, openai_failures = _run_tier(OPENAI, extract_openai, rule_info, customer_module, filename)
+    metrics.annotate(cascade_tier=OPENAI, cascade_local_failures=failures, cascade_openai_failures=openai_failures)
+    if openai_info is not None and (not openai_failures or local_info is None or len(openai_failures) <= len(failures)):
+        return openai_info
+    if local_info is None:
+        raise RuntimeError(f"Cascade extraction failed: {failures + openai_failures}")
+    return local_info
+
+def cascade_cache_key(pdf_bytes, customer_module):
+    """Build the result cache key of a PDF processed for a customer in cascade mode."""
+    customer_code = customer_module.__name__.split('_')[-1]
+    return make_key(pdf_bytes, f"{customer_code}:cascade:{CASCADE_OPENAI_MODEL}", prompt_version(customer_module))
+
+def process_cascade_purchase_order_bytes(pdf_bytes, filename, customer_module, upload_folder):
+    """
+    Process the content of a purchase order PDF file in cascade mode.
+
+    Args:
+        pdf_bytes: The PDF file content
+        filename: The uploaded file name
+        customer_module: The customer module to use for processing
+        upload_folder: The folder to spool large files to
+
+    Returns:
+        dict: The extracted and processed information
+    """
+    filename = secure_filename(filename)
+    cache_key = cascade_cache_key(pdf_bytes, customer_module)
+    cached_info = result_cache.get(cache_key)
+    metrics.annotate(cache_hit=cached_info is not None)
+    if cached_info is not None:
+        return cached_info
+
+    def run():
+        final_info = cascade_purchase_order(pdf_bytes, customer_module, upload_folder, filename)
+        result_cache.set(cache_key, final_info)
+        return final_info
+
+    return single_flight.do(cache_key, run)
+
+def process_cascade_purchase_order_file(file, customer_module, upload_folder):
+    """Process an uploaded purchase order PDF file in cascade mode."""
+    return process_cascade_purchase_order_bytes(file.read(), file.filename, customer_module, upload_folder)
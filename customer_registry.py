@@ -0,0 +1,209 @@
+import importlib
+import importlib.util
+import json
+import logging
+import os
+import re
+import string
+import sys
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from extraction_rules import FieldRule, RULE_TRANSFORMS
+from result_cache import prompt_version
+from utils import CANONICAL_FIELDS
+
+logger = logging.getLogger(__name__)
+
+# Directory of data-driven customers, one <CODE>.json file per customer
+CUSTOMER_CONFIG_DIR = os.environ.get('CUSTOMER_CONFIG_DIR', 'customers')
+# Customers kept loaded, the least recently used are dropped past this
+CUSTOMER_CACHE_SIZE = int(os.environ.get('CUSTOMER_CACHE_SIZE', 256))
+# Seconds before a loaded customer's definition is checked for changes again
+CUSTOMER_RELOAD_INTERVAL = float(os.environ.get('CUSTOMER_RELOAD_INTERVAL', 2))
+
+# Customers implemented as Python modules: code -> (module name, label)
+# ===== DEFAULT CUSTOMER HANDLING =====
+# standard_via_openai.py is used as the DEFAULT customer module (Customer_Default)
+# Note: There is no actual Customer_Default.py file - we're using standard_via_openai.py instead
+BUILTIN_CUSTOMERS = {
+    'C': ('Customer_C', 'Customer C'),
+    'N': ('Customer_N', 'Customer N'),
+    'B': ('Customer_B', 'Customer B'),
+    'G': ('Customer_G', 'Customer G'),
+    'BA': ('Customer_BA', 'Customer BA'),
+    'COM': ('Customer_COM', 'Customer COM'),
+    'DEFAULT': ('standard_via_openai', 'Customer Default'),
+}
+
+# Customer codes end up in module names and file names
+CUSTOMER_CODE_PATTERN = re.compile(r'^[A-Z0-9]+$')
+
+class PromptTemplate:
+    """A customer prompt compiled from a str.format template with a single placeholder."""
+
+    def __init__(self, template, placeholder):
+        fields = {name for _, name, _, _ in string.Formatter().parse(template) if name is not None}
+        if fields != {placeholder}:
+            raise ValueError(f"Prompt template must use exactly the {{{placeholder}}} placeholder, found {sorted(fields)}")
+        self.template = template
+        self.placeholder = placeholder
+
+    def __call__(self, value):
+        return self.template.format(**{self.placeholder: value})
+
+    def __repr__(self):
+        # result_cache.prompt_version hashes the repr, so editing a template invalidates cached results
+        return f"PromptTemplate({self.template!r})"
+
+@lru_cache(maxsize=CUSTOMER_CACHE_SIZE * 2)
+def compile_template(template, placeholder):
+    """Compile a prompt template, customers sharing a template share the compiled one."""
+    return PromptTemplate(template, placeholder)
+
+class CustomerConfig:
+    """A customer defined by a JSON file, with the same attributes as a Customer_*.py module."""
+
+    def __init__(self, code, definition):
+        # po_processor derives the customer code from the module name
+        self.__name__ = f"Customer_{code}"
+        self.code = code
+        self.label = definition.get('label', f"Customer {code}")
+        self.sold_to_info = definition.get('sold_to_info', {})
+        self.ship_to_info = definition.get('ship_to_info', {})
+        self.field_map = definition.get('field_map', {field: field for field in CANONICAL_FIELDS})
+        self.extract_prompt = compile_template(definition['extract_prompt'], 'retrieved_text')
+        self.refine_prompt = compile_template(definition['refine_prompt'], 'extracted_info')
+        self.single_pass = definition.get('single_pass', False)
+        self.single_pass_instructions = definition.get('single_pass_instructions', "")
+        self.extract_rules = {
+            field: FieldRule(
+                rule['pattern'],
+                confidence=rule.get('confidence', 0.95),
+                group=rule.get('group', 1),
+                transform=RULE_TRANSFORMS[rule['transform']] if rule.get('transform') else None,
+            )
+            for field, rule in definition.get('extract_rules', {}).items()
+        }
+        self.page_selection = definition.get('page_selection')
+        self.retrieval_strategy = definition.get('retrieval_strategy')
+        self.prompt_token_budget = definition.get('prompt_token_budget')
+
+    def __repr__(self):
+        return f"CustomerConfig({self.code!r})"
+
+class CustomerRegistry:
+    """Customers loaded on first request from CUSTOMER_CONFIG_DIR or the built-in modules.
+
+    A <CODE>.json file takes precedence over a built-in module with the same
+    code. Loaded customers are kept in an LRU and their file is checked for
+    changes at most every reload_interval seconds. A changed definition is
+    loaded again without a restart. If the new definition is broken, the
+    previous one keeps serving.
+    """
+
+    def __init__(self, config_dir=CUSTOMER_CONFIG_DIR, builtins=BUILTIN_CUSTOMERS,
+                 cache_size=CUSTOMER_CACHE_SIZE, reload_interval=CUSTOMER_RELOAD_INTERVAL):
+        self.config_dir = config_dir
+        self.builtins = builtins
+        self.cache_size = cache_size
+        self.reload_interval = reload_interval
+        self._customers = OrderedDict()
+        self._labels = {}
+        self._lock = threading.RLock()
+
+    def _source(self, code):
+        """Return the kind and file path of a customer's definition, or None for unknown codes."""
+        path = os.path.join(self.config_dir, f"{code}.json")
+        if os.path.isfile(path):
+            return 'config', path
+        if code in self.builtins:
+            spec = importlib.util.find_spec(self.builtins[code][0])
+            if spec is not None and spec.origin:
+                return 'module', spec.origin
+        return None
+
+    def _load(self, code, source, reload):
+        kind, path = source
+        if reload:
+            # Ship-to indexes are keyed by their dictionary, which a reload may have edited in place
+            ship_to_index = sys.modules.get('ship_to_index')
+            if ship_to_index is not None:
+                ship_to_index.clear_ship_to_indexes()
+        if kind == 'config':
+            with open(path, 'r') as f:
+                return CustomerConfig(code, json.load(f))
+        module = importlib.import_module(self.builtins[code][0])
+        if reload:
+            module = importlib.reload(module)
+            # The module object is the same, its cached prompt version is stale
+            prompt_version.cache_clear()
+        return module
+
+    def get(self, customer_code):
+        """Return the customer module or config of a code, or None if there is no such customer."""
+        code = customer_code.upper()
+        if not CUSTOMER_CODE_PATTERN.match(code):
+            return None
+
+        with self._lock:
+            entry = self._customers.get(code)
+            now = time.monotonic()
+            if entry is not None and now - entry['checked_at'] < self.reload_interval:
+                self._customers.move_to_end(code)
+                return entry['customer']
+
+            source = self._source(code)
+            if source is None:
+                self._customers.pop(code, None)
+                return None
+            mtime = os.path.getmtime(source[1])
+            if entry is not None and entry['source'] == source and entry['mtime'] == mtime:
+                entry['checked_at'] = now
+                self._customers.move_to_end(code)
+                return entry['customer']
+
+            try:
+                customer = self._load(code, source, reload=entry is not None and entry['source'] == source)
+            except Exception as e:
+                logger.error("Could not load customer %s from %s: %s", code, source[1], e)
+                if entry is None:
+                    return None
+                # Keep serving the last good definition, retry after the reload interval
+                entry['checked_at'] = now
+                return entry['customer']
+
+            self._customers[code] = {'customer': customer, 'source': source, 'mtime': mtime, 'checked_at': now}
+            self._customers.move_to_end(code)
+            while len(self._customers) > self.cache_size:
+                self._customers.popitem(last=False)
+            return customer
+
+    def _config_label(self, path):
+        """Read a config file's label, only when the file changed since the last listing."""
+        mtime = os.path.getmtime(path)
+        cached = self._labels.get(path)
+        if cached is None or cached[0] != mtime:
+            try:
+                with open(path, 'r') as f:
+                    label = json.load(f).get('label')
+            except (OSError, ValueError) as e:
+                logger.error("Could not read customer config %s: %s", path, e)
+                label = None
+            cached = self._labels[path] = (mtime, label)
+        return cached[1]
+
+    def list_customers(self):
+        """Return the value and label of every customer, built-ins first."""
+        with self._lock:
+            labels = {code: label for code, (_, label) in self.builtins.items()}
+            if os.path.isdir(self.config_dir):
+                for filename in sorted(os.listdir(self.config_dir)):
+                    code, extension = os.path.splitext(filename)
+                    if extension != '.json' or not CUSTOMER_CODE_PATTERN.match(code):
+                        continue
+                    labels[code] = self._config_label(os.path.join(self.config_dir, filename)) or f"Customer {code}"
+            return [{'value': code, 'label': label} for code, label in labels.items()]
+
+registry = CustomerRegistry()
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Without file locks (Windows), give each process its own EMBEDDING_CACHE_DIR
+    fcntl = None
+
+EMBEDDING_CACHE_DIR = os.environ.get('EMBEDDING_CACHE_DIR', os.path.join('cache', 'embeddings'))
+EMBEDDING_CACHE_ENABLED = os.environ.get('EMBEDDING_CACHE_ENABLED', '1').lower() not in ('0', 'false', 'no')
+
+class EmbeddingCache:
+    """Persistent chunk embedding cache for one embedding model.
+
+    Vectors are appended to a float32 file that is read through a memory map,
+    and an append-only index file holds one chunk hash per vector row.
+    """
+
+    def __init__(self, model, cache_dir=EMBEDDING_CACHE_DIR):
+        self.model = model
+        self.directory = os.path.join(cache_dir, re.sub(r'[^A-Za-z0-9_.-]', '_', model))
+        self.vectors_path = os.path.join(self.directory, 'vectors.f32')
+        self.index_path = os.path.join(self.directory, 'index.txt')
+        self.meta_path = os.path.join(self.directory, 'meta.json')
+        self.lock_path = os.path.join(self.directory, 'lock')
+        self.dim = None
+        self.hits = 0
+        self.misses = 0
+        self._rows = {}
+        # Index lines read so far, and their length in bytes
+        self._row_count = 0
+        self._index_offset = 0
+        self._vectors = None
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path, 'r') as f:
+            self.dim = json.load(f)['dim']
+        self._refresh()
+
+    def _refresh(self):
+        """Index the rows appended since the last read, by this or another process."""
+        if self.dim is None:
+            if not os.path.exists(self.meta_path):
+                return
+            with open(self.meta_path, 'r') as f:
+                self.dim = json.load(f)['dim']
+        if not os.path.exists(self.index_path):
+            return
+        # Ignore index entries whose vector was not fully written
+        stored_rows = os.path.getsize(self.vectors_path) // (self.dim * 4) if os.path.exists(self.vectors_path) else 0
+        with open(self.index_path, 'rb') as f:
+            f.seek(self._index_offset)
+            data = f.read()
+        for line in data.splitlines(keepends=True):
+            if self._row_count >= stored_rows or not line.endswith(b"\n"):
+                break
+            # Rows are positional, a key is served from its first row
+            self._rows.setdefault(line.decode().strip(), self._row_count)
+            self._row_count += 1
+            self._index_offset += len(line)
+        self._map()
+
+    def _map(self):
+        """Memory-map the vector file, remapping after it grew."""
+        if self._row_count and (self._vectors is None or len(self._vectors) != self._row_count):
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(self._row_count, self.dim))
+
+    @contextmanager
+    def _file_lock(self):
+        """Hold the directory's lock file, so processes sharing the cache append one at a time."""
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def key(self, text):
+        """Hash a chunk together with the embedding model name."""
+        return hashlib.sha256(f"{self.model}\0{text}".encode()).hexdigest()
+
+    def _append(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._file_lock():
+            # Another process may have appended since the last read, the new rows go after its rows
+            self._refresh()
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                # Written under a temporary name, so readers never see a partial file
+                with open(self.meta_path + '.tmp', 'w') as f:
+                    json.dump({'model': self.model, 'dim': self.dim}, f)
+                os.replace(self.meta_path + '.tmp', self.meta_path)
+            new = [index for index, key in enumerate(keys) if key not in self._rows]
+            if not new:
+                return
+            # Rows are only indexed once their vectors are on disk
+            with open(self.vectors_path, 'r+b' if os.path.exists(self.vectors_path) else 'wb') as f:
+                f.seek(self._row_count * self.dim * 4)
+                f.write(vectors[new].tobytes())
+                f.truncate()
+            with open(self.index_path, 'ab') as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() != self._index_offset:
+                    # Drop index entries left by a writer that died before its vectors were written
+                    f.truncate(self._index_offset)
+                f.write(''.join(f"{keys[index]}\n" for index in new).encode())
+            self._refresh()
+
+    def embed_documents(self, texts, embeddings):
+        """
+        Return the embedding of each text, calling the model only for unseen texts.
+        
+        The model is called without holding the lock, so cache hits and other
+        requests are not held up by a model round trip.
+        
+        Args:
+            texts: The chunks to embed
+            embeddings: The embedding client used for cache misses
+            
+        Returns:
+            list: One vector per text, in the same order
+        """
+        keys = [self.key(text) for text in texts]
+        with self._lock:
+            self._refresh()
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in self._rows and key not in missing:
+                    missing[key] = text
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+
+        new_vectors = {}
+        if missing:
+            vectors = np.asarray(embeddings.embed_documents(list(missing.values())), dtype=np.float32)
+            new_vectors = dict(zip(missing, vectors))
+            with self._lock:
+                self._append(list(missing), vectors)
+
+        with self._lock:
+            return [
+                new_vectors[key].tolist() if key in new_vectors else self._vectors[self._rows[key]].tolist()
+                for key in keys
+            ]
+
+    def stats(self):
+        with self._lock:
+            return {'model': self.model, 'entries': len(self._rows), 'dim': self.dim, 'hits': self.hits, 'misses': self.misses}
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_embedding_cache(model):
+    """Return the process-wide embedding cache for a model."""
+    with _caches_lock:
+        if model not in _caches:
+            _caches[model] = EmbeddingCache(model)
+        return _caches[model]
@@ -0,0 +1,97 @@
+import os
+import re
+from datetime import datetime
+from utils import SHIP_TO_INDEX_MIN_ENTRIES
+
+# Rule results at or above this confidence are used without asking the LLM
+RULE_CONFIDENCE_THRESHOLD = float(os.environ.get('RULE_CONFIDENCE_THRESHOLD', 0.9))
+
+class FieldRule:
+    """Compiled pattern that extracts one canonical field from the PDF text."""
+
+    def __init__(self, pattern, confidence=0.95, group=1, transform=None, flags=re.IGNORECASE):
+        self.regex = re.compile(pattern, flags)
+        self.confidence = confidence
+        self.group = group
+        self.transform = transform
+
+    def apply(self, text):
+        """Return the extracted value and its confidence, or (None, 0.0) when nothing matches."""
+        values = []
+        for match in self.regex.finditer(text):
+            value = " ".join(match.group(self.group).split())
+            if self.transform:
+                value = self.transform(value)
+            if value:
+                values.append(value)
+        if not values:
+            return None, 0.0
+        # Different values for the same field mean the pattern is ambiguous on this document
+        confidence = self.confidence if len(set(values)) == 1 else self.confidence / 2
+        return values[0], confidence
+
+    def __repr__(self):
+        transform = getattr(self.transform, '__name__', None)
+        return f"FieldRule({self.regex.pattern!r}, confidence={self.confidence}, group={self.group}, transform={transform})"
+
+def day_month_year_to_us(value):
+    """Convert a date like 15/MAR/2025 or 15/March/2025 to MM/DD/YYYY."""
+    for date_format in ("%d/%b/%Y", "%d/%B/%Y"):
+        try:
+            return datetime.strptime(value, date_format).strftime("%m/%d/%Y")
+        except ValueError:
+            pass
+    return None
+
+def pounds_to_lb(value):
+    """Use LB as the unit for quantities given in Pound(s)."""
+    return re.sub(r'\s*pound\(s\)|\s*pounds?', ' LB', value, flags=re.IGNORECASE)
+
+# Transforms a rule defined in a customer config file can name
+RULE_TRANSFORMS = {
+    'day_month_year_to_us': day_month_year_to_us,
+    'pounds_to_lb': pounds_to_lb,
+}
+
+def match_ship_to(text, ship_to_info):
+    """Find a ship-to address from the customer's master data quoted verbatim in the text."""
+    normalized_text = " ".join(text.split()).lower()
+    addresses = ship_to_info.values()
+    if len(ship_to_info) > SHIP_TO_INDEX_MIN_ENTRIES:
+        # Large master data is narrowed to the addresses whose words all occur in the text
+        from ship_to_index import get_ship_to_index
+        addresses = get_ship_to_index(ship_to_info).quoted_candidates(normalized_text)
+    found = {
+        address for address in addresses
+        if re.search(r'(?<!\w)' + re.escape(" ".join(address.split()).lower()) + r'(?!\w)', normalized_text)
+    }
+    if len(found) == 1:
+        return found.pop(), 0.95
+    return None, 0.0
+
+def apply_customer_rules(text, customer_module):
+    """
+    Run a customer's extraction rules over the PDF text.
+    
+    Args:
+        text: The raw PDF text
+        customer_module: The customer module declaring extract_rules
+        
+    Returns:
+        dict: Field name -> {'value': ..., 'confidence': ...} for every field a rule matched
+    """
+    results = {}
+    for field, rule in getattr(customer_module, 'extract_rules', {}).items():
+        value, confidence = rule.apply(text)
+        if value is not None:
+            results[field] = {'value': value, 'confidence': confidence}
+
+    if 'Deliver to' not in results:
+        value, confidence = match_ship_to(text, customer_module.ship_to_info)
+        if value is not None:
+            results['Deliver to'] = {'value': value, 'confidence': confidence}
+    return results
+
+def resolved_fields(rule_results, threshold=RULE_CONFIDENCE_THRESHOLD):
+    """Return the values of the fields the rules resolved with high confidence."""
+    return {field: result['value'] for field, result in rule_results.items() if result['confidence'] >= threshold}
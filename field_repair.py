@@ -0,0 +1,183 @@
+"""
+Field-level repair of a post-processed extraction: every field that fails
+validation is asked for again with a small prompt holding only the text
+around the field's label, instead of reprocessing the whole document.
+"""
+import logging
+import os
+import metrics
+from model_clients import client_manager
+from utils import modify_quantity_and_unit, modify_delivery_date_format, find_best_match
+from validation import field_is_valid, failed_fields
+
+logger = logging.getLogger(__name__)
+
+FIELD_REPAIR_ENABLED = os.environ.get('FIELD_REPAIR_ENABLED', '1').lower() not in ('0', 'false', 'no')
+# Characters of text kept after each occurrence of a field's label, a quarter of that before it
+FIELD_REPAIR_CONTEXT_CHARS = int(os.environ.get('FIELD_REPAIR_CONTEXT_CHARS', 400))
+# Occurrences of a field's labels included in its repair prompt
+FIELD_REPAIR_MAX_MATCHES = int(os.environ.get('FIELD_REPAIR_MAX_MATCHES', 2))
+
+# Labels searched for every customer, after the labels of the customer's field_map
+DEFAULT_LABELS = {
+    "Purchase Order Number": ["Purchase Order", "PO Number", "PO #", "Order No"],
+    "Quantity": ["Quantity", "Qty"],
+    "Required Delivery Date": ["Delivery Date", "Required Date", "Deliver by"],
+    "Material Number": ["Material No", "Material", "Item No"],
+    "Deliver to": ["Deliver to", "Delivery Address", "Ship to"],
+}
+
+# How the model answers for each field, in the format the post-processing expects
+ANSWER_FORMATS = {
+    "Purchase Order Number": "the purchase order number only",
+    "Quantity": "the ordered quantity followed by its unit of measure, KG or LB, e.g. 1000 KG",
+    "Required Delivery Date": "the date in MM/DD/YYYY format",
+    "Material Number": "the material number only",
+    "Deliver to": "the full delivery address on one line, without contact names, phone numbers or emails",
+}
+
+def field_labels(field, customer_module):
+    """Return the customer's labels of a field, then the default ones."""
+    labels = [label for label, canonical in customer_module.field_map.items() if canonical == field]
+    known = {label.lower() for label in labels}
+    return labels + [label for label in DEFAULT_LABELS[field] if label.lower() not in known]
+
+def label_context(text, labels, window=FIELD_REPAIR_CONTEXT_CHARS, max_matches=FIELD_REPAIR_MAX_MATCHES):
+    """
+    Return the text around the first occurrences of the labels.
+
+    Returns:
+        str: The excerpts joined by a separator line, or None if no label occurs in the text
+    """
+    lowered = text.lower()
+    spans = []
+    for label in labels:
+        start = 0
+        while len(spans) < max_matches:
+            index = lowered.find(label.lower(), start)
+            if index < 0:
+                break
+            spans.append((max(0, index - window // 4), min(len(text), index + len(label) + window)))
+            start = index + len(label)
+        if len(spans) >= max_matches:
+            break
+    if not spans:
+        return None
+
+    # Overlapping excerpts are merged so no text is sent twice
+    merged = []
+    for span_start, span_end in sorted(spans):
+        if merged and span_start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], span_end))
+        else:
+            merged.append((span_start, span_end))
+    return "\n...\n".join(text[span_start:span_end].strip() for span_start, span_end in merged)
+
+def repair_prompt(field, labels, context):
+    return f"""
+    From the purchase order excerpt below, extract the {field} (labelled {', '.join(f'"{label}"' for label in labels[:3])}).
+    Answer with {ANSWER_FORMATS[field]}, and nothing else. If it is not in the excerpt, answer N/A.
+
+    Excerpt:
+    {context}
+    """
+
+def _repair_requests(info, raw_text, customer_module, extracted):
+    """Return (field, prompt) for every failed field whose label occurs in the text."""
+    requests = []
+    for field in failed_fields(info, customer_module, extracted):
+        labels = field_labels(field, customer_module)
+        context = label_context(raw_text, labels)
+        if context is None:
+            metrics.FIELD_REPAIRS.inc(field=field, outcome='no_context')
+            continue
+        requests.append((field, repair_prompt(field, labels, context)))
+    if requests:
+        metrics.annotate(repair_fields=[field for field, _ in requests])
+    return requests
+
+def _apply_repair(info, field, answer, customer_module, extracted):
+    """Post-process the repaired value and keep it, and the extracted value, if it passes validation."""
+    value = answer.strip().splitlines()[0].strip().strip('"\'') if answer.strip() else ""
+    candidate = {field: value}
+    try:
+        if field == "Quantity":
+            modify_quantity_and_unit(candidate)
+        elif field == "Required Delivery Date":
+            modify_delivery_date_format(candidate)
+        elif field == "Deliver to":
+            candidate[field] = find_best_match(value, customer_module.ship_to_info)
+    except ValueError:
+        pass
+
+    deliver_to_address = value if field == "Deliver to" else None
+    if value.upper() != "N/A" and field_is_valid(field, candidate, customer_module, deliver_to_address):
+        info.update(candidate)
+        extracted[field] = value
+        metrics.FIELD_REPAIRS.inc(field=field, outcome='repaired')
+        return True
+    logger.debug("Repair of %s rejected: %r", field, answer)
+    metrics.FIELD_REPAIRS.inc(field=field, outcome='rejected')
+    return False
+
+def repair_fields(info, raw_text, customer_module, extracted=None):
+    """
+    Ask again for the fields of a post-processed extraction that fail validation.
+
+    Args:
+        info: The output of post_process_extracted_info, updated in place
+        raw_text: The selected page text of the purchase order
+        customer_module: The customer module the extraction was made for
+        extracted: The field values before post-processing, updated in place
+            with the repaired values
+
+    Returns:
+        dict: The information with the repaired fields
+    """
+    if not FIELD_REPAIR_ENABLED:
+        return info
+    extracted = extracted if extracted is not None else {}
+    requests = _repair_requests(info, raw_text, customer_module, extracted)
+    if not requests:
+        return info
+
+    llm = client_manager.get_llm(temperature=0)
+    repaired = []
+    with metrics.stage('field_repair'):
+        for field, prompt in requests:
+            try:
+                answer = llm.invoke(prompt)
+            except Exception as e:
+                logger.warning("Repair of %s failed: %s", field, e)
+                metrics.FIELD_REPAIRS.inc(field=field, outcome='error')
+                metrics.record_error('field_repair')
+                continue
+            if _apply_repair(info, field, answer, customer_module, extracted):
+                repaired.append(field)
+    metrics.annotate(repaired_fields=repaired)
+    return info
+
+async def repair_fields_async(info, raw_text, customer_module, extracted=None):
+    """Async variant of repair_fields, the repair prompts are awaited."""
+    if not FIELD_REPAIR_ENABLED:
+        return info
+    extracted = extracted if extracted is not None else {}
+    requests = _repair_requests(info, raw_text, customer_module, extracted)
+    if not requests:
+        return info
+
+    llm = client_manager.get_llm(temperature=0)
+    repaired = []
+    with metrics.stage('field_repair'):
+        for field, prompt in requests:
+            try:
+                answer = await llm.ainvoke(prompt)
+            except Exception as e:
+                logger.warning("Repair of %s failed: %s", field, e)
+                metrics.FIELD_REPAIRS.inc(field=field, outcome='error')
+                metrics.record_error('field_repair')
+                continue
+            if _apply_repair(info, field, answer, customer_module, extracted):
+                repaired.append(field)
+    metrics.annotate(repaired_fields=repaired)
+    return info
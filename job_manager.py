@@ -0,0 +1,88 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+class JobManager:
+    """Run extraction jobs on background workers and keep their state for polling."""
+
+    def __init__(self, max_workers=2, max_finished_jobs=1000):
+        self.max_workers = max_workers
+        self.max_finished_jobs = max_finished_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='po-job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        """Queue func(*args, **kwargs) and return the id of the new job right away."""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {
+                'job_id': job_id,
+                'status': QUEUED,
+                'submitted_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'error': None,
+            }
+            self._discard_old_jobs()
+        self._executor.submit(self._run, job_id, func, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, func, args, kwargs):
+        self._update(job_id, status=RUNNING, started_at=time.time())
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self._update(job_id, status=FAILED, error=str(e), finished_at=time.time())
+        else:
+            self._update(job_id, status=SUCCEEDED, result=result, finished_at=time.time())
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+
+    def _discard_old_jobs(self):
+        """Forget the oldest finished jobs once more than max_finished_jobs are kept."""
+        finished = [job_id for job_id, job in self._jobs.items() if job['status'] in (SUCCEEDED, FAILED)]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        """Return a snapshot of a job, or None if the job id is unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = dict(job)
+            if job['status'] == QUEUED:
+                # Number of jobs that were queued before this one and have not started yet
+                snapshot['queue_position'] = sum(
+                    1 for other_id, other in self._jobs.items()
+                    if other['status'] == QUEUED and other['submitted_at'] < job['submitted_at'] and other_id != job_id
+                )
+            return snapshot
+
+    def stats(self):
+        """Return queue depth and job counts per state."""
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0, SUCCEEDED: 0, FAILED: 0}
+            for job in self._jobs.values():
+                counts[job['status']] += 1
+        return {
+            'queue_depth': counts[QUEUED],
+            'running': counts[RUNNING],
+            'succeeded': counts[SUCCEEDED],
+            'failed': counts[FAILED],
+            'workers': self.max_workers,
+        }
@@ -1,9 +1,19 @@
-from langchain_ollama import OllamaEmbeddings, OllamaLLM
-from langchain.vectorstores import FAISS
+import json
+from model_clients import client_manager
+from utils import CANONICAL_FIELDS
+import metrics
 
 def embed_and_store(chunks):
-    embeddings = OllamaEmbeddings(model="llama3.1")
-    vectorstore = FAISS.from_texts(chunks, embedding=embeddings)
+    # FAISS and numpy are only loaded once a request needs vector retrieval
+    from langchain.vectorstores import FAISS
+    from embedding_cache import get_embedding_cache, EMBEDDING_CACHE_ENABLED
+    embeddings = client_manager.get_embeddings()
+    with metrics.stage('embed'):
+        if not EMBEDDING_CACHE_ENABLED:
+            return FAISS.from_texts(chunks, embedding=embeddings)
+        # Only chunks that were never embedded with this model go to Ollama
+        vectors = get_embedding_cache(embeddings.model).embed_documents(chunks, embeddings)
+        vectorstore = FAISS.from_embeddings(list(zip(chunks, vectors)), embedding=embeddings)
     return vectorstore
 
 def retrieve_most_relevant_chunk_with_confidence(vectorstore, query, threshold=0.8):
@@ -13,13 +23,53 @@ def retrieve_most_relevant_chunk_with_confidence(vectorstore, query, threshold=0
     return combined_text
 
 def extract_information_with_llm(retrieved_text, extract_prompt):
-    llm = OllamaLLM(model="llama3.1", temperature=0)
+    llm = client_manager.get_llm(temperature=0)
     prompt = extract_prompt(retrieved_text)
     response = llm.invoke(prompt)
     return response
 
 def refine_extracted_information(extracted_info, refine_prompt):
-    llm = OllamaLLM(model="llama3.1", temperature=0)
+    llm = client_manager.get_llm(temperature=0)
     prompt = refine_prompt(extracted_info)
     refined_response = llm.invoke(prompt)
     return refined_response.strip()
+
+async def extract_information_with_llm_async(retrieved_text, extract_prompt):
+    llm = client_manager.get_llm(temperature=0)
+    return await llm.ainvoke(extract_prompt(retrieved_text))
+
+async def refine_extracted_information_async(extracted_info, refine_prompt):
+    llm = client_manager.get_llm(temperature=0)
+    refined_response = await llm.ainvoke(refine_prompt(extracted_info))
+    return refined_response.strip()
+
+def single_pass_prompt(retrieved_text, extract_prompt, field_map, instructions=""):
+    mapping = "\n".join(f'    - "{label}" -> "{canonical}"' for label, canonical in field_map.items())
+    return extract_prompt(retrieved_text) + f"""
+    **Output format:**
+    Return ONLY a JSON object. Put the value found for each label below under its canonical key, leave out any other field:
+{mapping}
+
+    **Instructions:**
+    - **Quantity**: do not remove unit of measure
+    - **Required Delivery Date**: Remove any additional text and retain only the date in **MM/DD/YYYY** format.
+    - **Deliver to**: Ensure the address is correctly formatted and remove any duplicate information.
+    {instructions}
+    """
+
+def extract_structured_information(retrieved_text, extract_prompt, field_map, instructions=""):
+    llm = client_manager.get_llm(temperature=0, format="json")
+    prompt = single_pass_prompt(retrieved_text, extract_prompt, field_map, instructions)
+    return canonical_fields(json.loads(llm.invoke(prompt)), field_map)
+
+async def extract_structured_information_async(retrieved_text, extract_prompt, field_map, instructions=""):
+    llm = client_manager.get_llm(temperature=0, format="json")
+    prompt = single_pass_prompt(retrieved_text, extract_prompt, field_map, instructions)
+    return canonical_fields(json.loads(await llm.ainvoke(prompt)), field_map)
+
+def canonical_fields(info, field_map):
+    # The model sometimes keeps the customer's labels, map them to the canonical keys
+    for label, canonical in field_map.items():
+        if label in info and label != canonical:
+            info.setdefault(canonical, info.pop(label))
+    return {field: str(info.get(field, "") or "") for field in CANONICAL_FIELDS}
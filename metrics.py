@@ -0,0 +1,268 @@
+import contextvars
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+# Histogram bucket upper bounds in seconds, from fast rules up to slow LLM calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+class Counter(_Metric):
+    """Monotonically increasing count, e.g. errors."""
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """Value that goes up and down, e.g. requests in flight."""
+    type_name = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets."""
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            sample = self._values.get(key)
+            if sample is None:
+                sample = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample['buckets'][index] += 1
+                    break
+            sample['sum'] += value
+            sample['count'] += 1
+
+    def _render_sample(self, key, sample):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, sample['buckets']):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(sample['sum'])}")
+        lines.append(f"{self.name}_count{labels} {sample['count']}")
+        return lines
+
+class MetricsRegistry:
+    """Collection of metrics rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    'po_stage_duration_seconds', 'Latency of each purchase order processing stage', ('stage', 'customer', 'route')
+))
+REQUEST_SECONDS = registry.register(Histogram(
+    'po_request_duration_seconds', 'Latency of purchase order processing requests', ('route', 'customer', 'status')
+))
+IN_FLIGHT = registry.register(Gauge(
+    'po_requests_in_flight', 'Purchase order processing requests currently running', ('route',)
+))
+ERRORS = registry.register(Counter(
+    'po_errors_total', 'Failed purchase order processing stages', ('route', 'customer', 'stage')
+))
+
+COALESCED = registry.register(Counter(
+    'po_coalesced_requests_total', 'Requests that waited on an identical extraction already in flight', ('route',)
+))
+IDEMPOTENT_REPLAYS = registry.register(Counter(
+    'po_idempotent_replays_total', 'Responses replayed for a repeated Idempotency-Key', ('route',)
+))
+
+OPENAI_CONCURRENCY_LIMIT = registry.register(Gauge(
+    'po_openai_concurrency_limit', 'Concurrent OpenAI calls currently allowed by the scheduler'
+))
+OPENAI_RETRIES = registry.register(Counter(
+    'po_openai_retries_total', 'OpenAI calls retried by the scheduler', ('reason',)
+))
+
+CASCADE_RESULTS = registry.register(Counter(
+    'po_cascade_results_total', 'Cascade tier results by outcome: accepted, rejected or error', ('tier', 'outcome')
+))
+CASCADE_FAILED_CHECKS = registry.register(Counter(
+    'po_cascade_failed_checks_total', 'Validation checks failed by each cascade tier', ('tier', 'check')
+))
+
+FIELD_REPAIRS = registry.register(Counter(
+    'po_field_repairs_total', 'Fields asked for again after failing validation, by outcome', ('field', 'outcome')
+))
+
+trace_logger = logging.getLogger('po_trace')
+
+# The trace of the request being processed on this thread or task
+_current_trace = contextvars.ContextVar('po_trace', default=None)
+
+def current_trace():
+    """Return the trace record of the current request, or None outside of a request."""
+    return _current_trace.get()
+
+def annotate(**fields):
+    """Add fields, e.g. the retrieval strategy or a cache hit, to the current request's trace log."""
+    record = _current_trace.get()
+    if record is not None:
+        record.update(fields)
+
+@contextmanager
+def trace(route, customer, **fields):
+    """
+    Measure one request: in-flight gauge, request latency and a JSON trace log line
+    holding the duration of every stage that ran inside it.
+
+    Args:
+        route: The route or entry point label, e.g. 'process-purchase-order'
+        customer: The customer code label
+        fields: Extra fields for the trace log, e.g. the file name
+    """
+    record = {'trace_id': uuid.uuid4().hex, 'route': route, 'customer': customer, **fields, 'stages': {}}
+    token = _current_trace.set(record)
+    IN_FLIGHT.inc(route=route)
+    start = time.perf_counter()
+    record['status'] = 'ok'
+    try:
+        yield record
+    except Exception as e:
+        record['status'] = 'error'
+        record['error'] = str(e)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        IN_FLIGHT.dec(route=route)
+        REQUEST_SECONDS.observe(duration, route=route, customer=customer, status=record['status'])
+        _current_trace.reset(token)
+        record['duration_ms'] = round(duration * 1000, 2)
+        if trace_logger.isEnabledFor(logging.INFO):
+            trace_logger.info(json.dumps(record, default=str))
+
+def observe_stage(name, seconds, error=False):
+    """Record a stage duration measured elsewhere, e.g. in a worker process."""
+    record = _current_trace.get()
+    route = record['route'] if record else 'none'
+    customer = record['customer'] if record else 'none'
+    STAGE_SECONDS.observe(seconds, stage=name, customer=customer, route=route)
+    if error:
+        ERRORS.inc(route=route, customer=customer, stage=name)
+    if record is not None:
+        # Stages can run more than once per request, e.g. the model stage of a batch
+        stages = record['stages']
+        stages[name] = round(stages.get(name, 0) + seconds * 1000, 2)
+        if error:
+            record.setdefault('failed_stages', []).append(name)
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as a processing stage of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        observe_stage(name, time.perf_counter() - start, error=True)
+        raise
+    observe_stage(name, time.perf_counter() - start)
+
+def record_error(name):
+    """Count a stage failure that was handled without raising."""
+    record = _current_trace.get()
+    ERRORS.inc(route=record['route'] if record else 'none', customer=record['customer'] if record else 'none', stage=name)
+    if record is not None:
+        record.setdefault('failed_stages', []).append(name)
+
+def run_traced(route, customer, func, *args, **kwargs):
+    """Call func(*args, **kwargs) as its own traced request, e.g. on a background worker."""
+    with trace(route, customer):
+        return func(*args, **kwargs)
+
+_listener = None
+
+def configure_logging(level=None):
+    """
+    Send log records through a queue to a stderr handler on a background thread,
+    so request threads never block on console output. Does nothing if the root
+    logger is already configured.
+    """
+    global _listener
+    root = logging.getLogger()
+    if _listener is not None or root.handlers:
+        return
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    log_queue = queue.SimpleQueue()
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level or os.environ.get('LOG_LEVEL', 'INFO').upper())
+
+    _listener = QueueListener(log_queue, handler)
+    _listener.start()
@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import threading
+import urllib.error
+import urllib.request
+from dotenv import dotenv_values
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_BASE_URL = os.environ.get('OLLAMA_BASE_URL', 'http://localhost:11434')
+OLLAMA_MODEL = os.environ.get('OLLAMA_MODEL', 'llama3.1')
+# How long Ollama keeps a model loaded after the last keep-alive ping
+OLLAMA_KEEP_ALIVE = os.environ.get('OLLAMA_KEEP_ALIVE', '30m')
+# Seconds between keep-alive pings, shorter than Ollama's default 5 minute unload
+KEEP_ALIVE_INTERVAL = int(os.environ.get('MODEL_KEEP_ALIVE_INTERVAL', 240))
+
+class ClientManager:
+    """Process-wide pool of LLM, embedding and OpenAI clients.
+
+    Clients are created once and reused by every pipeline stage so HTTP
+    connections stay open between requests. Models are preloaded and kept
+    resident in Ollama so the first request does not pay a cold model load.
+    """
+
+    def __init__(self, ollama_base_url=OLLAMA_BASE_URL, ollama_model=OLLAMA_MODEL):
+        self.ollama_base_url = ollama_base_url.rstrip('/')
+        self.ollama_model = ollama_model
+        self._lock = threading.Lock()
+        self._llms = {}
+        self._embeddings = {}
+        self._openai_client = None
+        self._async_openai_client = None
+        self._keep_alive_thread = None
+        self._stop = threading.Event()
+
+    def get_llm(self, model=None, temperature=0, format=''):
+        """Return the shared Ollama LLM client for a model, temperature and output format."""
+        key = (model or self.ollama_model, temperature, format)
+        with self._lock:
+            if key not in self._llms:
+                from langchain_ollama import OllamaLLM
+                self._llms[key] = OllamaLLM(model=key[0], temperature=temperature, format=format, base_url=self.ollama_base_url)
+            return self._llms[key]
+
+    def get_embeddings(self, model=None):
+        """Return the shared Ollama embeddings client for a model."""
+        model = model or self.ollama_model
+        with self._lock:
+            if model not in self._embeddings:
+                from langchain_ollama import OllamaEmbeddings
+                self._embeddings[model] = OllamaEmbeddings(model=model, base_url=self.ollama_base_url)
+            return self._embeddings[model]
+
+    def get_openai_client(self):
+        """Return the shared OpenAI client, or None if no API key is configured."""
+        with self._lock:
+            if self._openai_client is None:
+                # Environment variables take precedence over the .env file
+                api_key = os.environ.get('OPENAI_API_KEY') or dotenv_values(".env").get("OPENAI_API_KEY")
+                if not api_key:
+                    return None
+                from openai import OpenAI
+                self._openai_client = OpenAI(api_key=api_key)
+            return self._openai_client
+
+    def get_async_openai_client(self):
+        """Return the shared AsyncOpenAI client for the async server, or None if no API key is configured."""
+        with self._lock:
+            if self._async_openai_client is None:
+                api_key = os.environ.get('OPENAI_API_KEY') or dotenv_values(".env").get("OPENAI_API_KEY")
+                if not api_key:
+                    return None
+                from openai import AsyncOpenAI
+                self._async_openai_client = AsyncOpenAI(api_key=api_key)
+            return self._async_openai_client
+
+    def _ollama_request(self, path, payload=None, timeout=5):
+        data = json.dumps(payload).encode() if payload is not None else None
+        req = urllib.request.Request(
+            f"{self.ollama_base_url}{path}",
+            data=data,
+            headers={'Content-Type': 'application/json'},
+        )
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return json.loads(response.read() or b'{}')
+
+    def warm_up(self, models=None):
+        """Load models into Ollama memory and keep them resident for OLLAMA_KEEP_ALIVE."""
+        loaded = {}
+        for model in models or {self.ollama_model} | {key[0] for key in self._llms} | set(self._embeddings):
+            try:
+                # A generate request without a prompt only loads the model
+                self._ollama_request('/api/generate', {'model': model, 'keep_alive': OLLAMA_KEEP_ALIVE}, timeout=300)
+                loaded[model] = True
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                logger.warning("Model warm-up failed for %s: %s", model, e)
+                loaded[model] = False
+        return loaded
+
+    def start_keep_alive(self, interval=KEEP_ALIVE_INTERVAL):
+        """Warm up models in the background and ping them every interval seconds."""
+        if self._keep_alive_thread is not None:
+            return
+
+        def keep_alive():
+            while not self._stop.is_set():
+                self.warm_up()
+                self._stop.wait(interval)
+
+        self._keep_alive_thread = threading.Thread(target=keep_alive, name='model-keep-alive', daemon=True)
+        self._keep_alive_thread.start()
+
+    def stop_keep_alive(self):
+        self._stop.set()
+
+    def health_check(self):
+        """Check that the model backends are reachable."""
+        health = {}
+        try:
+            tags = self._ollama_request('/api/tags')
+            models = [m.get('name', '') for m in tags.get('models', [])]
+            health['ollama'] = {
+                'ok': any(name.split(':')[0] == self.ollama_model.split(':')[0] for name in models),
+                'models': models,
+            }
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            health['ollama'] = {'ok': False, 'error': str(e)}
+
+        openai_client = self.get_openai_client()
+        if openai_client is None:
+            health['openai'] = {'ok': False, 'error': 'OPENAI_API_KEY not configured'}
+        else:
+            try:
+                openai_client.models.list()
+                health['openai'] = {'ok': True}
+            except Exception as e:
+                health['openai'] = {'ok': False, 'error': str(e)}
+        return health
+
+# Process-wide client manager shared by every pipeline stage
+client_manager = ClientManager()
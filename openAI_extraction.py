@@ -1,46 +1,21 @@
 from dotenv import dotenv_values
 from openai import OpenAI
-import PyPDF2
 import json
+from pdf_processing import extract_text
 
 
 env_vars=dotenv_values(".env")
 OPENAI_API_KEY=env_vars.get("OPENAI_API_KEY")
 
-if OPENAI_API_KEY:
-  try:
-    openai_client=OpenAI(api_key=OPENAI_API_KEY)
-    openai_client.models.list()
-  except Exception as e:
-    print (f"Incorrect Key{e}")
-    
 
 def extract_text_from_pdf(pdf_filename):
     text = ""
     try:
-        with open(pdf_filename, "rb") as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
+        text = extract_text(pdf_filename, normalize=True)
     except Exception as e:
         print(f"Error reading PDF: {e}")
     return text
 
-import re
-
-def fix_number_format(text):
-
-    # Convert numbers formatted as "xxx,xxx.xxx" to "xxxxxx.xxx"
-    text = re.sub(r'(\d{1,3}),(\d{3}\.\d+)', r'\1\2', text)  
-
-    return text
-
-pdf_filename = "4700414082.pdf"
-pdf_text = extract_text_from_pdf(pdf_filename)
-
-pdf_text = fix_number_format(pdf_text)
-
-
 system_message = (
     "You are an AI extracting relevant content from a purchase order. "
     "Find the following details and return ONLY a valid JSON object with these fields:"
@@ -61,42 +36,54 @@ system_message = (
 )
 
 
+MODEL='gpt-4o'
 
 
-
-
-user_prompt=f"Extract relevant details from the following purchase order:\n{pdf_text}"
-prompts=[
-  {"role":"system","content":system_message},
-  {"role":"user","content":user_prompt},
-]
-
-prompts.append({
-    "role": "system",
-    "content": (
-        "Analyze the purchase order details provided. If the item section contains more than one item number, this indicates there are multiple purchase order lines. "
-        "In that case, extract and output each line separately as a JSON array, where each element represents a single purchase order line with all its details. "
-        "If there's only one line, output it as a single JSON object. Ensure that no line is omitted."
+def extract_po(pdf_filename, openai_client):
+    """Extract the details of a purchase order PDF with one chat completion and print them."""
+    pdf_text = extract_text_from_pdf(pdf_filename)
+    user_prompt=f"Extract relevant details from the following purchase order:\n{pdf_text}"
+    prompts=[
+      {"role":"system","content":system_message},
+      {"role":"user","content":user_prompt},
+    ]
+
+    prompts.append({
+        "role": "system",
+        "content": (
+            "Analyze the purchase order details provided. If the item section contains more than one item number, this indicates there are multiple purchase order lines. "
+            "In that case, extract and output each line separately as a JSON array, where each element represents a single purchase order line with all its details. "
+            "If there's only one line, output it as a single JSON object. Ensure that no line is omitted."
+        )
+    })
+
+    response=openai_client.chat.completions.create(
+      model=MODEL,
+      messages=prompts,
+      temperature=0,
+      top_p=0.1
     )
-})
+    print(response.choices[0].message.content)
+    extract_contents=response.choices[0].message.content
 
 
-MODEL='gpt-4o'
-response=openai_client.chat.completions.create(
-  model=MODEL,
-  messages=prompts,
-  temperature=0,
-  top_p=0.1
-)
-print(response.choices[0].message.content)
-extract_contents=response.choices[0].message.content
-
+    # Convert string to JSON format
+    try:
+        extract_contents_json = json.loads(extract_contents)  # Convert to dictionary
+        print("Valid JSON Output:\n", json.dumps(extract_contents_json, indent=4))  # Pretty print JSON
+    except json.JSONDecodeError as e:
+        print("Error: OpenAI did not return valid JSON.\n", e)
+        print("Raw API Response:\n", extract_contents)
 
 
-# Convert string to JSON format
-try:
-    extract_contents_json = json.loads(extract_contents)  # Convert to dictionary
-    print("Valid JSON Output:\n", json.dumps(extract_contents_json, indent=4))  # Pretty print JSON
-except json.JSONDecodeError as e:
-    print("Error: OpenAI did not return valid JSON.\n", e)
-    print("Raw API Response:\n", extract_contents)
\ No newline at end of file
+# The API is only called when run as a script, importing the module makes no request
+if __name__ == '__main__':
+  if OPENAI_API_KEY:
+    try:
+      openai_client=OpenAI(api_key=OPENAI_API_KEY)
+      openai_client.models.list()
+    except Exception as e:
+      print (f"Incorrect Key{e}")
+    extract_po("4700414082.pdf", openai_client)
+  else:
+    print("OPENAI_API_KEY not found in .env file")
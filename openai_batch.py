@@ -0,0 +1,253 @@
+"""
+Bulk DEFAULT extraction through the OpenAI Batch API, for backlogs that do not
+need interactive latency.
+
+    python openai_batch.py overnight-2025-03-14 pos/*.pdf --output results.json
+
+Re-running the same command after an interruption resumes the batch from its
+saved state instead of submitting it again.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+import standard_via_openai
+from model_clients import client_manager
+from result_cache import result_cache
+
+logger = logging.getLogger(__name__)
+
+# Directory holding the request file and the state of every batch
+BATCH_DIR = os.environ.get('OPENAI_BATCH_DIR', os.path.join('cache', 'openai_batches'))
+# Seconds between two batch status checks
+BATCH_POLL_INTERVAL = float(os.environ.get('OPENAI_BATCH_POLL_INTERVAL', 60))
+
+# Batch states after which OpenAI does no more work on the batch
+FINAL_STATES = ('completed', 'failed', 'expired', 'cancelled')
+
+# Document states
+PENDING = 'pending'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+class PurchaseOrderBatch:
+    """A set of purchase order PDFs extracted with one OpenAI batch.
+
+    Every step saves its progress to BATCH_DIR/<name>/state.json, so an
+    interrupted run picks up where it stopped: the request file is not rebuilt,
+    an uploaded request file is not uploaded again and a submitted batch is
+    polled instead of submitted again.
+    """
+
+    def __init__(self, name, batch_dir=BATCH_DIR, client=None):
+        self.name = name
+        self.directory = os.path.join(batch_dir, name)
+        self.state_path = os.path.join(self.directory, 'state.json')
+        self.requests_path = os.path.join(self.directory, 'requests.jsonl')
+        self._client = client
+        os.makedirs(self.directory, exist_ok=True)
+        self.state = self._load()
+
+    def _load(self):
+        try:
+            with open(self.state_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {
+                'name': self.name,
+                'status': 'new',
+                'documents': {},
+                'input_file_id': None,
+                'batch_id': None,
+                'output_file_id': None,
+                'error_file_id': None,
+                'request_counts': None,
+            }
+
+    def _save(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = client_manager.get_openai_client()
+            if self._client is None:
+                raise RuntimeError("OPENAI_API_KEY not found in .env file")
+        return self._client
+
+    def pending(self):
+        """Return the custom ids of the documents still waiting for a result."""
+        return [custom_id for custom_id, document in self.state['documents'].items() if document['status'] == PENDING]
+
+    def prepare(self, pdf_paths):
+        """
+        Write one chat completion request per PDF to the batch request file.
+        PDFs with a cached result and PDFs without text are settled right away.
+
+        Args:
+            pdf_paths: The PDF files to extract
+        """
+        if self.state['status'] != 'new':
+            return
+
+        documents = {}
+        with open(self.requests_path, 'w') as requests_file:
+            for index, path in enumerate(pdf_paths):
+                with open(path, 'rb') as f:
+                    pdf_bytes = f.read()
+                cache_key = standard_via_openai.result_cache_key(pdf_bytes)
+                custom_id = f"po-{index:05d}-{hashlib.sha256(pdf_bytes).hexdigest()[:12]}"
+                document = {'path': path, 'cache_key': cache_key, 'status': PENDING, 'result': None, 'error': None}
+                documents[custom_id] = document
+
+                cached_results = result_cache.get(cache_key)
+                if cached_results is not None:
+                    document.update(status=SUCCEEDED, result=cached_results)
+                    continue
+
+                pdf_text = standard_via_openai.extract_text_from_pdf(pdf_bytes)
+                if not pdf_text:
+                    document.update(status=FAILED, error='No text found in PDF')
+                    continue
+
+                request = {
+                    'custom_id': custom_id,
+                    'method': 'POST',
+                    'url': '/v1/chat/completions',
+                    'body': {'messages': standard_via_openai.build_messages(pdf_text), **standard_via_openai.COMPLETION_OPTIONS},
+                }
+                requests_file.write(json.dumps(request) + "\n")
+
+        self.state['documents'] = documents
+        self.state['status'] = 'prepared' if self.pending() else 'collected'
+        self._save()
+        logger.info("Batch %s prepared: %d requests, %d settled without a request",
+                    self.name, len(self.pending()), len(documents) - len(self.pending()))
+
+    def submit(self):
+        """Upload the request file and create the batch, skipping the steps already done."""
+        if self.state['input_file_id'] is None:
+            with open(self.requests_path, 'rb') as f:
+                input_file = self.client.files.create(file=f, purpose='batch')
+            self.state['input_file_id'] = input_file.id
+            self._save()
+
+        if self.state['batch_id'] is None:
+            batch = self.client.batches.create(
+                input_file_id=self.state['input_file_id'],
+                endpoint='/v1/chat/completions',
+                completion_window='24h',
+                metadata={'name': self.name},
+            )
+            self.state['batch_id'] = batch.id
+            self.state['status'] = batch.status
+            self._save()
+            logger.info("Batch %s submitted as %s", self.name, batch.id)
+
+    def poll(self, interval=BATCH_POLL_INTERVAL, timeout=None):
+        """
+        Wait until OpenAI finishes the batch.
+
+        Args:
+            interval: Seconds between two status checks
+            timeout: Give up after this many seconds, None waits for the batch's completion window
+
+        Returns:
+            str: The last batch status
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            batch = self.client.batches.retrieve(self.state['batch_id'])
+            self.state.update(
+                status=batch.status,
+                output_file_id=batch.output_file_id,
+                error_file_id=batch.error_file_id,
+                request_counts=batch.request_counts.model_dump() if batch.request_counts else None,
+            )
+            self._save()
+            if batch.status in FINAL_STATES:
+                return batch.status
+            if deadline is not None and time.monotonic() >= deadline:
+                return batch.status
+            logger.info("Batch %s is %s: %s", self.name, batch.status, self.state['request_counts'])
+            time.sleep(interval)
+
+    def _settle(self, line):
+        entry = json.loads(line)
+        document = self.state['documents'].get(entry.get('custom_id'))
+        if document is None or document['status'] != PENDING:
+            return
+
+        response = entry.get('response') or {}
+        if entry.get('error') or response.get('status_code') != 200:
+            error = entry.get('error') or (response.get('body') or {}).get('error')
+            document.update(status=FAILED, error=str(error))
+            return
+
+        extracted_data = standard_via_openai.parse_response_content(response['body']['choices'][0]['message']['content'])
+        if extracted_data is None:
+            document.update(status=FAILED, error='Invalid JSON response')
+            return
+
+        results = standard_via_openai.format_results_for_frontend(extracted_data)
+        result_cache.set(document['cache_key'], results)
+        document.update(status=SUCCEEDED, result=results)
+
+    def collect(self):
+        """Map the batch output and error files back to the documents."""
+        for file_id in (self.state['output_file_id'], self.state['error_file_id']):
+            if file_id:
+                for line in self.client.files.content(file_id).text.splitlines():
+                    if line.strip():
+                        self._settle(line)
+
+        # Requests missing from both files failed with the batch
+        for custom_id in self.pending():
+            self.state['documents'][custom_id].update(status=FAILED, error=f"Batch {self.state['status']} without a result")
+        self.state['status'] = 'collected'
+        self._save()
+
+    def results(self):
+        """Return the extracted line items or the error of each PDF, keyed by path."""
+        return {
+            document['path']: {'result': document['result']} if document['status'] == SUCCEEDED else {'error': document['error']}
+            for document in self.state['documents'].values()
+        }
+
+    def run(self, pdf_paths=(), interval=BATCH_POLL_INTERVAL):
+        """Prepare, submit, poll and collect the batch, resuming from the saved state."""
+        self.prepare(pdf_paths)
+        if self.state['status'] != 'collected':
+            self.submit()
+            if self.state['status'] not in FINAL_STATES:
+                self.poll(interval)
+            self.collect()
+        return self.results()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('name', help="Batch name, re-use it to resume an interrupted batch")
+    parser.add_argument('pdfs', nargs='*', help="PDF files, only needed the first time")
+    parser.add_argument('--poll-interval', type=float, default=BATCH_POLL_INTERVAL, help="Seconds between status checks")
+    parser.add_argument('--output', help="Write the results to this JSON file instead of stdout")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    batch = PurchaseOrderBatch(args.name)
+    if batch.state['status'] == 'new' and not args.pdfs:
+        parser.error("No PDF files given for a new batch")
+    results = batch.run(args.pdfs, args.poll_interval)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,383 @@
+import asyncio
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+import metrics
+from prompt_assembly import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Requests and tokens per minute this process may use, see https://platform.openai.com/account/limits.
+# Unset, the scheduler adopts the account limits from the x-ratelimit-limit-* headers;
+# set, they cap this process's share of them, e.g. the account limits divided by the workers
+OPENAI_RPM_LIMIT = int(os.environ['OPENAI_RPM_LIMIT']) if os.environ.get('OPENAI_RPM_LIMIT') else None
+OPENAI_TPM_LIMIT = int(os.environ['OPENAI_TPM_LIMIT']) if os.environ.get('OPENAI_TPM_LIMIT') else None
+# Budgets used until the first response reports the account limits, high enough
+# not to hold back the first calls
+INITIAL_RPM = 10000
+INITIAL_TPM = 2000000
+# Upper bound on concurrent calls, lowered while the rate-limit headers run low
+OPENAI_MAX_CONCURRENCY = int(os.environ.get('OPENAI_MAX_CONCURRENCY', 16))
+# Retries of a call failing with 429, 5xx, a timeout or a connection error
+OPENAI_MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', 5))
+# Backoff before retry n is drawn from [0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** n)]
+OPENAI_BACKOFF_BASE = float(os.environ.get('OPENAI_BACKOFF_BASE', 1.0))
+OPENAI_BACKOFF_MAX = float(os.environ.get('OPENAI_BACKOFF_MAX', 60.0))
+# Completion tokens reserved for a call without max_tokens, an order of a few lines
+COMPLETION_TOKEN_ESTIMATE = int(os.environ.get('OPENAI_COMPLETION_TOKEN_ESTIMATE', 1000))
+
+# Fraction of the remaining requests or tokens below which concurrency is lowered,
+# and above which it is raised again
+LOW_REMAINING = 0.1
+HIGH_REMAINING = 0.5
+# Seconds after halving the concurrency limit on a 429 before it is halved again
+HALVE_COOLDOWN = 5.0
+
+DURATION_PATTERN = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+def parse_duration(value):
+    """Parse a rate-limit reset duration like '6m0s', '1.5s' or '20ms' into seconds, None if absent."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PATTERN.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+def _header_int(headers, name):
+    try:
+        return int(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    """Per-minute budget refilled continuously.
+
+    Reservations are never refused: the balance goes negative and the caller
+    waits until it is paid back, so callers are served in reservation order.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.balance = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.balance = min(self.capacity, self.balance + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount, now):
+        """Take amount from the bucket and return the seconds to wait before using it."""
+        self._refill(now)
+        self.balance -= min(amount, self.capacity)
+        return max(0.0, -self.balance / self.rate)
+
+    def refund(self, amount, now):
+        self._refill(now)
+        self.balance = min(self.capacity, self.balance + amount)
+
+    def limit_to(self, remaining, now):
+        """Lower the balance to what the server reports as remaining, e.g. after calls from other processes."""
+        self._refill(now)
+        self.balance = min(self.balance, remaining)
+
+    def set_capacity(self, per_minute, now):
+        """Adopt the per-minute limit the server reports, raising or lowering the refill rate."""
+        self._refill(now)
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.balance = min(self.balance, per_minute)
+
+class ConcurrencyGate:
+    """Semaphore with an adjustable limit, shared by threads and asyncio tasks in arrival order."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._waiters = deque()
+
+    def _wake(self):
+        # Called with the lock held, hands free slots to the waiters in order
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            self.in_flight += 1
+            if isinstance(waiter, threading.Event):
+                waiter.set()
+            else:
+                loop, future = waiter
+                loop.call_soon_threadsafe(self._hand_over, future)
+
+    def _hand_over(self, future):
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+    def acquire(self):
+        with self._lock:
+            if self.in_flight < self.limit and not self._waiters:
+                self.in_flight += 1
+                return
+            event = threading.Event()
+            self._waiters.append(event)
+        event.wait()
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.in_flight < self.limit and not self._waiters:
+                self.in_flight += 1
+                return
+            future = loop.create_future()
+            self._waiters.append((loop, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                try:
+                    self._waiters.remove((loop, future))
+                    handed_over = False
+                except ValueError:
+                    handed_over = True
+            # A slot handed over before the cancellation is released by _hand_over,
+            # unless the future already holds it
+            if handed_over and future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._wake()
+
+    def set_limit(self, limit):
+        with self._lock:
+            self.limit = limit
+            self._wake()
+
+class OpenAIScheduler:
+    """Admission control in front of the OpenAI chat completion calls.
+
+    Every call reserves one request and its estimated tokens from the
+    requests/min and tokens/min buckets and waits for a concurrency slot.
+    The time spent waiting is recorded as the 'openai_queue' stage. The
+    x-ratelimit-* headers of each response correct the buckets and move the
+    concurrency limit: halved on a 429, lowered by one while the remaining
+    budget is low and raised by one while it is high. Failed calls are
+    retried with jittered exponential backoff, or after retry-after.
+    """
+
+    def __init__(self, rpm=OPENAI_RPM_LIMIT, tpm=OPENAI_TPM_LIMIT, max_concurrency=OPENAI_MAX_CONCURRENCY,
+                 max_retries=OPENAI_MAX_RETRIES, backoff_base=OPENAI_BACKOFF_BASE, backoff_max=OPENAI_BACKOFF_MAX):
+        self.requests = TokenBucket(rpm or INITIAL_RPM)
+        self.tokens = TokenBucket(tpm or INITIAL_TPM)
+        self.rpm_cap = rpm
+        self.tpm_cap = tpm
+        self.gate = ConcurrencyGate(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self._last_halved = float('-inf')
+        metrics.OPENAI_CONCURRENCY_LIMIT.set(max_concurrency)
+
+    def estimate_tokens(self, request):
+        """Estimate the tokens a chat completion request counts against the tokens/min limit."""
+        prompt_tokens = sum(count_tokens(message.get('content') or "", request.get('model', 'gpt-4o')) + 4
+                            for message in request.get('messages', []))
+        return prompt_tokens + (request.get('max_tokens') or COMPLETION_TOKEN_ESTIMATE)
+
+    def _reserve(self, estimate):
+        with self._lock:
+            now = time.monotonic()
+            return max(self.requests.reserve(1, now), self.tokens.reserve(estimate, now))
+
+    def _refund(self, estimate):
+        """Give back the reservation of a call that failed before reporting any usage."""
+        with self._lock:
+            now = time.monotonic()
+            self.requests.refund(1, now)
+            self.tokens.refund(estimate, now)
+
+    def _set_limit(self, limit, reason):
+        limit = max(1, min(self.max_concurrency, limit))
+        if limit != self.gate.limit:
+            logger.info("OpenAI concurrency limit %d -> %d (%s)", self.gate.limit, limit, reason)
+            self.gate.set_limit(limit)
+            metrics.OPENAI_CONCURRENCY_LIMIT.set(limit)
+
+    def _on_response(self, headers, estimate, usage):
+        now = time.monotonic()
+        with self._lock:
+            if usage is not None:
+                # Give back what the estimate over-reserved, or take the shortfall
+                self.tokens.refund(estimate - usage.total_tokens, now)
+            limit_requests = _header_int(headers, 'x-ratelimit-limit-requests')
+            limit_tokens = _header_int(headers, 'x-ratelimit-limit-tokens')
+            # The account's actual limits replace the initial budgets, up to the configured caps
+            for bucket, limit, cap in ((self.requests, limit_requests, self.rpm_cap), (self.tokens, limit_tokens, self.tpm_cap)):
+                if limit:
+                    limit = min(limit, cap) if cap else limit
+                    if limit != bucket.capacity:
+                        bucket.set_capacity(limit, now)
+            remaining_requests = _header_int(headers, 'x-ratelimit-remaining-requests')
+            remaining_tokens = _header_int(headers, 'x-ratelimit-remaining-tokens')
+            if remaining_requests is not None:
+                self.requests.limit_to(remaining_requests, now)
+            if remaining_tokens is not None:
+                self.tokens.limit_to(remaining_tokens, now)
+
+            shares = []
+            for remaining, limit in ((remaining_requests, limit_requests), (remaining_tokens, limit_tokens)):
+                if remaining is not None and limit:
+                    shares.append(remaining / limit)
+            if shares and min(shares) < LOW_REMAINING:
+                self._set_limit(self.gate.limit - 1, 'rate limit budget low')
+            elif shares and min(shares) > HIGH_REMAINING:
+                self._set_limit(self.gate.limit + 1, 'rate limit budget high')
+
+    def _retry_delay(self, error, attempt):
+        """Return the seconds to wait before retrying a failed call, or None if it should not be retried."""
+        import openai
+
+        if isinstance(error, openai.RateLimitError):
+            if getattr(error, 'code', None) == 'insufficient_quota':
+                return None
+            reason = 'rate_limited'
+            with self._lock:
+                # The calls in flight when the limit is hit all get a 429, halve once for the burst
+                now = time.monotonic()
+                if now - self._last_halved >= HALVE_COOLDOWN:
+                    self._last_halved = now
+                    self._set_limit(self.gate.limit // 2, 'HTTP 429')
+        elif isinstance(error, (openai.APIConnectionError, openai.InternalServerError)):
+            reason = 'timeout' if isinstance(error, openai.APITimeoutError) else 'server_error'
+        else:
+            return None
+        if attempt >= self.max_retries:
+            return None
+
+        metrics.OPENAI_RETRIES.inc(reason=reason)
+        response = getattr(error, 'response', None)
+        headers = response.headers if response is not None else {}
+        retry_after_ms = _header_int(headers, 'retry-after-ms')
+        retry_after = retry_after_ms / 1000 if retry_after_ms is not None else parse_duration(headers.get('retry-after'))
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self.backoff_base)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _parse(self, raw, estimate):
+        response = raw.parse()
+        # Streamed responses carry no usage, their estimate stands
+        self._on_response(raw.headers, estimate, getattr(response, 'usage', None))
+        return response
+
+    def create_chat_completion(self, client, **request):
+        """
+        Call client.chat.completions.create(**request) within the rate limits.
+
+        A streamed response keeps its concurrency slot until the stream is consumed.
+
+        Raises:
+            The last openai error once the retries are exhausted, or right away
+            for errors that are not worth retrying
+        """
+        client = client.with_options(max_retries=0)
+        estimate = self.estimate_tokens(request)
+        attempt = 0
+        while True:
+            queued = time.perf_counter()
+            wait = self._reserve(estimate)
+            if wait > 0:
+                time.sleep(wait)
+            self.gate.acquire()
+            metrics.observe_stage('openai_queue', time.perf_counter() - queued)
+            try:
+                raw = client.chat.completions.with_raw_response.create(**request)
+                response = self._parse(raw, estimate)
+            except Exception as e:
+                self.gate.release()
+                # Each retry reserves again, the failed attempt must not count twice
+                self._refund(estimate)
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                logger.warning("OpenAI call failed (%s), retry %d in %.1fs", e, attempt + 1, delay)
+                attempt += 1
+                time.sleep(delay)
+                continue
+            if request.get('stream'):
+                return self._release_after(response)
+            self.gate.release()
+            return response
+
+    def _release_after(self, stream):
+        try:
+            yield from stream
+        finally:
+            self.gate.release()
+
+    async def create_chat_completion_async(self, client, **request):
+        """Async variant of create_chat_completion for an AsyncOpenAI client."""
+        client = client.with_options(max_retries=0)
+        estimate = self.estimate_tokens(request)
+        attempt = 0
+        while True:
+            queued = time.perf_counter()
+            wait = self._reserve(estimate)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await self.gate.acquire_async()
+            metrics.observe_stage('openai_queue', time.perf_counter() - queued)
+            try:
+                raw = await client.chat.completions.with_raw_response.create(**request)
+                response = self._parse(raw, estimate)
+            except Exception as e:
+                self.gate.release()
+                # Each retry reserves again, the failed attempt must not count twice
+                self._refund(estimate)
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                logger.warning("OpenAI call failed (%s), retry %d in %.1fs", e, attempt + 1, delay)
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            if request.get('stream'):
+                return self._release_after_async(response)
+            self.gate.release()
+            return response
+
+    async def _release_after_async(self, stream):
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            self.gate.release()
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            self.requests._refill(now)
+            self.tokens._refill(now)
+            return {
+                'concurrency_limit': self.gate.limit,
+                'in_flight': self.gate.in_flight,
+                'requests_available': round(self.requests.balance, 1),
+                'tokens_available': round(self.tokens.balance),
+            }
+
+# Process-wide scheduler shared by every OpenAI call of the app
+openai_scheduler = OpenAIScheduler()
@@ -0,0 +1,102 @@
+import os
+from collections import Counter
+
+# Default page selection, customers override any of these keys with a
+# page_selection dict in their module
+DEFAULT_PAGE_SELECTION = {
+    # Keep only the first N pages and skip scoring (None scores every page)
+    'first_pages': None,
+    # Maximum number of pages sent to the prompt
+    'max_pages': int(os.environ.get('PAGE_SELECTION_MAX_PAGES', 3)),
+    # Drop pages scoring below this fraction of the best page
+    'min_relative_score': float(os.environ.get('PAGE_SELECTION_MIN_RELATIVE_SCORE', 0.25)),
+    # The header fields are nearly always on the first page
+    'always_include_first': True,
+}
+
+# Terms found next to the purchase order fields
+FIELD_KEYWORDS = (
+    'purchase order', 'po number', 'order no', 'quantity', 'qty', 'delivery', 'ship to',
+    'deliver to', 'material', 'item', 'kg', 'lb', 'unit price', 'total',
+)
+
+# Terms found on terms & conditions pages and appendices
+BOILERPLATE_KEYWORDS = (
+    'terms and conditions', 'general conditions', 'appendix', 'warranty', 'liability',
+    'indemnif', 'governing law', 'force majeure', 'arbitration',
+)
+
+def table_score(blocks):
+    """Fraction of text blocks that share a row with another block, as in a table."""
+    text_blocks = [block for block in blocks if len(block) < 7 or block[6] == 0]
+    if len(text_blocks) < 2:
+        return 0.0
+    rows = Counter(round(block[1] / 3) for block in text_blocks)
+    return sum(count for count in rows.values() if count > 1) / len(text_blocks)
+
+def score_page(text, blocks=None):
+    """
+    Score how likely a page is to hold the purchase order fields.
+    
+    Args:
+        text: The page text
+        blocks: The fitz text blocks of the page, when available
+        
+    Returns:
+        float: The page score, 0 for empty or pure boilerplate pages
+    """
+    stripped = text.strip()
+    if not stripped:
+        return 0.0
+    lower = stripped.lower()
+    keyword_hits = sum(min(lower.count(keyword), 3) for keyword in FIELD_KEYWORDS)
+    boilerplate_hits = sum(lower.count(keyword) for keyword in BOILERPLATE_KEYWORDS)
+    digit_density = sum(char.isdigit() for char in stripped) / len(stripped)
+    layout = table_score(blocks) if blocks else 0.0
+    return max(keyword_hits + 20 * digit_density + 5 * layout - 2 * boilerplate_hits, 0.0)
+
+def is_boilerplate(text):
+    """Whether text reads as terms & conditions rather than purchase order fields."""
+    lower = text.lower()
+    keyword_hits = sum(min(lower.count(keyword), 3) for keyword in FIELD_KEYWORDS)
+    boilerplate_hits = sum(lower.count(keyword) for keyword in BOILERPLATE_KEYWORDS)
+    return boilerplate_hits > 0 and 2 * boilerplate_hits >= keyword_hits
+
+def page_selection_config(overrides=None):
+    """Merge a customer's page_selection overrides into the defaults."""
+    config = dict(DEFAULT_PAGE_SELECTION)
+    config.update(overrides or {})
+    return config
+
+def select_pages(page_texts, page_blocks=None, overrides=None):
+    """
+    Pick the pages to send to the prompt.
+    
+    Args:
+        page_texts: The text of each page
+        page_blocks: The fitz text blocks of each page, when available
+        overrides: The customer's page_selection settings
+        
+    Returns:
+        list: The indices of the selected pages, in document order
+    """
+    config = page_selection_config(overrides)
+    total_pages = len(page_texts)
+    if config['first_pages']:
+        return list(range(min(config['first_pages'], total_pages)))
+
+    scores = [
+        score_page(text, page_blocks[index] if page_blocks else None)
+        for index, text in enumerate(page_texts)
+    ]
+    if not scores or max(scores) == 0:
+        return list(range(total_pages))
+
+    cutoff = max(scores) * config['min_relative_score']
+    ranked = sorted((index for index in range(total_pages) if scores[index] >= cutoff), key=lambda i: -scores[i])
+    selected = set(ranked[:config['max_pages']])
+    if config['always_include_first']:
+        if 0 not in selected and len(selected) >= config['max_pages']:
+            selected.discard(ranked[config['max_pages'] - 1])
+        selected.add(0)
+    return sorted(selected)
@@ -1,24 +1,91 @@
-import fitz
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import io
+import os
+import re
+from page_selection import select_pages, page_selection_config
 
-def extract_text_from_pdf(pdf_path, customer=None):
-    document = fitz.open(pdf_path)
-    text = ""
-    total_pages = len(document)
+# Text extraction backend used when none is requested: 'pymupdf' or 'pypdf2'
+PDF_BACKEND = os.environ.get('PDF_BACKEND', 'pymupdf')
+
+def fix_number_format(text):
+    """Convert numbers formatted as 'xxx,xxx.xxx' to 'xxxxxx.xxx'"""
+    return re.sub(r'(\d{1,3}),(\d{3}\.\d+)', r'\1\2', text)
+
+def open_pdf(source):
+    """Open a PDF from a file path, or parse it directly from bytes."""
+    import fitz
+    if isinstance(source, str):
+        return fitz.open(source)
+    return fitz.open(stream=source, filetype="pdf")
+
+def _pymupdf_pages(source, with_blocks, max_pages):
+    document = open_pdf(source)
+    try:
+        for page_num in range(min(len(document), max_pages or len(document))):
+            page = document[page_num]
+            yield page.get_text(), page.get_text("blocks") if with_blocks else None
+    finally:
+        document.close()
+
+def _pypdf2_pages(source, with_blocks, max_pages):
+    import PyPDF2
+    if isinstance(source, str):
+        with open(source, "rb") as file:
+            source = file.read()
+    pages = PyPDF2.PdfReader(io.BytesIO(source)).pages
+    for page_num in range(min(len(pages), max_pages or len(pages))):
+        # PyPDF2 has no layout blocks
+        yield (pages[page_num].extract_text() or "") + "\n", None
+
+PDF_BACKENDS = {
+    'pymupdf': _pymupdf_pages,
+    'pypdf2': _pypdf2_pages,
+}
+
+def extract_pages(source, backend=None, with_blocks=False, normalize=False, max_pages=None):
+    """
+    Extract the text of each page of a PDF.
     
-    if customer and customer.upper() == "BA":
-        # Only keep the first 2 pages for customer BA
-        pages_to_extract = min(2, total_pages)
-    else:
-        # Default behavior: all pages except the last one if more than one
-        pages_to_extract = total_pages - 1 if total_pages > 1 else 1
-
-    for page_num in range(pages_to_extract):
-        page = document[page_num]
-        text += page.get_text()
+    Args:
+        source: The PDF file path or PDF bytes
+        backend: A PDF_BACKENDS name, defaults to PDF_BACKEND
+        with_blocks: Also return the layout blocks of each page (pymupdf only)
+        normalize: Apply fix_number_format to the page text
+        max_pages: Stop after this many pages
+        
+    Returns:
+        list: (text, blocks) per page, blocks is None without layout information
+    """
+    pages = []
+    for text, blocks in PDF_BACKENDS[backend or PDF_BACKEND](source, with_blocks, max_pages):
+        pages.append((fix_number_format(text) if normalize else text, blocks))
+    return pages
+
+def extract_text(source, backend=None, normalize=False):
+    """Extract the text of every page of a PDF."""
+    return "".join(text for text, _ in extract_pages(source, backend, normalize=normalize))
+
+def extract_selected_pages(source, page_selection=None, backend=None, normalize=False):
+    """
+    Extract the page texts of a PDF and pick the pages most likely to hold the PO fields.
     
-    return text
+    Returns:
+        tuple: The text of each extracted page and the indices of the selected pages
+    """
+    config = page_selection_config(page_selection)
+    # Layout blocks are only needed when the pages get scored
+    pages = extract_pages(
+        source, backend, with_blocks=not config['first_pages'], normalize=normalize, max_pages=config['first_pages']
+    )
+    page_texts = [text for text, _ in pages]
+    page_blocks = [blocks for _, blocks in pages] if not config['first_pages'] else None
+    return page_texts, select_pages(page_texts, page_blocks, page_selection)
+
+def extract_text_from_pdf(source, page_selection=None, backend=None, normalize=False):
+    """Extract the text of the pages most likely to hold the PO fields."""
+    page_texts, selected_pages = extract_selected_pages(source, page_selection, backend, normalize)
+    return "".join(page_texts[page_num] for page_num in selected_pages)
 
 def split_text(text):
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
     splitter = RecursiveCharacterTextSplitter(chunk_size=10000, chunk_overlap=100)
     return splitter.split_text(text)
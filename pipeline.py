@@ -0,0 +1,240 @@
+import contextvars
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from customer_handler import get_customer_module
+from po_processor import parse_purchase_order, complete_purchase_order, purchase_order_cache_key
+from result_cache import result_cache
+import metrics
+
+# Worker processes for PDF parsing and normalization
+PARSE_WORKERS = int(os.environ.get('PIPELINE_PARSE_WORKERS', os.cpu_count() or 2))
+# Worker threads waiting on the model calls
+LLM_WORKERS = int(os.environ.get('PIPELINE_LLM_WORKERS', 4))
+# Parsed documents allowed to wait for a model worker
+QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', 8))
+# Start method of the parse workers. A worker forked from the threaded server could
+# inherit a lock another thread held, e.g. a metrics or customer registry lock, and hang
+PARSE_START_METHOD = os.environ.get(
+    'PIPELINE_START_METHOD', 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+
+def parse_context():
+    """Return the multiprocessing context the parse workers are started with."""
+    context = multiprocessing.get_context(PARSE_START_METHOD)
+    if PARSE_START_METHOD == 'forkserver':
+        # Workers are forked from a server that imported the parse stage once, not from the app
+        context.set_forkserver_preload(['pipeline'])
+    return context
+
+def parse_in_worker(pdf_bytes, customer_code, upload_folder):
+    """Parse stage entry point, runs in a worker process."""
+    start = time.perf_counter()
+    parsed = parse_purchase_order(pdf_bytes, get_customer_module(customer_code), upload_folder)
+    return parsed, time.perf_counter() - start
+
+class StageStats:
+    """Busy time and throughput of one pipeline stage."""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds, error=False):
+        with self._lock:
+            self.items += 1
+            self.errors += int(error)
+            self.busy_seconds += seconds
+
+    def observe_queue(self, depth):
+        with self._lock:
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def report(self, wall_seconds):
+        with self._lock:
+            capacity = wall_seconds * self.workers
+            return {
+                'workers': self.workers,
+                'items': self.items,
+                'errors': self.errors,
+                'busy_seconds': round(self.busy_seconds, 3),
+                # Fraction of the stage's worker time spent working
+                'occupancy': round(self.busy_seconds / capacity, 3) if capacity else 0.0,
+                'max_queue_depth': self.max_queue_depth,
+            }
+
+class PurchaseOrderPipeline:
+    """Two-stage purchase order pipeline.
+
+    PDF parsing and rules run in a process pool while model calls run in a
+    thread pool, connected by a bounded queue, so document N+1 is parsed
+    while document N waits on the LLM.
+    """
+
+    def __init__(self, parse_workers=PARSE_WORKERS, llm_workers=LLM_WORKERS, queue_size=QUEUE_SIZE):
+        self.parse_workers = parse_workers
+        self.llm_workers = llm_workers
+        self.queue_size = queue_size
+        self._parse_executor = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        with self._lock:
+            if self._parse_executor is None:
+                self._parse_executor = ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=parse_context())
+            return self._parse_executor
+
+    def _discard_executor(self, executor):
+        """Drop a pool broken by a dead worker, so the next call builds a new one."""
+        with self._lock:
+            if self._parse_executor is executor:
+                self._parse_executor = None
+        executor.shutdown(wait=False)
+
+    def _submit(self, pdf_bytes, customer_code, upload_folder):
+        """Submit a parse, replacing the pool once if it is broken."""
+        executor = self._executor()
+        try:
+            return executor, executor.submit(parse_in_worker, pdf_bytes, customer_code, upload_folder)
+        except BrokenProcessPool:
+            self._discard_executor(executor)
+            executor = self._executor()
+            return executor, executor.submit(parse_in_worker, pdf_bytes, customer_code, upload_folder)
+
+    @staticmethod
+    def _parse_isolated(pdf_bytes, customer_code, upload_folder):
+        """Parse one document again in its own worker, so a PDF that kills its worker fails alone."""
+        with ProcessPoolExecutor(max_workers=1, mp_context=parse_context()) as executor:
+            return executor.submit(parse_in_worker, pdf_bytes, customer_code, upload_folder).result()
+
+    def run(self, documents, customer_module, upload_folder, llm_workers=None):
+        """
+        Process documents through the parse and model stages.
+        
+        Args:
+            documents: (filename, pdf_bytes) pairs
+            customer_module: The customer module to use for processing
+            upload_folder: The folder to spool large files to
+            llm_workers: Model stage threads for this run, defaults to the pipeline's
+            
+        Returns:
+            tuple: One result entry per document, in order, holding either
+            'result' or 'error', and the occupancy report of each stage
+        """
+        llm_workers = max(1, min(llm_workers or self.llm_workers, len(documents) or 1))
+        customer_code = customer_module.__name__.split('_')[-1]
+        results = [None] * len(documents)
+        parse_stats = StageStats('parse', self.parse_workers)
+        llm_stats = StageStats('llm', llm_workers)
+        parsed_queue = queue.Queue()
+        # Bounds the parsed documents waiting for the model stage
+        slots = threading.BoundedSemaphore(self.queue_size)
+        start = time.perf_counter()
+
+        def model_worker():
+            while True:
+                item = parsed_queue.get()
+                if item is None:
+                    return
+                index, filename, pdf_bytes, cache_key, executor, future, context = item
+                slots.release()
+                try:
+                    try:
+                        parsed, parse_seconds = future.result()
+                    except BrokenProcessPool:
+                        # A worker died, e.g. on a crashing PDF, and took every parse in its pool with it
+                        self._discard_executor(executor)
+                        parsed, parse_seconds = self._parse_isolated(pdf_bytes, customer_code, upload_folder)
+                    parse_stats.record(parse_seconds)
+                    # Parsing ran in a worker process, record its duration against this request
+                    context.run(metrics.observe_stage, 'parse', parse_seconds)
+                except Exception as e:
+                    parse_stats.record(0.0, error=True)
+                    context.run(metrics.record_error, 'parse')
+                    results[index] = {'filename': filename, 'error': str(e)}
+                    continue
+
+                stage_start = time.perf_counter()
+                try:
+                    final_info = context.run(complete_purchase_order, parsed, customer_module, filename)
+                    result_cache.set(cache_key, final_info)
+                    results[index] = {'filename': filename, 'result': final_info}
+                    llm_stats.record(time.perf_counter() - stage_start)
+                except Exception as e:
+                    results[index] = {'filename': filename, 'error': str(e)}
+                    llm_stats.record(time.perf_counter() - stage_start, error=True)
+
+        threads = [threading.Thread(target=model_worker, daemon=True) for _ in range(llm_workers)]
+        for thread in threads:
+            thread.start()
+
+        # Released once per parsed document handed to the model stage
+        enqueued = threading.Semaphore(0)
+
+        def enqueue(future, index, filename, pdf_bytes, cache_key, executor, context):
+            parsed_queue.put((index, filename, pdf_bytes, cache_key, executor, future, context))
+            llm_stats.observe_queue(parsed_queue.qsize())
+            enqueued.release()
+
+        futures = []
+        for index, (filename, pdf_bytes) in enumerate(documents):
+            # Return the stored result if this PDF was already processed with the same prompts
+            cache_key = purchase_order_cache_key(pdf_bytes, customer_module)
+            cached_info = result_cache.get(cache_key)
+            if cached_info is not None:
+                results[index] = {'filename': filename, 'result': cached_info}
+                continue
+
+            slots.acquire()
+            try:
+                executor, future = self._submit(pdf_bytes, customer_code, upload_folder)
+            except Exception as e:
+                slots.release()
+                results[index] = {'filename': filename, 'error': str(e)}
+                continue
+            # Each document runs its model stage in a copy of the caller's context, so its
+            # stages are recorded against the caller's request trace
+            context = contextvars.copy_context()
+            future.add_done_callback(
+                lambda done, index=index, filename=filename, pdf_bytes=pdf_bytes, cache_key=cache_key,
+                executor=executor, context=context: enqueue(
+                    done, index, filename, pdf_bytes, cache_key, executor, context
+                )
+            )
+            futures.append(future)
+
+        # Wait until every parsed document reached the queue before stopping the model workers
+        for _ in futures:
+            enqueued.acquire()
+        for _ in threads:
+            parsed_queue.put(None)
+        for thread in threads:
+            thread.join()
+
+        wall_seconds = time.perf_counter() - start
+        stages = {
+            'wall_seconds': round(wall_seconds, 3),
+            'parse': parse_stats.report(wall_seconds),
+            'llm': llm_stats.report(wall_seconds),
+        }
+        return results, stages
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+def get_pipeline():
+    """Return the process-wide pipeline, its worker processes are started on first use."""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = PurchaseOrderPipeline()
+        return _pipeline
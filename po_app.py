@@ -1,25 +1,125 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, url_for
 from flask_cors import CORS
+from werkzeug.datastructures import FileStorage
+import io
 import os
 import json
+import hashlib
+import functools
 
 # Import modularized components
 from utils import allowed_file
 from customer_handler import get_customer_module, get_all_customers, validate_user_permission
-from po_processor import process_purchase_order_file
+from po_processor import (
+    process_purchase_order_file, process_purchase_order_files, process_default_purchase_order_file,
+    stream_default_purchase_order_file,
+)
+from cascade import process_cascade_purchase_order_file, cascade_stats
+from streaming import format_event
+from job_manager import JobManager
+from result_cache import result_cache
+from single_flight import single_flight, idempotency_store
+from model_clients import client_manager
+import metrics
+from preload import preload_backends
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+# Log through a background thread so request threads never block on the console
+metrics.configure_logging()
+
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'pdf'}
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Reject request bodies above this size before they are read
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 100 * 1024 * 1024))
+# Upper bound on how many files of a batch are processed at the same time
+app.config['BATCH_MAX_WORKERS'] = int(os.environ.get('BATCH_MAX_WORKERS', 4))
+# Number of background workers running submitted extraction jobs
+app.config['JOB_MAX_WORKERS'] = int(os.environ.get('JOB_MAX_WORKERS', 2))
+# Extraction mode of customer uploads sent without a 'mode' field: 'local' runs the
+# Ollama pipeline only, 'cascade' sends the results failing validation to OpenAI
+app.config['EXTRACTION_MODE'] = os.environ.get('EXTRACTION_MODE', 'local')
+
+EXTRACTION_MODES = {
+    'local': process_purchase_order_file,
+    'cascade': process_cascade_purchase_order_file,
+}
+
+job_manager = JobManager(max_workers=app.config['JOB_MAX_WORKERS'])
+
+# Heavy backends are imported when a route first needs them. Set PRELOAD_BACKENDS=1
+# with a pre-forking server (gunicorn --preload) to import them once in the parent
+if os.environ.get('PRELOAD_BACKENDS', '0').lower() not in ('0', 'false', 'no'):
+    preload_backends()
+
+# Preload the Ollama models in the background and keep them resident
+if os.environ.get('MODEL_WARM_UP', '1').lower() not in ('0', 'false', 'no'):
+    client_manager.start_keep_alive()
 
 # Ensure upload folder exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+@app.errorhandler(413)
+def request_too_large(e):
+    """Return a JSON error when an upload exceeds MAX_CONTENT_LENGTH."""
+    return jsonify({'error': f"Upload exceeds the {app.config['MAX_CONTENT_LENGTH']} byte limit"}), 413
+
+def request_fingerprint():
+    """Hash the path, form fields and uploaded files of the current request."""
+    digest = hashlib.sha256(request.path.encode())
+    for name, value in sorted(request.form.items(multi=True)):
+        digest.update(f"{name}={value}\0".encode())
+    for name, file in request.files.items(multi=True):
+        digest.update(f"{name}:{file.filename}\0".encode())
+        digest.update(hashlib.sha256(file.read()).digest())
+        file.seek(0)
+    return digest.hexdigest()
+
+def idempotent(view):
+    """
+    Replay the stored response of a request repeated with the same Idempotency-Key header.
+    
+    A repeat arriving while the first request still runs waits for its response.
+    Server errors are not stored, so a retry after a 5xx runs again.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+        
+        store_key = (request.path, key)
+        fingerprint = request_fingerprint()
+        token = object()
+        
+        def run():
+            stored = idempotency_store.get(store_key)
+            if stored is not None:
+                return None, stored, None
+            response = app.make_response(view(*args, **kwargs))
+            body = response.get_json(silent=True)
+            if body is not None and response.status_code < 500:
+                idempotency_store.set(store_key, fingerprint, response.status_code, body)
+            return token, (fingerprint, response.status_code, body), response
+        
+        owner, (stored_fingerprint, status, body), response = single_flight.do(('idempotency',) + store_key, run)
+        if owner is token:
+            return response
+        if stored_fingerprint != fingerprint:
+            return jsonify({'error': 'Idempotency-Key was already used with a different request'}), 422
+        
+        metrics.IDEMPOTENT_REPLAYS.inc(route=request.path)
+        replay = jsonify(body)
+        replay.status_code = status
+        replay.headers['Idempotent-Replayed'] = 'true'
+        return replay
+    return wrapper
+
 @app.route('/api/process-purchase-order', methods=['POST'])
+@idempotent
 def process_purchase_order():
     """API endpoint to process a purchase order PDF file."""
     if 'file' not in request.files:
@@ -28,6 +128,7 @@ def process_purchase_order():
     file = request.files['file']
     customer_code = request.form.get('customer', 'BA')
     user_data = request.form.get('user', None)
+    mode = request.form.get('mode', app.config['EXTRACTION_MODE'])
     
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
@@ -35,6 +136,9 @@ def process_purchase_order():
     if not file or not allowed_file(file.filename, ALLOWED_EXTENSIONS):
         return jsonify({'error': 'Invalid file type'}), 400
     
+    if mode not in EXTRACTION_MODES:
+        return jsonify({'error': 'Invalid extraction mode'}), 400
+    
     # Validate user permissions
     if not validate_user_permission(user_data, customer_code):
         return jsonify({'error': 'You do not have permission to access this customer'}), 403
@@ -46,16 +150,71 @@ def process_purchase_order():
     
     try:
         # Process the purchase order
-        result = process_purchase_order_file(file, customer_module, app.config['UPLOAD_FOLDER'])
+        with metrics.trace('process-purchase-order', customer_code, filename=file.filename):
+            result = EXTRACTION_MODES[mode](file, customer_module, app.config['UPLOAD_FOLDER'])
         return jsonify(result)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/process-purchase-orders', methods=['POST'])
+@idempotent
+def process_purchase_orders():
+    """API endpoint to process several purchase order PDF files concurrently."""
+    files = request.files.getlist('files')
+    customer_code = request.form.get('customer', 'BA')
+    user_data = request.form.get('user', None)
+    
+    if not files:
+        return jsonify({'error': 'No file provided'}), 400
+    
+    # Validate user permissions
+    if not validate_user_permission(user_data, customer_code):
+        return jsonify({'error': 'You do not have permission to access this customer'}), 403
+    
+    # Get the appropriate customer module
+    customer_module = get_customer_module(customer_code)
+    if not customer_module:
+        return jsonify({'error': 'Invalid customer selection'}), 400
+    
+    # The client may ask for less concurrency than the server allows, never more
+    max_workers = app.config['BATCH_MAX_WORKERS']
+    try:
+        concurrency = int(request.form.get('concurrency', max_workers))
+    except ValueError:
+        concurrency = 0
+    if concurrency < 1:
+        return jsonify({'error': 'Invalid concurrency value'}), 400
+    max_workers = min(max_workers, concurrency)
+    
+    # Reject invalid files individually instead of failing the whole batch
+    valid_files = []
+    errors = {}
+    for index, file in enumerate(files):
+        if file.filename == '':
+            errors[index] = {'filename': file.filename, 'error': 'No file selected'}
+        elif not allowed_file(file.filename, ALLOWED_EXTENSIONS):
+            errors[index] = {'filename': file.filename, 'error': 'Invalid file type'}
+        else:
+            valid_files.append(file)
+    
+    with metrics.trace('process-purchase-orders', customer_code, files=len(files)):
+        processed, stages = process_purchase_order_files(valid_files, customer_module, app.config['UPLOAD_FOLDER'], max_workers)
+    processed = iter(processed)
+    results = [errors[index] if index in errors else next(processed) for index in range(len(files))]
+    
+    return jsonify({
+        'results': results,
+        'succeeded': sum(1 for entry in results if 'result' in entry),
+        'failed': sum(1 for entry in results if 'error' in entry),
+        'stages': stages,
+    })
+
 # ===== DEFAULT CUSTOMER HANDLING =====
 # This endpoint is specifically for the DEFAULT customer option
 # It bypasses the regular processing flow (utils.py, po_process.py, llm_process.py)
 # and uses standard_via_openai.py directly
 @app.route('/api/process-default-purchase-order', methods=['POST'])
+@idempotent
 def process_default_purchase_order():
     """API endpoint to process a purchase order PDF file using standard_via_openai directly."""
     if 'file' not in request.files:
@@ -75,24 +234,145 @@ def process_default_purchase_order():
         return jsonify({'error': 'You do not have permission to access this customer'}), 403
     
     try:
-        # Save the file temporarily
-        filename = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-        file.save(filename)
-        
         # Use standard_via_openai's extract_po_data function directly
-        # This is where we directly use the output from standard_via_openai.py (imported as Customer_Default)
         # instead of going through the regular flow with po_processor.py
-        import standard_via_openai
-        result = standard_via_openai.extract_po_data(filename)
-        
-        # Clean up the temporary file
-        if os.path.exists(filename):
-            os.remove(filename)
-            
+        with metrics.trace('process-default-purchase-order', 'DEFAULT', filename=file.filename):
+            result = process_default_purchase_order_file(file, app.config['UPLOAD_FOLDER'])
         return jsonify(result)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/process-default-purchase-order/stream', methods=['POST'])
+def stream_default_purchase_order():
+    """API endpoint streaming the line items of a purchase order PDF file as the model generates them.
+    
+    Sends Server-Sent Events, or newline-delimited JSON when the client accepts
+    application/x-ndjson: one 'line' event per line item, merged with the
+    header fields, then a 'done' event holding the same results as
+    /api/process-default-purchase-order, or an 'error' event.
+    """
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file provided'}), 400
+    
+    file = request.files['file']
+    user_data = request.form.get('user', None)
+    
+    if file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+    
+    if not file or not allowed_file(file.filename, ALLOWED_EXTENSIONS):
+        return jsonify({'error': 'Invalid file type'}), 400
+    
+    if not validate_user_permission(user_data, 'DEFAULT'):
+        return jsonify({'error': 'You do not have permission to access this customer'}), 403
+    
+    ndjson = request.accept_mimetypes.best == 'application/x-ndjson'
+    filename = file.filename
+    events = stream_default_purchase_order_file(file, app.config['UPLOAD_FOLDER'])
+    
+    # The response is sent after this function returns, the trace covers the whole stream
+    def generate():
+        with metrics.trace('stream-default-purchase-order', 'DEFAULT', filename=filename):
+            for event, data in events:
+                yield format_event(event, data, ndjson)
+    
+    return Response(
+        generate(),
+        mimetype='application/x-ndjson' if ndjson else 'text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+# ===== BACKGROUND JOBS =====
+# Submit a purchase order for processing and poll for the result later, so the
+# request never stays open while the LLM chain runs
+@app.route('/api/jobs', methods=['POST'])
+@idempotent
+def submit_job():
+    """API endpoint to queue a purchase order PDF file for background processing."""
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file provided'}), 400
+    
+    file = request.files['file']
+    customer_code = request.form.get('customer', 'BA')
+    user_data = request.form.get('user', None)
+    mode = request.form.get('mode', app.config['EXTRACTION_MODE'])
+    
+    if file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+    
+    if not file or not allowed_file(file.filename, ALLOWED_EXTENSIONS):
+        return jsonify({'error': 'Invalid file type'}), 400
+    
+    if mode not in EXTRACTION_MODES:
+        return jsonify({'error': 'Invalid extraction mode'}), 400
+    
+    # Validate user permissions
+    if not validate_user_permission(user_data, customer_code):
+        return jsonify({'error': 'You do not have permission to access this customer'}), 403
+    
+    # Get the appropriate customer module
+    customer_module = get_customer_module(customer_code)
+    if not customer_module:
+        return jsonify({'error': 'Invalid customer selection'}), 400
+    
+    # The request stream is closed once we return, so hand the worker its own copy
+    job_file = FileStorage(stream=io.BytesIO(file.read()), filename=file.filename, content_type=file.content_type)
+    
+    # Jobs are measured as their own requests once a worker picks them up
+    if customer_code.upper() == 'DEFAULT':
+        job_id = job_manager.submit(
+            metrics.run_traced, 'jobs', 'DEFAULT',
+            process_default_purchase_order_file, job_file, app.config['UPLOAD_FOLDER'],
+        )
+    else:
+        job_id = job_manager.submit(
+            metrics.run_traced, 'jobs', customer_code,
+            EXTRACTION_MODES[mode], job_file, customer_module, app.config['UPLOAD_FOLDER'],
+        )
+    
+    return jsonify({
+        'job_id': job_id,
+        'status': job_manager.get(job_id)['status'],
+        'status_url': url_for('get_job', job_id=job_id),
+    }), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """API endpoint to get the status and, once finished, the result of a job."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    
+    job['queue_depth'] = job_manager.stats()['queue_depth']
+    return jsonify(job)
+
+@app.route('/api/jobs', methods=['GET'])
+def get_jobs_stats():
+    """API endpoint to get the job queue depth and job counts per state."""
+    return jsonify(job_manager.stats())
+
+@app.route('/api/health', methods=['GET'])
+def get_health():
+    """API endpoint to check that the model backends are reachable."""
+    health = client_manager.health_check()
+    status = 200 if health['ollama']['ok'] else 503
+    return jsonify(health), status
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """API endpoint to get the extraction result cache hit/miss counters."""
+    return jsonify({**result_cache.stats(), 'single_flight': single_flight.stats(), 'idempotency': idempotency_store.stats()})
+
+@app.route('/api/cascade/stats', methods=['GET'])
+def get_cascade_stats():
+    """API endpoint to get the share of documents settled by each cascade tier and its latency."""
+    return jsonify(cascade_stats.snapshot())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Endpoint exposing stage latency histograms, in-flight and error counters in the Prometheus text format."""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/customers', methods=['GET'])
 def get_customers():
     """API endpoint to get a list of all available customers."""
@@ -0,0 +1,311 @@
+"""
+Async serving mode of the purchase order API, with the same routes and JSON
+responses as po_app.py.
+
+Requests wait on Ollama and OpenAI through async clients instead of holding a
+thread each, so one process serves hundreds of extractions at the same time:
+
+    uvicorn po_asgi_app:app --port 5000
+"""
+import json
+import os
+import asyncio
+import hashlib
+import functools
+from contextlib import asynccontextmanager
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse as StarletteJSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from utils import allowed_file
+from customer_handler import get_customer_module, get_all_customers, validate_user_permission
+from po_processor import (
+    process_purchase_order_bytes_async, process_default_purchase_order_bytes_async,
+    stream_default_purchase_order_bytes_async,
+)
+from cascade import process_cascade_purchase_order_bytes, cascade_stats
+from streaming import format_event
+from result_cache import result_cache
+from single_flight import single_flight, idempotency_store
+from model_clients import client_manager
+import metrics
+from preload import preload_backends
+
+metrics.configure_logging()
+
+UPLOAD_FOLDER = 'uploads'
+ALLOWED_EXTENSIONS = {'pdf'}
+
+# Reject request bodies above this size before they are read
+MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 100 * 1024 * 1024))
+# Extractions running at the same time, later requests wait for a free slot
+ASYNC_MAX_CONCURRENCY = int(os.environ.get('ASYNC_MAX_CONCURRENCY', 256))
+# Extraction mode of customer uploads sent without a 'mode' field, as in po_app.py
+EXTRACTION_MODE = os.environ.get('EXTRACTION_MODE', 'local')
+EXTRACTION_MODES = ('local', 'cascade')
+
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+class JSONResponse(StarletteJSONResponse):
+    """JSON response encoded like Flask's jsonify, so both servers return identical bodies."""
+
+    def render(self, content):
+        return json.dumps(content, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+def error(message, status):
+    return JSONResponse({'error': message}, status_code=status)
+
+class BodyTooLarge(Exception):
+    pass
+
+class BodySizeLimitMiddleware:
+    """Reject request bodies above max_bytes with a 413, as Flask does with MAX_CONTENT_LENGTH.
+
+    A Content-Length above the limit is rejected before the body is read. A
+    body sent without one, e.g. chunked, is counted as it is received and
+    rejected once it passes the limit.
+    """
+
+    def __init__(self, app, max_bytes):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        too_large = error(f"Upload exceeds the {self.max_bytes} byte limit", 413)
+        length = dict(scope['headers']).get(b'content-length')
+        if length is not None and length.isdigit() and int(length) > self.max_bytes:
+            await too_large(scope, receive, send)
+            return
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > self.max_bytes:
+                    raise BodyTooLarge()
+            return message
+
+        async def tracked_send(message):
+            nonlocal started
+            if message['type'] == 'http.response.start':
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except BodyTooLarge:
+            if started:
+                raise
+            await too_large(scope, receive, send)
+
+async def read_upload(request):
+    """
+    Read the multipart form of an upload request.
+
+    Returns:
+        tuple: The form, the uploaded file or None, and an error response or None
+    """
+    # Bodies above MAX_CONTENT_LENGTH were rejected by BodySizeLimitMiddleware
+    form = await request.form()
+    file = form.get('file')
+    if file is None or isinstance(file, str):
+        return form, None, error('No file provided', 400)
+    if file.filename == '':
+        return form, None, error('No file selected', 400)
+    if not allowed_file(file.filename, ALLOWED_EXTENSIONS):
+        return form, None, error('Invalid file type', 400)
+    return form, file, None
+
+async def request_fingerprint(request):
+    """Hash the path, form fields and uploaded files of a request."""
+    digest = hashlib.sha256(request.url.path.encode())
+    files = []
+    for name, value in (await request.form()).multi_items():
+        if isinstance(value, str):
+            digest.update(f"{name}={value}\0".encode())
+        else:
+            files.append((name, value))
+    for name, file in files:
+        digest.update(f"{name}:{file.filename}\0".encode())
+        digest.update(hashlib.sha256(await file.read()).digest())
+        await file.seek(0)
+    return digest.hexdigest()
+
+def idempotent(handler):
+    """Replay the stored response of a request repeated with the same Idempotency-Key header, as in po_app.py."""
+    @functools.wraps(handler)
+    async def wrapper(request):
+        key = request.headers.get('idempotency-key')
+        if not key:
+            return await handler(request)
+
+        store_key = (request.url.path, key)
+        fingerprint = await request_fingerprint(request)
+        token = object()
+
+        async def run():
+            stored = idempotency_store.get(store_key)
+            if stored is not None:
+                return None, stored, None
+            response = await handler(request)
+            body = json.loads(response.body) if isinstance(response, JSONResponse) else None
+            if body is not None and response.status_code < 500:
+                idempotency_store.set(store_key, fingerprint, response.status_code, body)
+            return token, (fingerprint, response.status_code, body), response
+
+        owner, (stored_fingerprint, status, body), response = await single_flight.do_async(('idempotency',) + store_key, run)
+        if owner is token:
+            return response
+        if stored_fingerprint != fingerprint:
+            return error('Idempotency-Key was already used with a different request', 422)
+
+        metrics.IDEMPOTENT_REPLAYS.inc(route=request.url.path)
+        return JSONResponse(body, status_code=status, headers={'Idempotent-Replayed': 'true'})
+    return wrapper
+
+@idempotent
+async def process_purchase_order(request):
+    """API endpoint to process a purchase order PDF file."""
+    form, file, response = await read_upload(request)
+    if response is not None:
+        return response
+
+    customer_code = form.get('customer', 'BA')
+    mode = form.get('mode', EXTRACTION_MODE)
+    if mode not in EXTRACTION_MODES:
+        return error('Invalid extraction mode', 400)
+    if not validate_user_permission(form.get('user', None), customer_code):
+        return error('You do not have permission to access this customer', 403)
+
+    customer_module = get_customer_module(customer_code)
+    if not customer_module:
+        return error('Invalid customer selection', 400)
+
+    try:
+        pdf_bytes = await file.read()
+        async with request.app.state.extraction_slots:
+            with metrics.trace('process-purchase-order', customer_code, filename=file.filename):
+                if mode == 'cascade':
+                    # The cascade runs on a worker thread, its escalation calls are synchronous
+                    result = await asyncio.to_thread(
+                        process_cascade_purchase_order_bytes, pdf_bytes, file.filename, customer_module, UPLOAD_FOLDER
+                    )
+                else:
+                    result = await process_purchase_order_bytes_async(pdf_bytes, file.filename, customer_module, UPLOAD_FOLDER)
+        return JSONResponse(result)
+    except Exception as e:
+        return error(str(e), 500)
+
+# ===== DEFAULT CUSTOMER HANDLING =====
+# As in po_app.py, the DEFAULT customer uses standard_via_openai directly
+@idempotent
+async def process_default_purchase_order(request):
+    """API endpoint to process a purchase order PDF file using standard_via_openai directly."""
+    form, file, response = await read_upload(request)
+    if response is not None:
+        return response
+
+    if not validate_user_permission(form.get('user', None), 'DEFAULT'):
+        return error('You do not have permission to access this customer', 403)
+
+    try:
+        pdf_bytes = await file.read()
+        async with request.app.state.extraction_slots:
+            with metrics.trace('process-default-purchase-order', 'DEFAULT', filename=file.filename):
+                result = await process_default_purchase_order_bytes_async(pdf_bytes, UPLOAD_FOLDER)
+        return JSONResponse(result)
+    except Exception as e:
+        return error(str(e), 500)
+
+async def stream_default_purchase_order(request):
+    """API endpoint streaming the line items of a purchase order PDF file as the model generates them."""
+    form, file, response = await read_upload(request)
+    if response is not None:
+        return response
+
+    if not validate_user_permission(form.get('user', None), 'DEFAULT'):
+        return error('You do not have permission to access this customer', 403)
+
+    ndjson = request.headers.get('accept', '').startswith('application/x-ndjson')
+    pdf_bytes = await file.read()
+    filename = file.filename
+
+    async def generate():
+        async with request.app.state.extraction_slots:
+            with metrics.trace('stream-default-purchase-order', 'DEFAULT', filename=filename):
+                async for event, data in stream_default_purchase_order_bytes_async(pdf_bytes, UPLOAD_FOLDER):
+                    yield format_event(event, data, ndjson)
+
+    return StreamingResponse(
+        generate(),
+        media_type='application/x-ndjson' if ndjson else 'text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+async def get_cache_stats(request):
+    """API endpoint to get the extraction result cache hit/miss counters."""
+    return JSONResponse({**result_cache.stats(), 'single_flight': single_flight.stats(), 'idempotency': idempotency_store.stats()})
+
+async def get_cascade_stats(request):
+    """API endpoint to get the share of documents settled by each cascade tier and its latency."""
+    return JSONResponse(cascade_stats.snapshot())
+
+async def get_metrics(request):
+    """Endpoint exposing stage latency histograms, in-flight and error counters in the Prometheus text format."""
+    return Response(metrics.registry.render(), media_type='text/plain; version=0.0.4')
+
+async def get_customers(request):
+    """API endpoint to get a list of all available customers."""
+    return JSONResponse(get_all_customers())
+
+async def get_customer_ship_to(request):
+    """API endpoint to get ship-to information for a specific customer."""
+    customer_module = get_customer_module(request.path_params['customer'])
+    if not customer_module:
+        return error('Invalid customer selection', 400)
+    return JSONResponse(customer_module.ship_to_info)
+
+@asynccontextmanager
+async def lifespan(app):
+    # Created inside the running event loop
+    app.state.extraction_slots = asyncio.Semaphore(ASYNC_MAX_CONCURRENCY)
+    if os.environ.get('PRELOAD_BACKENDS', '0').lower() not in ('0', 'false', 'no'):
+        await asyncio.to_thread(preload_backends)
+    if os.environ.get('MODEL_WARM_UP', '1').lower() not in ('0', 'false', 'no'):
+        client_manager.start_keep_alive()
+    yield
+    client_manager.stop_keep_alive()
+
+routes = [
+    Route('/api/process-purchase-order', process_purchase_order, methods=['POST']),
+    Route('/api/process-default-purchase-order', process_default_purchase_order, methods=['POST']),
+    Route('/api/process-default-purchase-order/stream', stream_default_purchase_order, methods=['POST']),
+    Route('/api/cache/stats', get_cache_stats, methods=['GET']),
+    Route('/api/cascade/stats', get_cascade_stats, methods=['GET']),
+    Route('/metrics', get_metrics, methods=['GET']),
+    Route('/api/customers', get_customers, methods=['GET']),
+    Route('/api/customer-ship-to/{customer}', get_customer_ship_to, methods=['GET']),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*']),
+        Middleware(BodySizeLimitMiddleware, max_bytes=MAX_CONTENT_LENGTH),
+    ],
+    lifespan=lifespan,
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, port=int(os.environ.get('PORT', 5000)))
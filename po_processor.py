@@ -1,64 +1,360 @@
 import os
 import json
+import asyncio
+import logging
+import tempfile
+from contextlib import contextmanager
 from werkzeug.utils import secure_filename
 from pdf_processing import extract_text_from_pdf, split_text
-from llm_processing import embed_and_store, retrieve_most_relevant_chunk_with_confidence, extract_information_with_llm, refine_extracted_information
-from utils import post_process_extracted_info
+from llm_processing import (
+    extract_information_with_llm, refine_extracted_information, extract_structured_information,
+    extract_information_with_llm_async, refine_extracted_information_async, extract_structured_information_async,
+)
+from retrieval import retrieve_relevant_text
+from extraction_rules import apply_customer_rules, resolved_fields
+from utils import post_process_extracted_info, CANONICAL_FIELDS
+from field_repair import repair_fields, repair_fields_async
+from result_cache import result_cache, make_key, prompt_version
+from single_flight import single_flight
+import metrics
 
-def process_purchase_order_file(file, customer_module, upload_folder):
+logger = logging.getLogger(__name__)
+
+def _extraction_plan(customer_module, single_pass, fields):
+    """Return whether to extract in a single pass, and the field_map of the fields to extract."""
+    if single_pass is None:
+        single_pass = getattr(customer_module, 'single_pass', False)
+    if fields is None or set(CANONICAL_FIELDS) <= set(fields):
+        return single_pass, customer_module.field_map
+    # The customer's extract + refine prompts always ask for every field, only
+    # the single-pass output format can be limited to the missing ones
+    field_map = {label: canonical for label, canonical in customer_module.field_map.items() if canonical in fields}
+    return True, field_map
+
+def extract_fields(relevant_text, customer_module, single_pass=None, fields=None):
     """
-    Process a purchase order PDF file and extract information.
+    Extract the canonical fields from the relevant text with the LLM.
     
     Args:
-        file: The uploaded file object
+        relevant_text: The purchase order text to extract from
         customer_module: The customer module to use for processing
-        upload_folder: The folder to save the uploaded file
+        single_pass: Use one JSON-constrained call instead of extract + refine,
+            defaults to the customer module's single_pass setting
+        fields: The canonical fields to extract, defaults to all. A subset is
+            extracted with one JSON-constrained call asking for those fields only
         
     Returns:
-        dict: The extracted and processed information
+        dict: The refined information keyed by the canonical field names
     """
-    filename = secure_filename(file.filename)
-    filepath = os.path.join(upload_folder, filename)
+    single_pass, field_map = _extraction_plan(customer_module, single_pass, fields)
+    
+    if single_pass:
+        with metrics.stage('llm_single_pass'):
+            return extract_structured_information(
+                relevant_text,
+                customer_module.extract_prompt,
+                field_map,
+                getattr(customer_module, 'single_pass_instructions', ""),
+            )
     
+    # Initial extraction with the customer's labels, then refinement to the canonical format
+    with metrics.stage('llm_extract'):
+        initial_extracted_info = extract_information_with_llm(relevant_text, customer_module.extract_prompt)
+    with metrics.stage('llm_refine'):
+        refined_info = refine_extracted_information(initial_extracted_info, customer_module.refine_prompt)
+        return json.loads(refined_info)
+
+async def extract_fields_async(relevant_text, customer_module, single_pass=None, fields=None):
+    """Async variant of extract_fields, the event loop serves other requests while the LLM runs."""
+    single_pass, field_map = _extraction_plan(customer_module, single_pass, fields)
+    
+    if single_pass:
+        with metrics.stage('llm_single_pass'):
+            return await extract_structured_information_async(
+                relevant_text,
+                customer_module.extract_prompt,
+                field_map,
+                getattr(customer_module, 'single_pass_instructions', ""),
+            )
+    
+    with metrics.stage('llm_extract'):
+        initial_extracted_info = await extract_information_with_llm_async(relevant_text, customer_module.extract_prompt)
+    with metrics.stage('llm_refine'):
+        refined_info = await refine_extracted_information_async(initial_extracted_info, customer_module.refine_prompt)
+        return json.loads(refined_info)
+
+# PDFs larger than this are spooled to a temp file instead of parsed from memory
+SPOOL_THRESHOLD_BYTES = int(os.environ.get('PDF_SPOOL_THRESHOLD_BYTES', 20 * 1024 * 1024))
+
+@contextmanager
+def pdf_source(pdf_bytes, upload_folder):
+    """Yield the PDF bytes, or the path of a unique temp file for PDFs above the spool threshold."""
+    if len(pdf_bytes) <= SPOOL_THRESHOLD_BYTES:
+        yield pdf_bytes
+        return
+    
+    fd, filepath = tempfile.mkstemp(suffix='.pdf', dir=upload_folder)
     try:
-        # Save the file temporarily
-        file.save(filepath)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(pdf_bytes)
+        yield filepath
+    finally:
+        # Clean up the temporary file
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+def parse_purchase_order(pdf_bytes, customer_module, upload_folder):
+    """
+    Run the CPU-bound stage: text extraction and the customer's deterministic rules.
+    
+    Args:
+        pdf_bytes: The PDF file content
+        customer_module: The customer module to use for processing
+        upload_folder: The folder to spool large files to
         
-        # Get the prompts from the customer module
-        extract_prompt = customer_module.extract_prompt
-        refine_prompt = customer_module.refine_prompt
+    Returns:
+        dict: The selected page text under 'raw_text' and the rule results under 'rule_results'
+    """
+    with metrics.stage('pdf_text'), pdf_source(pdf_bytes, upload_folder) as source:
+        raw_text = extract_text_from_pdf(source, getattr(customer_module, 'page_selection', None))
+    with metrics.stage('rules'):
+        rule_results = apply_customer_rules(raw_text, customer_module)
+    return {'raw_text': raw_text, 'rule_results': rule_results}
+
+def select_model_input(parsed, customer_module, filename):
+    """
+    Resolve the fields the rules found and retrieve the text the LLM extracts the others from.
+    
+    Args:
+        parsed: The output of parse_purchase_order
+        customer_module: The customer module to use for processing
+        filename: The uploaded file name, for logging
         
-        # Step 1: Process the PDF
-        raw_text = extract_text_from_pdf(filepath, customer_module.__name__.split('_')[-1])
+    Returns:
+        tuple: The fields resolved by the rules, and the relevant text for the
+        LLM or None when the rules resolved every field
+    """
+    raw_text = parsed['raw_text']
+    rule_results = parsed['rule_results']
+    rule_info = resolved_fields(rule_results)
+    logger.debug("Rule extraction for %s: %s", filename, rule_results)
+    metrics.annotate(rule_fields=sorted(rule_info))
+    
+    if all(field in rule_info for field in CANONICAL_FIELDS):
+        # Every field is known with high confidence, the LLM is not needed
+        metrics.annotate(llm_skipped=True)
+        return rule_info, None
+    
+    with metrics.stage('split'):
         text_chunks = split_text(raw_text)
-        vectorstore = embed_and_store(text_chunks)
-        
-        query = "Purchase Order Number, Quantity in kg, Required Delivery Date, Material Number, deliver to"
-        relevant_text = retrieve_most_relevant_chunk_with_confidence(vectorstore, query, threshold=0.80)
-        
-        # Step 2: Initial Extraction
-        initial_extracted_info = extract_information_with_llm(relevant_text, extract_prompt)
-        print(f"\n--- Initial Extracted Information for {filename} (Step 1) ---")
+    
+    # Customers can pin a retrieval strategy, otherwise RETRIEVAL_STRATEGY applies
+    query = "Purchase Order Number, Quantity in kg, Required Delivery Date, Material Number, deliver to"
+    with metrics.stage('retrieval'):
+        relevant_text, retrieval_strategy = retrieve_relevant_text(
+            text_chunks, query, getattr(customer_module, 'retrieval_strategy', None)
+        )
+    metrics.annotate(retrieval_strategy=retrieval_strategy, chunks=len(text_chunks))
+    return rule_info, relevant_text
+
+def unresolved_fields(rule_info):
+    """Return the canonical fields the rules did not resolve, the only ones the LLM is asked for."""
+    return [field for field in CANONICAL_FIELDS if field not in rule_info]
+
+def finish_purchase_order(refined_info_dict, customer_module, filename, raw_text=None, extracted=None):
+    """
+    Post-process the refined information into the final output, repairing failed fields from raw_text if given.
+
+    The values before post-processing, with the repaired ones, are copied into
+    extracted if given, e.g. the delivery address its ship-to code was matched from.
+    """
+    logger.debug("Refined information for %s: %s", filename, refined_info_dict)
+    extracted = extracted if extracted is not None else {}
+    extracted.update(refined_info_dict)
+    with metrics.stage('post_process'):
+        final_info = post_process_extracted_info(refined_info_dict, customer_module)
+    if raw_text is not None:
+        # Fields failing validation are asked for again from the text near their label
+        final_info = repair_fields(final_info, raw_text, customer_module, extracted)
+    logger.debug("Final output for %s: %s", filename, final_info)
+    return final_info
+
+def complete_purchase_order(parsed, customer_module, filename):
+    """
+    Run the model stage on a parsed purchase order: retrieval, LLM extraction and post-processing.
+    
+    Args:
+        parsed: The output of parse_purchase_order
+        customer_module: The customer module to use for processing
+        filename: The uploaded file name, for logging
         
-        # Step 3: Refinement
-        refined_info = refine_extracted_information(initial_extracted_info, refine_prompt)
-        print(f"\n--- Refined Information for {filename} (Step 2) ---")
-        print(refined_info)
+    Returns:
+        dict: The extracted and processed information
+    """
+    refined_info_dict, relevant_text = select_model_input(parsed, customer_module, filename)
+    if relevant_text is not None:
+        # Extraction and refinement, the LLM only fills the fields the rules could not resolve
+        rule_info = refined_info_dict
+        refined_info_dict = extract_fields(relevant_text, customer_module, fields=unresolved_fields(rule_info))
+        refined_info_dict.update(rule_info)
+    return finish_purchase_order(refined_info_dict, customer_module, filename, parsed['raw_text'])
+
+def purchase_order_cache_key(pdf_bytes, customer_module):
+    """Build the result cache key of a PDF processed for a customer."""
+    customer_code = customer_module.__name__.split('_')[-1]
+    return make_key(pdf_bytes, customer_code, prompt_version(customer_module))
+
+def process_purchase_order_file(file, customer_module, upload_folder):
+    """
+    Process a purchase order PDF file and extract information.
+    
+    Args:
+        file: The uploaded file object
+        customer_module: The customer module to use for processing
+        upload_folder: The folder to spool large files to
         
-        # Process the refined information
-        refined_info_dict = json.loads(refined_info)
+    Returns:
+        dict: The extracted and processed information
+    """
+    filename = secure_filename(file.filename)
+    pdf_bytes = file.read()
+    
+    # Return the stored result if this PDF was already processed with the same prompts
+    cache_key = purchase_order_cache_key(pdf_bytes, customer_module)
+    cached_info = result_cache.get(cache_key)
+    metrics.annotate(cache_hit=cached_info is not None)
+    if cached_info is not None:
+        return cached_info
+    
+    # Identical uploads already being processed share that run's result
+    return single_flight.do(cache_key, _process_uncached, pdf_bytes, cache_key, customer_module, upload_folder, filename)
+
+def _process_uncached(pdf_bytes, cache_key, customer_module, upload_folder, filename):
+    parsed = parse_purchase_order(pdf_bytes, customer_module, upload_folder)
+    final_info = complete_purchase_order(parsed, customer_module, filename)
+    
+    result_cache.set(cache_key, final_info)
+    return final_info
+
+def process_default_purchase_order_file(file, upload_folder):
+    """
+    Process a purchase order PDF file with the DEFAULT (OpenAI) extraction.
+    
+    Args:
+        file: The uploaded file object
+        upload_folder: The folder to spool large files to
         
-        # Step 4: Post-process the extracted information
-        final_info = post_process_extracted_info(refined_info_dict, customer_module)
+    Returns:
+        list: The extracted line items as returned by standard_via_openai
+    """
+    # The DEFAULT customer bypasses the regular processing flow and uses
+    # standard_via_openai.py directly
+    import standard_via_openai
+    
+    with pdf_source(file.read(), upload_folder) as source:
+        return standard_via_openai.extract_po_data(source)
+
+async def process_purchase_order_bytes_async(pdf_bytes, filename, customer_module, upload_folder):
+    """
+    Async variant of process_purchase_order_file for the ASGI server.
+    
+    The CPU-bound stages and the cache run in worker threads, the LLM calls
+    are awaited, so a request holds no thread while it waits on Ollama.
+    
+    Args:
+        pdf_bytes: The PDF file content
+        filename: The uploaded file name
+        customer_module: The customer module to use for processing
+        upload_folder: The folder to spool large files to
         
-        # Step 5: Final Output Logging
-        print(f"\n===== FINAL OUTPUT for {filename} (Step 3) =====")
-        print(json.dumps(final_info, indent=4))
-        print("=================================")
+    Returns:
+        dict: The extracted and processed information
+    """
+    filename = secure_filename(filename)
+    
+    cache_key = purchase_order_cache_key(pdf_bytes, customer_module)
+    cached_info = await asyncio.to_thread(result_cache.get, cache_key)
+    metrics.annotate(cache_hit=cached_info is not None)
+    if cached_info is not None:
+        return cached_info
+    
+    return await single_flight.do_async(
+        cache_key, _process_uncached_async, pdf_bytes, cache_key, customer_module, upload_folder, filename
+    )
+
+async def _process_uncached_async(pdf_bytes, cache_key, customer_module, upload_folder, filename):
+    parsed = await asyncio.to_thread(parse_purchase_order, pdf_bytes, customer_module, upload_folder)
+    refined_info_dict, relevant_text = await asyncio.to_thread(select_model_input, parsed, customer_module, filename)
+    if relevant_text is not None:
+        rule_info = refined_info_dict
+        refined_info_dict = await extract_fields_async(relevant_text, customer_module, fields=unresolved_fields(rule_info))
+        refined_info_dict.update(rule_info)
+    extracted = {}
+    final_info = await asyncio.to_thread(finish_purchase_order, refined_info_dict, customer_module, filename, None, extracted)
+    final_info = await repair_fields_async(final_info, parsed['raw_text'], customer_module, extracted)
+    
+    await asyncio.to_thread(result_cache.set, cache_key, final_info)
+    return final_info
+
+async def process_default_purchase_order_bytes_async(pdf_bytes, upload_folder):
+    """Async variant of process_default_purchase_order_file for the ASGI server."""
+    import standard_via_openai
+    
+    # Large PDFs are read from a spooled file, as in the sync route
+    with pdf_source(pdf_bytes, upload_folder) as source:
+        return await standard_via_openai.extract_po_data_async(source)
+
+def stream_default_purchase_order_file(file, upload_folder):
+    """
+    Process a purchase order PDF file with the streaming DEFAULT (OpenAI) extraction.
+    
+    The file is read right away, the extraction runs while the returned
+    generator is consumed.
+    
+    Args:
+        file: The uploaded file object
+        upload_folder: The folder to spool large files to
         
-        return final_info
+    Returns:
+        generator: The (event, data) pairs of standard_via_openai.stream_po_data
+    """
+    import standard_via_openai
+    
+    pdf_bytes = file.read()
+    
+    def events():
+        with pdf_source(pdf_bytes, upload_folder) as source:
+            yield from standard_via_openai.stream_po_data(source)
+    
+    return events()
+
+async def stream_default_purchase_order_bytes_async(pdf_bytes, upload_folder):
+    """Async variant of stream_default_purchase_order_file for the ASGI server."""
+    import standard_via_openai
+    
+    with pdf_source(pdf_bytes, upload_folder) as source:
+        async for event in standard_via_openai.stream_po_data_async(source):
+            yield event
+
+def process_purchase_order_files(files, customer_module, upload_folder, max_workers=4):
+    """
+    Process several purchase order PDF files through the pipelined stage executors.
+    
+    PDF parsing runs in a process pool and the LLM calls in max_workers threads,
+    so parsing of the next files overlaps with the model calls of earlier ones.
+    
+    Args:
+        files: The uploaded file objects
+        customer_module: The customer module to use for processing
+        upload_folder: The folder to spool large files to
+        max_workers: The maximum number of files waiting on the LLM at the same time
         
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(filepath):
-            os.remove(filepath)
+    Returns:
+        tuple: One entry per file, in upload order, holding either the
+        extracted information under 'result' or the failure under 'error',
+        and the occupancy report of each stage
+    """
+    from pipeline import get_pipeline
+    
+    documents = [(file.filename, file.read()) for file in files]
+    return get_pipeline().run(documents, customer_module, upload_folder, llm_workers=max_workers)
@@ -0,0 +1,45 @@
+import importlib
+import logging
+import time
+from customer_registry import BUILTIN_CUSTOMERS
+
+logger = logging.getLogger(__name__)
+
+# Heavy dependencies the request paths import on first use
+HEAVY_MODULES = (
+    'fitz',
+    'numpy',
+    'openai',
+    'langchain_ollama',
+    'langchain.text_splitter',
+    'langchain.vectorstores',
+    'embedding_cache',
+    'ship_to_index',
+    'pipeline',
+)
+
+def preload_backends(modules=None):
+    """
+    Import the heavy backends and customer modules right away instead of on
+    the first request. Call it in a pre-forking parent (e.g. gunicorn --preload)
+    so the workers share the loaded modules instead of each importing them.
+    
+    Args:
+        modules: The modules to import, defaults to HEAVY_MODULES and every built-in customer module
+        
+    Returns:
+        dict: The import seconds of each module, None for modules that are not installed
+    """
+    if modules is None:
+        modules = HEAVY_MODULES + tuple(module_name for module_name, _ in BUILTIN_CUSTOMERS.values())
+    timings = {}
+    for name in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.warning("Could not preload %s: %s", name, e)
+            timings[name] = None
+            continue
+        timings[name] = round(time.perf_counter() - start, 4)
+    return timings
@@ -0,0 +1,178 @@
+import logging
+import os
+import re
+from collections import Counter
+from functools import lru_cache
+from page_selection import score_page, is_boilerplate
+
+logger = logging.getLogger(__name__)
+
+# Maximum prompt tokens of document text, customers override it with a
+# prompt_token_budget attribute in their module
+TOKEN_BUDGET = int(os.environ.get('OPENAI_PROMPT_TOKEN_BUDGET', 6000))
+
+# Headings that start a section of legal boilerplate running to the end of the page
+BOILERPLATE_HEADINGS = (
+    'terms and conditions', 'general terms', 'general conditions', 'standard terms',
+    'conditions of purchase', 'purchase order terms', 'appendix',
+)
+# Lowercase words allowed in a capitalized heading line
+HEADING_CONNECTORS = {'and', 'of', 'for', 'the', 'to', '&'}
+
+# Page numbers differ on every page but are the same line otherwise
+PAGE_NUMBER_PATTERN = re.compile(r'\bpage\s*\d+(\s*(of|/)\s*\d+)?\b', re.I)
+
+@lru_cache(maxsize=None)
+def _encoding(model):
+    try:
+        import tiktoken
+    except ImportError:
+        logger.warning("tiktoken is not installed, prompt tokens are estimated at 4 characters per token")
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding('o200k_base')
+
+def count_tokens(text, model='gpt-4o'):
+    """Count the tokens of text with tiktoken, or estimate them at 4 characters per token."""
+    encoding = _encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text, max_tokens, model='gpt-4o'):
+    """Cut text down to at most max_tokens tokens."""
+    encoding = _encoding(model)
+    if encoding is None:
+        return text[:max_tokens * 4]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+
+def _line_key(line):
+    return PAGE_NUMBER_PATTERN.sub('page #', ' '.join(line.split()).lower())
+
+def repeated_lines(page_texts, min_share=0.5):
+    """
+    Find the header and footer lines printed on most pages.
+
+    Args:
+        page_texts: The text of each page
+        min_share: Fraction of the pages a line must appear on, at least two
+
+    Returns:
+        set: The normalized keys of the repeated lines
+    """
+    if len(page_texts) < 2:
+        return set()
+    counts = Counter()
+    for text in page_texts:
+        counts.update({_line_key(line) for line in text.splitlines() if line.strip()})
+    min_pages = max(2, round(len(page_texts) * min_share))
+    return {key for key, count in counts.items() if count >= min_pages}
+
+def _is_boilerplate_heading(line):
+    """Whether a line is a standalone heading, e.g. "12. TERMS AND CONDITIONS:", not "General Terms: Net 30 days"."""
+    heading = line.strip(' \t:.-*#0123456789')
+    if len(heading) > 60 or not heading.lower().startswith(BOILERPLATE_HEADINGS):
+        return False
+    # A heading holds no value, no sentence punctuation and only capitalized words
+    if any(char.isdigit() or char in ':;,.' for char in heading):
+        return False
+    return all(word[0].isupper() or word in HEADING_CONNECTORS for word in heading.split())
+
+def _join_lines(lines):
+    return "\n".join(lines) + "\n" if lines else ""
+
+def clean_page(text, repeated, seen, truncate=True):
+    """
+    Drop repeated lines already kept on an earlier page and, if truncate is set,
+    everything from a boilerplate heading to the end of the page when that
+    part reads as boilerplate.
+
+    Returns:
+        tuple: The cleaned text, the number of repeated and of boilerplate lines removed
+    """
+    kept = []
+    lines = text.splitlines()
+    repeated_removed = 0
+    for index, line in enumerate(lines):
+        if truncate and _is_boilerplate_heading(line) and is_boilerplate("\n".join(lines[index:])):
+            return _join_lines(kept), repeated_removed, len(lines) - index
+        key = _line_key(line)
+        if key in repeated:
+            # The first occurrence stays, a repeated header can hold the PO number
+            if key in seen:
+                repeated_removed += 1
+                continue
+            seen.add(key)
+        kept.append(line)
+    return _join_lines(kept), repeated_removed, 0
+
+def assemble_prompt_text(page_texts, selected_pages=None, budget=None, model='gpt-4o'):
+    """
+    Build the document text of a prompt within a token budget.
+
+    Repeated headers and footers are detected across all pages, then the
+    selected pages are cleaned. Pages are dropped lowest score first, never
+    the first page, until the text fits the budget, and the text is truncated
+    as a last resort.
+
+    Args:
+        page_texts: The text of every page of the document
+        selected_pages: The indices of the pages to use, defaults to all
+        budget: The maximum number of tokens, defaults to TOKEN_BUDGET
+        model: The model whose tokenizer counts the tokens
+
+    Returns:
+        tuple: The prompt text and a report of the tokens saved
+    """
+    budget = budget or TOKEN_BUDGET
+    if selected_pages is None:
+        selected_pages = list(range(len(page_texts)))
+    original = "".join(page_texts[index] for index in selected_pages)
+
+    repeated = repeated_lines(page_texts)
+    # The first selected page and the best scoring one hold the order, they are never cut short
+    protected = set(selected_pages[:1])
+    if selected_pages:
+        protected.add(max(selected_pages, key=lambda index: score_page(page_texts[index])))
+    seen = set()
+    cleaned = {}
+    repeated_removed = boilerplate_removed = 0
+    for index in selected_pages:
+        text, repeated_count, boilerplate_count = clean_page(
+            page_texts[index], repeated, seen, truncate=index not in protected
+        )
+        cleaned[index] = text
+        repeated_removed += repeated_count
+        boilerplate_removed += boilerplate_count
+
+    page_tokens = {index: count_tokens(text, model) for index, text in cleaned.items()}
+    dropped_pages = []
+    first_page = selected_pages[0] if selected_pages else None
+    droppable = sorted((index for index in cleaned if index != first_page), key=lambda i: score_page(cleaned[i]))
+    while sum(page_tokens.values()) > budget and droppable:
+        index = droppable.pop(0)
+        dropped_pages.append(index)
+        del page_tokens[index]
+
+    text = "".join(cleaned[index] for index in sorted(page_tokens))
+    truncated = sum(page_tokens.values()) > budget
+    if truncated:
+        text = truncate_to_tokens(text, budget, model)
+
+    report = {
+        'tokens_before': count_tokens(original, model),
+        'tokens_after': count_tokens(text, model),
+        'repeated_lines_removed': repeated_removed,
+        'boilerplate_lines_removed': boilerplate_removed,
+        'pages_dropped': sorted(dropped_pages),
+        'truncated': truncated,
+        'budget': budget,
+    }
+    report['tokens_saved'] = report['tokens_before'] - report['tokens_after']
+    return text, report
+
+def token_budget(module):
+    """Return the customer's prompt_token_budget, or TOKEN_BUDGET."""
+    return getattr(module, 'prompt_token_budget', None) or TOKEN_BUDGET
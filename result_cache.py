@@ -0,0 +1,138 @@
+import hashlib
+import inspect
+import json
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', os.path.join('cache', 'results'))
+CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 10000))
+CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', '1').lower() not in ('0', 'false', 'no')
+
+# Module attributes whose source defines what an extraction returns for a customer.
+# Editing any of them changes the prompt version and so invalidates cached results.
+# The master data is included as the post-processing copies it into the result.
+PROMPT_ATTRIBUTES = (
+    'extract_prompt', 'refine_prompt', 'extract_po_data',
+    'field_map', 'single_pass', 'single_pass_instructions', 'extract_rules', 'page_selection',
+    'prompt_token_budget', 'build_messages', 'COMPLETION_OPTIONS',
+    'sold_to_info', 'ship_to_info',
+)
+
+@lru_cache(maxsize=4096)
+def prompt_version(customer_module):
+    """Hash the prompt source of a customer module."""
+    digest = hashlib.sha256()
+    for name in PROMPT_ATTRIBUTES:
+        func = getattr(customer_module, name, None)
+        if func is None:
+            continue
+        try:
+            source = inspect.getsource(func)
+        except (OSError, TypeError):
+            source = repr(func)
+        digest.update(name.encode())
+        digest.update(source.encode())
+    return digest.hexdigest()
+
+def make_key(pdf_bytes, customer_code, version):
+    """Build the cache key for a PDF processed for a customer with a prompt version."""
+    digest = hashlib.sha256(pdf_bytes).hexdigest()
+    return hashlib.sha256(f"{digest}:{customer_code.upper()}:{version}".encode()).hexdigest()
+
+class ResultCache:
+    """Disk-backed extraction result cache with LRU eviction by entry count and size."""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, enabled=CACHE_ENABLED):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size in bytes, least recently used first
+        self._total_bytes = 0
+        if self.enabled:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._load_index()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load_index(self):
+        """Rebuild the LRU order from the files left by a previous run."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, name))
+            entries.append((stat.st_mtime, name[:-len('.json')], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    def get(self, key):
+        """Return the cached result for key, or None on a miss."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            try:
+                with open(self._path(key), 'r') as f:
+                    value = json.load(f)
+                # Touch the file so the LRU order survives a restart
+                os.utime(self._path(key))
+            except (OSError, ValueError):
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Store a result and evict the least recently used entries over the limits."""
+        if not self.enabled:
+            return
+        data = json.dumps(value).encode()
+        with self._lock:
+            tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            while self._entries and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        self._total_bytes -= self._entries.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def stats(self):
+        """Return hit/miss counters and the current cache size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+            }
+
+# Process-wide cache shared by the Ollama and OpenAI pipelines
+result_cache = ResultCache()
@@ -0,0 +1,63 @@
+import math
+import os
+import re
+from collections import Counter
+
+# 'lexical' ranks chunks with BM25, 'vector' embeds them and uses FAISS similarity search
+RETRIEVAL_STRATEGY = os.environ.get('RETRIEVAL_STRATEGY', 'lexical')
+
+# Terms that show up next to the purchase order fields we extract
+PO_FIELD_KEYWORDS = [
+    'purchase', 'order', 'po', 'number', 'no', 'quantity', 'qty', 'kg', 'lb',
+    'delivery', 'date', 'required', 'promised', 'material', 'item', 'ship', 'deliver', 'address',
+]
+
+def tokenize(text):
+    """Lowercase a text and split it into alphanumeric tokens."""
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+def bm25_scores(chunks, query_terms, k1=1.5, b=0.75):
+    """Score each chunk against the query terms with Okapi BM25."""
+    tokenized = [tokenize(chunk) for chunk in chunks]
+    avg_length = sum(len(tokens) for tokens in tokenized) / len(tokenized) or 1
+    document_frequency = Counter(term for tokens in tokenized for term in set(tokens))
+    terms = set(query_terms)
+
+    scores = []
+    for tokens in tokenized:
+        term_counts = Counter(tokens)
+        score = 0.0
+        for term in terms:
+            tf = term_counts.get(term, 0)
+            if not tf:
+                continue
+            idf = math.log(1 + (len(chunks) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(tokens) / avg_length))
+        scores.append(score)
+    return scores
+
+def retrieve_relevant_text(text_chunks, query, strategy=None):
+    """
+    Pick the text to send to the LLM from the document chunks.
+    
+    Args:
+        text_chunks: The chunks of the document text
+        query: The description of the fields to extract
+        strategy: 'lexical' or 'vector', defaults to RETRIEVAL_STRATEGY
+        
+    Returns:
+        tuple: The relevant text and the name of the strategy that ran
+    """
+    # A single chunk is the whole document, there is nothing to rank
+    if len(text_chunks) <= 1:
+        return (text_chunks[0] if text_chunks else ""), 'passthrough'
+
+    strategy = strategy or RETRIEVAL_STRATEGY
+    if strategy == 'vector':
+        from llm_processing import embed_and_store, retrieve_most_relevant_chunk_with_confidence
+        vectorstore = embed_and_store(text_chunks)
+        return retrieve_most_relevant_chunk_with_confidence(vectorstore, query, threshold=0.80), 'vector'
+
+    scores = bm25_scores(text_chunks, tokenize(query) + PO_FIELD_KEYWORDS)
+    best = max(range(len(text_chunks)), key=lambda i: scores[i])
+    return text_chunks[best], 'lexical'
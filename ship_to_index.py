@@ -0,0 +1,142 @@
+import os
+import re
+import threading
+from collections import Counter
+from difflib import SequenceMatcher
+import numpy as np
+
+# Candidates retrieved from the index and re-ranked with SequenceMatcher
+INDEX_CANDIDATES = int(os.environ.get('SHIP_TO_INDEX_CANDIDATES', 20))
+
+NGRAM_SIZE = 3
+
+def normalize_address(text):
+    """Lowercase an address and reduce punctuation and whitespace runs to single spaces."""
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', str(text).lower()).split())
+
+def address_ngrams(text):
+    """Count the character n-grams of a normalized address, word boundaries included."""
+    padded = f" {normalize_address(text)} "
+    return Counter(padded[index:index + NGRAM_SIZE] for index in range(len(padded) - NGRAM_SIZE + 1))
+
+class ShipToIndex:
+    """Character n-gram TF-IDF index over the addresses of a ship_to_info dictionary.
+
+    Candidates are scored by cosine similarity through postings lists stored
+    as numpy arrays, then the top candidates are re-ranked with the same
+    SequenceMatcher ratio as utils.find_best_match.
+    """
+
+    def __init__(self, ship_info):
+        self.ship_info = ship_info
+        self.keys = list(ship_info.keys())
+        self.values = list(ship_info.values())
+        self.vocabulary = {}
+        # Word postings for quoted_candidates, built on first use
+        self._word_postings = None
+        self._word_lock = threading.Lock()
+
+        doc_ids, term_ids, counts = [], [], []
+        for doc_id, value in enumerate(self.values):
+            for ngram, count in address_ngrams(value).items():
+                doc_ids.append(doc_id)
+                term_ids.append(self.vocabulary.setdefault(ngram, len(self.vocabulary)))
+                counts.append(count)
+        doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        counts = np.asarray(counts, dtype=np.float32)
+
+        document_frequency = np.bincount(term_ids, minlength=len(self.vocabulary))
+        self.idf = (np.log((1 + len(self.values)) / (1 + document_frequency)) + 1).astype(np.float32)
+        weights = (1 + np.log(counts)) * self.idf[term_ids]
+        norms = np.sqrt(np.bincount(doc_ids, weights=weights ** 2, minlength=len(self.values)))
+        weights /= np.maximum(norms[doc_ids], 1e-12)
+
+        # Postings lists: the documents and weights of term t are at term_offsets[t]:term_offsets[t + 1]
+        order = np.argsort(term_ids, kind='stable')
+        self.posting_docs = doc_ids[order]
+        self.posting_weights = weights[order].astype(np.float32)
+        self.term_offsets = np.concatenate(([0], np.cumsum(document_frequency))).astype(np.int64)
+
+    def candidates(self, deliver_to, k=INDEX_CANDIDATES):
+        """Return the indices of the k entries with the highest TF-IDF similarity, best first."""
+        query = [(self.vocabulary[ngram], count) for ngram, count in address_ngrams(deliver_to).items() if ngram in self.vocabulary]
+        if not query:
+            return []
+        term_ids = np.array([term_id for term_id, _ in query])
+        query_weights = (1 + np.log(np.array([count for _, count in query], dtype=np.float32))) * self.idf[term_ids]
+
+        starts, ends = self.term_offsets[term_ids], self.term_offsets[term_ids + 1]
+        docs = np.concatenate([self.posting_docs[start:end] for start, end in zip(starts, ends)])
+        weights = np.concatenate([
+            self.posting_weights[start:end] * weight for start, end, weight in zip(starts, ends, query_weights)
+        ])
+        scores = np.bincount(docs, weights=weights, minlength=len(self.values))
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[scores[top] > 0]
+        return top[np.argsort(-scores[top], kind='stable')].tolist()
+
+    def find_best_match(self, deliver_to, threshold=0.3, k=INDEX_CANDIDATES):
+        """Find the best matching ship-to code for a delivery address, or "N/A"."""
+        best_match = None
+        highest_ratio = 0.0
+        # Dictionary order breaks ties, as in utils.find_best_match
+        for index in sorted(self.candidates(deliver_to, k)):
+            ratio = SequenceMatcher(None, deliver_to, self.values[index]).ratio()
+            if ratio > highest_ratio:
+                highest_ratio = ratio
+                best_match = self.keys[index]
+
+        if highest_ratio < threshold:
+            return "N/A"
+        return best_match
+
+    def _words(self):
+        with self._word_lock:
+            if self._word_postings is None:
+                words = [set(re.findall(r'\w+', value.lower())) for value in self.values]
+                frequency = Counter(word for value_words in words for word in value_words)
+                # Each address is posted under its rarest word only, so few addresses share a posting
+                postings = {}
+                for index, value_words in enumerate(words):
+                    if value_words:
+                        rarest = min(value_words, key=lambda word: (frequency[word], word))
+                        postings.setdefault(rarest, []).append(index)
+                self._value_words = words
+                self._word_postings = postings
+            return self._word_postings, self._value_words
+
+    def quoted_candidates(self, text):
+        """
+        Return the addresses that can occur verbatim in the text.
+
+        An address quoted with word boundaries has all of its words among the
+        text's words, so only the addresses passing that test need the
+        word-boundary search of extraction_rules.match_ship_to.
+        """
+        postings, value_words = self._words()
+        text_words = set(re.findall(r'\w+', text.lower()))
+        candidates = []
+        for word in text_words:
+            for index in postings.get(word, ()):
+                if value_words[index] <= text_words:
+                    candidates.append(self.values[index])
+        return candidates
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def clear_ship_to_indexes():
+    """Drop every built index, e.g. when a customer definition is reloaded."""
+    with _indexes_lock:
+        _indexes.clear()
+
+def get_ship_to_index(ship_info):
+    """Return the index of a ship_to_info dictionary, built on first use and rebuilt when its size changes."""
+    with _indexes_lock:
+        index = _indexes.get(id(ship_info))
+        if index is None or index.ship_info is not ship_info or len(index.keys) != len(ship_info):
+            index = _indexes[id(ship_info)] = ShipToIndex(ship_info)
+        return index
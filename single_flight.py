@@ -0,0 +1,130 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+import metrics
+
+# Seconds an Idempotency-Key response is replayed for
+IDEMPOTENCY_TTL = float(os.environ.get('IDEMPOTENCY_TTL', 24 * 60 * 60))
+# Idempotency-Key responses kept, the oldest are dropped past this
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get('IDEMPOTENCY_MAX_ENTRIES', 10000))
+
+class SingleFlight:
+    """Coalesce identical in-flight computations.
+
+    The first caller of a key runs the computation, callers arriving with the
+    same key while it runs wait for that result instead of starting their
+    own. Failures are shared the same way. Threads and asyncio tasks are
+    coalesced separately.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _coalesced(self):
+        self.coalesced += 1
+        record = metrics.current_trace()
+        metrics.COALESCED.inc(route=record['route'] if record else 'none')
+        metrics.annotate(coalesced=True)
+
+    def do(self, key, func, *args, **kwargs):
+        """Return func(*args, **kwargs), or the result of the call already running for key."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.leaders += 1
+            else:
+                self._coalesced()
+        if not leader:
+            return future.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def do_async(self, key, func, *args, **kwargs):
+        """Await func(*args, **kwargs), or the result of the call already running for key."""
+        future = self._async_calls.get(key)
+        if future is not None:
+            with self._lock:
+                self._coalesced()
+            # A cancelled waiter must not cancel the computation the others wait on
+            return await asyncio.shield(future)
+
+        future = self._async_calls[key] = asyncio.get_running_loop().create_future()
+        with self._lock:
+            self.leaders += 1
+        try:
+            result = await func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            # Retrieved here, so a failure nobody waited on is not logged as never retrieved
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._async_calls[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls) + len(self._async_calls),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+            }
+
+class IdempotencyStore:
+    """Responses of requests sent with an Idempotency-Key header, replayed when the key comes again.
+
+    Each entry stores a fingerprint of the request. A key reused with a
+    different request is rejected instead of replayed.
+    """
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL, max_entries=IDEMPOTENCY_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """Return the stored (fingerprint, status, body) of a key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry['stored_at'] > self.ttl:
+                del self._entries[key]
+                return None
+            return entry['fingerprint'], entry['status'], entry['body']
+
+    def set(self, key, fingerprint, status, body):
+        with self._lock:
+            self._entries[key] = {'fingerprint': fingerprint, 'status': status, 'body': body, 'stored_at': time.monotonic()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries)}
+
+single_flight = SingleFlight()
+idempotency_store = IdempotencyStore()
@@ -1,9 +1,20 @@
-from dotenv import dotenv_values
-from openai import OpenAI
-import PyPDF2
 import re
+import sys
 import json
 import os
+import time
+import asyncio
+import logging
+from result_cache import result_cache, make_key, prompt_version
+from single_flight import single_flight
+from openai_scheduler import openai_scheduler
+from model_clients import client_manager
+import pdf_processing
+import prompt_assembly
+import metrics
+from streaming import LineItemParser
+
+logger = logging.getLogger(__name__)
 
 # Add ship_to_info dictionary required by the frontend
 ship_to_info = {
@@ -12,22 +23,47 @@ ship_to_info = {
     "default_3": "Default Shipping Address 3"
 }
 
-def extract_text_from_pdf(pdf_filename):
-    """Extract text content from a PDF file"""
+# Page selection overrides for the DEFAULT customer, see page_selection.DEFAULT_PAGE_SELECTION
+page_selection = {}
+
+# Maximum tokens of document text in the prompt, None uses OPENAI_PROMPT_TOKEN_BUDGET
+prompt_token_budget = None
+
+def extract_text_from_pdf(pdf_source):
+    """Extract normalized text content from the most relevant pages of a PDF file path or PDF bytes,
+    without repeated headers and boilerplate and within the prompt token budget"""
     try:
-        with open(pdf_filename, "rb") as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            return text
+        with metrics.stage('pdf_text'):
+            page_texts, selected_pages = pdf_processing.extract_selected_pages(pdf_source, page_selection, normalize=True)
+        with metrics.stage('prompt_assembly'):
+            text, report = prompt_assembly.assemble_prompt_text(
+                page_texts, selected_pages, prompt_assembly.token_budget(sys.modules[__name__])
+            )
     except Exception as e:
-        print(f"Error reading PDF: {e}")
+        logger.error("Error reading PDF: %s", e)
         return ""
+    logger.info(
+        "Prompt assembly saved %d of %d tokens (%d repeated, %d boilerplate lines, pages dropped %s%s)",
+        report['tokens_saved'], report['tokens_before'], report['repeated_lines_removed'],
+        report['boilerplate_lines_removed'], report['pages_dropped'], ", truncated" if report['truncated'] else "",
+    )
+    metrics.annotate(prompt_tokens=report['tokens_after'], prompt_tokens_saved=report['tokens_saved'])
+    return text
 
-def fix_number_format(text):
-    """Convert numbers formatted as 'xxx,xxx.xxx' to 'xxxxxx.xxx'"""
-    return re.sub(r'(\d{1,3}),(\d{3}\.\d+)', r'\1\2', text)
+# Header fields every line item of the frontend output carries
+HEADER_FIELDS = ["Customer Name", "Purchase Order Number", "Required Delivery Date", "Delivery Address"]
+
+def header_fields(extracted_data):
+    """Get the common header fields of the extracted data, empty when missing"""
+    return {field: extracted_data.get(field, "") for field in HEADER_FIELDS}
+
+def merge_line_item(common_fields, line_item):
+    """Combine the common fields with a line item, unless the line item has all of them"""
+    if all(field in line_item for field in HEADER_FIELDS):
+        return line_item
+    combined_item = common_fields.copy()
+    combined_item.update(line_item)
+    return combined_item
 
 def format_results_for_frontend(extracted_data):
     """Format the extracted data to match the expected frontend format"""
@@ -42,27 +78,10 @@ def format_results_for_frontend(extracted_data):
             lines = extracted_data[array_field]
             
             # Get common fields from the top level
-            common_fields = {
-                "Customer Name": extracted_data.get("Customer Name", ""),
-                "Purchase Order Number": extracted_data.get("Purchase Order Number", ""),
-                "Required Delivery Date": extracted_data.get("Required Delivery Date", ""),
-                "Delivery Address": extracted_data.get("Delivery Address", "")
-            }
+            common_fields = header_fields(extracted_data)
             
             # Process each line item
-            results = []
-            for line_item in lines:
-                # If the line item has all fields, use those directly
-                if all(field in line_item for field in ["Customer Name", "Purchase Order Number", "Required Delivery Date", "Delivery Address"]):
-                    # Just use the line item directly
-                    results.append(line_item)
-                else:
-                    # Combine common fields with line-specific fields
-                    combined_item = common_fields.copy()
-                    combined_item.update(line_item)
-                    results.append(combined_item)
-            
-            return results
+            return [merge_line_item(common_fields, line_item) for line_item in lines]
     
     # If the data is already an array, return it directly
     if isinstance(extracted_data, list):
@@ -71,31 +90,16 @@ def format_results_for_frontend(extracted_data):
     # If the data is a single object, return it as a single-item array
     return [extracted_data]
 
-def extract_po_data(pdf_filename):
-    """Extract purchase order data from a PDF file using OpenAI"""
-    print(f"\n===== PROCESSING PDF: {pdf_filename} =====")
-    # Load environment variables
-    env_vars = dotenv_values(".env")
-    api_key = env_vars.get("OPENAI_API_KEY")
-    
-    if not api_key:
-        print("Error: OPENAI_API_KEY not found in .env file")
-        return []
-    
-    # Initialize OpenAI client
-    try:
-        openai_client = OpenAI(api_key=api_key)
-    except Exception as e:
-        print(f"Error initializing OpenAI client: {e}")
-        return []
-    
-    # Extract and process PDF text
-    pdf_text = extract_text_from_pdf(pdf_filename)
-    if not pdf_text:
-        return []
-    
-    pdf_text = fix_number_format(pdf_text)
-    
+# Chat completion settings shared by the interactive and the batch extraction
+COMPLETION_OPTIONS = {
+    "model": "gpt-4o",
+    "temperature": 0,
+    "top_p": 0.1,
+    "response_format": {"type": "json_object"},
+}
+
+def build_messages(pdf_text):
+    """Build the chat messages that extract the purchase order fields from the PDF text"""
     # Define the system message
     system_message = (
         "You are an AI extracting relevant content from a purchase order. "
@@ -132,54 +136,289 @@ def extract_po_data(pdf_filename):
             "If there's only one line, output it as a single JSON object. Ensure that no line is omitted."
         )
     })
+    return prompts
 
+def parse_response_content(raw_response):
+    """Parse the JSON answer of the model, also when wrapped in a markdown code block. Returns None if it is not valid JSON"""
+    try:
+        return json.loads(raw_response)
+    except json.JSONDecodeError:
+        logger.warning("Received invalid JSON response. Attempting to fix...")
+    
+    # Try to extract JSON if it's wrapped in markdown code blocks
+    if "```json" in raw_response:
+        match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', raw_response)
+        if match:
+            try:
+                return json.loads(match.group(1))
+            except json.JSONDecodeError:
+                logger.error("Failed to extract JSON from code block")
+                return None
+    logger.error("Could not parse JSON response")
+    return None
+
+def result_cache_key(pdf_bytes):
+    """Build the result cache key of a PDF processed with the DEFAULT extraction"""
+    return make_key(pdf_bytes, "DEFAULT", prompt_version(sys.modules[__name__]))
+
+def read_pdf_source(pdf_source):
+    """Return the bytes of a PDF file path or PDF bytes, or None if the file cannot be read"""
+    if not isinstance(pdf_source, str):
+        logger.debug("Processing PDF: %d bytes", len(pdf_source))
+        return pdf_source
+    logger.debug("Processing PDF: %s", pdf_source)
+    try:
+        with open(pdf_source, "rb") as file:
+            return file.read()
+    except OSError as e:
+        logger.error("Error reading PDF: %s", e)
+        metrics.record_error('pdf_text')
+        return None
+
+def results_from_response(raw_response, cache_key):
+    """Parse and format the model's answer and store the results in the cache. Returns [] if the answer is not valid JSON"""
+    extracted_data = parse_response_content(raw_response)
+    if extracted_data is None:
+        metrics.record_error('parse_response')
+        return []
+    
+    logger.debug("Raw extracted data: %s", extracted_data)
+    
+    # Format the results for the frontend
+    with metrics.stage('post_process'):
+        results = format_results_for_frontend(extracted_data)
+    logger.debug("Formatted results for frontend: %s", results)
+    
+    result_cache.set(cache_key, results)
+    return results
+
+def extract_po_data(pdf_source):
+    """Extract purchase order data from a PDF file path or PDF bytes using OpenAI"""
+    pdf_source = read_pdf_source(pdf_source)
+    if pdf_source is None:
+        return []
+    
+    # Return the stored result if this PDF was already processed with the same prompts
+    cache_key = result_cache_key(pdf_source)
+    cached_results = result_cache.get(cache_key)
+    metrics.annotate(cache_hit=cached_results is not None)
+    if cached_results is not None:
+        return cached_results
+    
+    # Identical uploads already being processed share that run's result
+    return single_flight.do(cache_key, _extract_uncached, pdf_source, cache_key)
+
+def _extract_uncached(pdf_source, cache_key):
+    # Get the shared OpenAI client
+    try:
+        openai_client = client_manager.get_openai_client()
+    except Exception as e:
+        logger.error("Error initializing OpenAI client: %s", e)
+        metrics.record_error('openai_client')
+        return []
+    
+    if openai_client is None:
+        logger.error("OPENAI_API_KEY not found in .env file")
+        metrics.record_error('openai_client')
+        return []
+    
+    # Extract and process PDF text
+    pdf_text = extract_text_from_pdf(pdf_source)
+    if not pdf_text:
+        return []
+    
     try:
         # Make the API call
-        response = openai_client.chat.completions.create(
-            model='gpt-4o',
-            messages=prompts,
-            temperature=0,
-            top_p=0.1,
-            response_format={"type": "json_object"}
-        )
+        with metrics.stage('openai_chat'):
+            response = openai_scheduler.create_chat_completion(openai_client, messages=build_messages(pdf_text), **COMPLETION_OPTIONS)
         
-        # Parse the response
-        raw_response = response.choices[0].message.content
+        return results_from_response(response.choices[0].message.content, cache_key)
         
-        try:
-            extracted_data = json.loads(raw_response)
-        except json.JSONDecodeError:
-            print("Received invalid JSON response. Attempting to fix...")
-            
-            # Try to extract JSON if it's wrapped in markdown code blocks
-            if "```json" in raw_response:
-                match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', raw_response)
-                if match:
-                    try:
-                        extracted_data = json.loads(match.group(1))
-                    except:
-                        print("Failed to extract JSON from code block")
-                        return []
-            else:
-                print("Could not parse JSON response")
-                return []
-        
-        # Print the raw extracted data for debugging
-        print("\n===== RAW EXTRACTED DATA =====")
-        print(json.dumps(extracted_data, indent=2))
-        
-        # Format the results for the frontend
-        results = format_results_for_frontend(extracted_data)
-        
-        # Print the formatted results
-        print("\n===== FORMATTED RESULTS FOR FRONTEND =====")
-        print(json.dumps(results, indent=2))
+    except Exception as e:
+        logger.error("Error in PO extraction: %s", e)
+        return []
+
+async def extract_po_data_async(pdf_source):
+    """Async variant of extract_po_data for the ASGI server: PDF parsing runs in a worker
+    thread and the OpenAI call is awaited instead of holding a thread"""
+    pdf_source = await asyncio.to_thread(read_pdf_source, pdf_source)
+    if pdf_source is None:
+        return []
+    
+    cache_key = result_cache_key(pdf_source)
+    cached_results = await asyncio.to_thread(result_cache.get, cache_key)
+    metrics.annotate(cache_hit=cached_results is not None)
+    if cached_results is not None:
+        return cached_results
+    
+    return await single_flight.do_async(cache_key, _extract_uncached_async, pdf_source, cache_key)
+
+async def _extract_uncached_async(pdf_source, cache_key):
+    try:
+        openai_client = client_manager.get_async_openai_client()
+    except Exception as e:
+        logger.error("Error initializing OpenAI client: %s", e)
+        metrics.record_error('openai_client')
+        return []
+    
+    if openai_client is None:
+        logger.error("OPENAI_API_KEY not found in .env file")
+        metrics.record_error('openai_client')
+        return []
+    
+    pdf_text = await asyncio.to_thread(extract_text_from_pdf, pdf_source)
+    if not pdf_text:
+        return []
+    
+    try:
+        with metrics.stage('openai_chat'):
+            response = await openai_scheduler.create_chat_completion_async(
+                openai_client, messages=build_messages(pdf_text), **COMPLETION_OPTIONS
+            )
         
-        return results
+        return await asyncio.to_thread(results_from_response, response.choices[0].message.content, cache_key)
         
     except Exception as e:
-        print(f"Error in PO extraction: {e}")
+        logger.error("Error in PO extraction: %s", e)
+        return []
+
+def _line_events(parser, delta, started):
+    """Feed a streamed piece of the answer to the parser and build the events of the completed line items"""
+    if parser.failed:
         return []
+    try:
+        completed = parser.feed(delta)
+    except ValueError as e:
+        # The whole answer is still parsed once the stream ends
+        logger.warning("Could not parse the streamed answer incrementally: %s", e)
+        parser.failed = True
+        return []
+    
+    if completed and parser.completed == len(completed):
+        metrics.annotate(first_line_ms=round((time.perf_counter() - started) * 1000, 2))
+    events = []
+    for headers, line_item in completed:
+        if not isinstance(line_item, dict):
+            continue
+        if headers is not None:
+            line_item = merge_line_item(header_fields(headers), line_item)
+        events.append(('line', line_item))
+    return events
+
+def stream_po_data(pdf_source):
+    """
+    Extract purchase order data like extract_po_data, with streaming on, and
+    yield each line item as soon as the model has written it.
+    
+    Yields:
+        tuple: ('line', line item merged with the header fields) while the
+        model generates, then ('done', the same results extract_po_data
+        returns) or ('error', message)
+    """
+    started = time.perf_counter()
+    pdf_source = read_pdf_source(pdf_source)
+    if pdf_source is None:
+        yield 'error', 'Error reading PDF'
+        return
+    
+    cache_key = result_cache_key(pdf_source)
+    cached_results = result_cache.get(cache_key)
+    metrics.annotate(cache_hit=cached_results is not None)
+    if cached_results is not None:
+        for line_item in cached_results:
+            yield 'line', line_item
+        yield 'done', cached_results
+        return
+    
+    openai_client = client_manager.get_openai_client()
+    if openai_client is None:
+        metrics.record_error('openai_client')
+        yield 'error', 'OPENAI_API_KEY not found in .env file'
+        return
+    
+    pdf_text = extract_text_from_pdf(pdf_source)
+    if not pdf_text:
+        yield 'error', 'No text found in PDF'
+        return
+    
+    parser = LineItemParser()
+    pieces = []
+    chat_started = time.perf_counter()
+    try:
+        stream = openai_scheduler.create_chat_completion(
+            openai_client, messages=build_messages(pdf_text), stream=True, **COMPLETION_OPTIONS
+        )
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                pieces.append(delta)
+                yield from _line_events(parser, delta, started)
+    except Exception as e:
+        logger.error("Error in streamed PO extraction: %s", e)
+        metrics.observe_stage('openai_chat', time.perf_counter() - chat_started, error=True)
+        yield 'error', str(e)
+        return
+    metrics.observe_stage('openai_chat', time.perf_counter() - chat_started)
+    
+    results = results_from_response("".join(pieces), cache_key)
+    if not results:
+        yield 'error', 'Invalid JSON response'
+        return
+    yield 'done', results
+
+async def stream_po_data_async(pdf_source):
+    """Async variant of stream_po_data for the ASGI server"""
+    started = time.perf_counter()
+    pdf_source = await asyncio.to_thread(read_pdf_source, pdf_source)
+    if pdf_source is None:
+        yield 'error', 'Error reading PDF'
+        return
+    
+    cache_key = result_cache_key(pdf_source)
+    cached_results = await asyncio.to_thread(result_cache.get, cache_key)
+    metrics.annotate(cache_hit=cached_results is not None)
+    if cached_results is not None:
+        for line_item in cached_results:
+            yield 'line', line_item
+        yield 'done', cached_results
+        return
+    
+    openai_client = client_manager.get_async_openai_client()
+    if openai_client is None:
+        metrics.record_error('openai_client')
+        yield 'error', 'OPENAI_API_KEY not found in .env file'
+        return
+    
+    pdf_text = await asyncio.to_thread(extract_text_from_pdf, pdf_source)
+    if not pdf_text:
+        yield 'error', 'No text found in PDF'
+        return
+    
+    parser = LineItemParser()
+    pieces = []
+    chat_started = time.perf_counter()
+    try:
+        stream = await openai_scheduler.create_chat_completion_async(
+            openai_client, messages=build_messages(pdf_text), stream=True, **COMPLETION_OPTIONS
+        )
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                pieces.append(delta)
+                for event in _line_events(parser, delta, started):
+                    yield event
+    except Exception as e:
+        logger.error("Error in streamed PO extraction: %s", e)
+        metrics.observe_stage('openai_chat', time.perf_counter() - chat_started, error=True)
+        yield 'error', str(e)
+        return
+    metrics.observe_stage('openai_chat', time.perf_counter() - chat_started)
+    
+    results = await asyncio.to_thread(results_from_response, "".join(pieces), cache_key)
+    if not results:
+        yield 'error', 'Invalid JSON response'
+        return
+    yield 'done', results
 
 # Save extraction results to a JSON file and display them
 def save_and_display_results(pdf_filename, results):
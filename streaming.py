@@ -0,0 +1,90 @@
+import json
+
+class LineItemParser:
+    """Incremental parser of a streamed JSON answer that returns each line item as soon as it is complete.
+
+    The answer is either an array of line items, or an object holding the
+    header fields and the line items in its first array field, as read by
+    standard_via_openai.format_results_for_frontend. Header fields written
+    before that array are returned with every item. Header fields written
+    after it are only known once the whole answer has been parsed.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.position = 0
+        self.stack = []
+        self.in_string = False
+        self.escaped = False
+        self.top_level = None
+        # Position of the last ',' or '{' of the top-level object before the line array
+        self.last_separator = None
+        self.headers_end = None
+        self.headers = None
+        self.lines_start = None
+        self.lines_done = False
+        # Line items returned so far, and whether the answer stopped being valid JSON
+        self.completed = 0
+        self.failed = False
+
+    def _headers(self):
+        if self.headers is None:
+            start = self.stack[0][1]
+            prefix = self.text[start:self.headers_end]
+            self.headers = json.loads(prefix + "}") if self.headers_end > start else {}
+        return self.headers
+
+    def feed(self, chunk):
+        """
+        Parse the next chunk of the answer.
+
+        Returns:
+            list: (headers, item) for every line item completed by this chunk,
+            headers is None when the answer is an array of line items
+        """
+        self.text += chunk
+        completed = []
+        text = self.text
+        for index in range(self.position, len(text)):
+            char = text[index]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in '{[':
+                if not self.stack:
+                    self.top_level = char
+                    self.last_separator = index
+                elif (len(self.stack) == 1 and self.top_level == '{' and char == '['
+                      and self.lines_start is None):
+                    # The first array of the object holds the line items
+                    self.lines_start = index
+                    self.headers_end = self.last_separator
+                self.stack.append((char, index))
+            elif char == ',' and len(self.stack) == 1:
+                self.last_separator = index
+            elif char in '}]' and self.stack:
+                opening, start = self.stack.pop()
+                if opening != '{':
+                    if start == self.lines_start:
+                        self.lines_done = True
+                    continue
+                if self.top_level == '[' and len(self.stack) == 1:
+                    completed.append((None, json.loads(text[start:index + 1])))
+                elif (not self.lines_done and self.lines_start is not None
+                      and len(self.stack) == 2 and self.stack[-1][1] == self.lines_start):
+                    completed.append((self._headers(), json.loads(text[start:index + 1])))
+        self.position = len(text)
+        self.completed += len(completed)
+        return completed
+
+def format_event(event, data, ndjson=False):
+    """Encode an event as a Server-Sent Event, or as a newline-delimited JSON line."""
+    if ndjson:
+        return json.dumps({'event': event, 'data': data}) + "\n"
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
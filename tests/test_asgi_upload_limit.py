@@ -0,0 +1,63 @@
+import asyncio
+import json
+import pytest
+
+po_asgi_app = pytest.importorskip('po_asgi_app')
+
+BOUNDARY = 'testboundary'
+
+def multipart_body(size):
+    return (
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="customer"\r\n\r\nB\r\n'
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="po.txt"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'
+    ).encode() + b'x' * size + f'\r\n--{BOUNDARY}--\r\n'.encode()
+
+def call(app, body, content_length=True, chunk_size=1024):
+    """Send a multipart upload through the ASGI app, returning the status and JSON body."""
+    headers = [(b'content-type', f'multipart/form-data; boundary={BOUNDARY}'.encode())]
+    if content_length:
+        headers.append((b'content-length', str(len(body)).encode()))
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST',
+        'scheme': 'http', 'path': '/api/process-purchase-order', 'raw_path': b'/api/process-purchase-order',
+        'query_string': b'', 'root_path': '', 'headers': headers,
+        'client': ('127.0.0.1', 5000), 'server': ('127.0.0.1', 5000),
+    }
+    chunks = [body[index:index + chunk_size] for index in range(0, len(body), chunk_size)]
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': index < len(chunks) - 1} for index, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    status = next(message['status'] for message in sent if message['type'] == 'http.response.start')
+    body = b''.join(message.get('body', b'') for message in sent if message['type'] == 'http.response.body')
+    return status, json.loads(body)
+
+@pytest.fixture
+def app():
+    from starlette.applications import Starlette
+    from starlette.middleware import Middleware
+    return Starlette(routes=po_asgi_app.routes, middleware=[Middleware(po_asgi_app.BodySizeLimitMiddleware, max_bytes=4096)])
+
+def test_body_within_the_limit_reaches_the_route(app):
+    status, body = call(app, multipart_body(1000), content_length=False)
+    assert status == 400
+    assert body == {'error': 'Invalid file type'}
+
+def test_content_length_above_the_limit_is_rejected(app):
+    status, body = call(app, multipart_body(10000))
+    assert status == 413
+    assert body == {'error': 'Upload exceeds the 4096 byte limit'}
+
+def test_chunked_body_above_the_limit_is_rejected(app):
+    status, body = call(app, multipart_body(10000), content_length=False)
+    assert status == 413
+    assert body == {'error': 'Upload exceeds the 4096 byte limit'}
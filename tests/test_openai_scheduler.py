@@ -0,0 +1,221 @@
+import asyncio
+import threading
+import time
+import pytest
+import openai_scheduler
+from openai_scheduler import TokenBucket, ConcurrencyGate, OpenAIScheduler, parse_duration
+
+def test_reservation_within_budget_does_not_wait():
+    bucket = TokenBucket(60)
+    assert bucket.reserve(30, bucket.updated) == 0.0
+    assert bucket.reserve(30, bucket.updated) == 0.0
+
+def test_reservation_past_budget_waits_for_the_refill():
+    bucket = TokenBucket(60)  # one per second
+    now = bucket.updated
+    bucket.reserve(60, now)
+    assert bucket.reserve(1, now) == pytest.approx(1.0)
+    # Later reservations queue behind the earlier ones
+    assert bucket.reserve(2, now) == pytest.approx(3.0)
+    assert bucket.reserve(1, now + 2.0) == pytest.approx(2.0)
+
+def test_reservation_larger_than_capacity_is_capped():
+    bucket = TokenBucket(60)
+    now = bucket.updated
+    bucket.reserve(60, now)
+    assert bucket.reserve(600, now) == pytest.approx(60.0)
+
+def test_refill_never_exceeds_capacity():
+    bucket = TokenBucket(60)
+    now = bucket.updated
+    bucket.reserve(10, now)
+    bucket.reserve(0, now + 3600)
+    assert bucket.balance == 60
+
+def test_refund_shortens_the_wait():
+    bucket = TokenBucket(60)
+    now = bucket.updated
+    bucket.reserve(60, now)
+    bucket.reserve(10, now)
+    bucket.refund(10, now)
+    assert bucket.reserve(1, now) == pytest.approx(1.0)
+
+def test_refund_is_capped_at_capacity():
+    bucket = TokenBucket(60)
+    now = bucket.updated
+    bucket.refund(100, now)
+    assert bucket.balance == 60
+
+def test_negative_refund_takes_the_shortfall():
+    bucket = TokenBucket(60)
+    now = bucket.updated
+    bucket.refund(-60, now)
+    assert bucket.reserve(1, now) == pytest.approx(1.0)
+
+def test_limit_to_lowers_the_balance_only():
+    bucket = TokenBucket(60)
+    now = bucket.updated
+    bucket.limit_to(10, now)
+    assert bucket.balance == 10
+    bucket.limit_to(50, now)
+    assert bucket.balance == 10
+    bucket.reserve(10, now)
+    assert bucket.reserve(6, now) == pytest.approx(6.0)
+
+def test_set_capacity_changes_the_refill_rate():
+    bucket = TokenBucket(60)
+    now = bucket.updated
+    bucket.set_capacity(6000, now)
+    bucket.reserve(60, now)
+    assert bucket.reserve(100, now) == pytest.approx(1.0)
+    bucket.set_capacity(30, now)
+    assert bucket.balance <= 30
+    assert bucket.rate == 0.5
+
+def test_parse_duration():
+    assert parse_duration('6m0s') == 360
+    assert parse_duration('1.5s') == 1.5
+    assert parse_duration('20ms') == pytest.approx(0.02)
+    assert parse_duration('2') == 2
+    assert parse_duration('') is None
+    assert parse_duration('soon') is None
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+def test_gate_hands_slots_to_threads_in_arrival_order():
+    gate = ConcurrencyGate(1)
+    gate.acquire()
+    order = []
+
+    def worker(index):
+        gate.acquire()
+        order.append(index)
+        gate.release()
+
+    threads = []
+    for index in range(8):
+        thread = threading.Thread(target=worker, args=(index,))
+        thread.start()
+        threads.append(thread)
+        wait_for(lambda: len(gate._waiters) == index + 1)
+    gate.release()
+    for thread in threads:
+        thread.join(5)
+    assert order == list(range(8))
+    assert gate.in_flight == 0
+
+def test_gate_hands_slots_to_tasks_in_arrival_order():
+    async def main():
+        gate = ConcurrencyGate(1)
+        await gate.acquire_async()
+        order = []
+
+        async def worker(index):
+            await gate.acquire_async()
+            order.append(index)
+            await asyncio.sleep(0)
+            gate.release()
+
+        tasks = []
+        for index in range(8):
+            tasks.append(asyncio.create_task(worker(index)))
+            while len(gate._waiters) < index + 1:
+                await asyncio.sleep(0)
+        gate.release()
+        await asyncio.wait_for(asyncio.gather(*tasks), 5)
+        return gate, order
+
+    gate, order = asyncio.run(main())
+    assert order == list(range(8))
+    assert gate.in_flight == 0
+
+def test_gate_serves_threads_and_tasks_in_one_queue():
+    gate = ConcurrencyGate(1)
+    gate.acquire()
+    order = []
+
+    def thread_worker():
+        gate.acquire()
+        order.append('thread')
+        gate.release()
+
+    async def task_worker():
+        await gate.acquire_async()
+        order.append('task')
+        gate.release()
+
+    loop_thread = threading.Thread(target=asyncio.run, args=(task_worker(),))
+    loop_thread.start()
+    wait_for(lambda: len(gate._waiters) == 1)
+    worker = threading.Thread(target=thread_worker)
+    worker.start()
+    wait_for(lambda: len(gate._waiters) == 2)
+    gate.release()
+    loop_thread.join(5)
+    worker.join(5)
+    assert order == ['task', 'thread']
+    assert gate.in_flight == 0
+
+def test_raising_the_limit_wakes_waiters():
+    gate = ConcurrencyGate(1)
+    gate.acquire()
+    acquired = threading.Event()
+
+    def worker():
+        gate.acquire()
+        acquired.set()
+
+    threading.Thread(target=worker).start()
+    wait_for(lambda: len(gate._waiters) == 1)
+    gate.set_limit(2)
+    assert acquired.wait(5)
+    assert gate.in_flight == 2
+
+def test_cancelled_task_does_not_keep_a_slot():
+    async def main():
+        gate = ConcurrencyGate(1)
+        await gate.acquire_async()
+        waiter = asyncio.create_task(gate.acquire_async())
+        while not gate._waiters:
+            await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        gate.release()
+        await asyncio.wait_for(gate.acquire_async(), 1)
+        return gate
+
+    gate = asyncio.run(main())
+    assert gate.in_flight == 1
+    assert not gate._waiters
+
+class FailingCompletions:
+    def __init__(self, error):
+        self.error = error
+        self.with_raw_response = self
+
+    def create(self, **request):
+        raise self.error
+
+class FailingClient:
+    def __init__(self, error):
+        self.chat = type('Chat', (), {})()
+        self.chat.completions = FailingCompletions(error)
+
+    def with_options(self, **options):
+        return self
+
+def test_failed_call_refunds_its_reservation(monkeypatch):
+    monkeypatch.setattr(openai_scheduler, 'count_tokens', lambda text, model: len(text))
+    scheduler = OpenAIScheduler(rpm=60, tpm=6000, max_retries=0)
+    request = {'model': 'gpt-4o', 'messages': [{'role': 'user', 'content': 'x' * 100}], 'max_tokens': 900}
+    assert scheduler.estimate_tokens(request) == 1004
+    with pytest.raises(ValueError):
+        scheduler.create_chat_completion(FailingClient(ValueError("bad request")), **request)
+    assert scheduler.requests.balance == pytest.approx(60, abs=0.1)
+    assert scheduler.tokens.balance == pytest.approx(6000, abs=1)
+    assert scheduler.gate.in_flight == 0
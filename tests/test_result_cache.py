@@ -0,0 +1,50 @@
+import json
+import os
+from customer_registry import CustomerRegistry
+from result_cache import make_key, prompt_version
+
+DEFINITION = {
+    'extract_prompt': "Extract the fields from: {retrieved_text}",
+    'refine_prompt': "Refine: {extracted_info}",
+    'sold_to_info': {'Sold To': '100200'},
+    'ship_to_info': {'ST01': '12 Harbor Way, Reno, NV 89501'},
+}
+
+def write_definition(path, definition, mtime):
+    with open(path, 'w') as f:
+        json.dump(definition, f)
+    os.utime(path, (mtime, mtime))
+
+def reloaded_versions(tmp_path, change):
+    path = tmp_path / "ZZ.json"
+    registry = CustomerRegistry(config_dir=str(tmp_path), reload_interval=0)
+    write_definition(path, DEFINITION, 1000)
+    before = prompt_version(registry.get('ZZ'))
+    write_definition(path, change(json.loads(json.dumps(DEFINITION))), 2000)
+    return before, prompt_version(registry.get('ZZ'))
+
+def test_unchanged_definition_keeps_the_version(tmp_path):
+    before, after = reloaded_versions(tmp_path, lambda definition: definition)
+    assert before == after
+
+def test_ship_to_edit_changes_the_key(tmp_path):
+    def change(definition):
+        definition['ship_to_info']['ST01'] = '14 Harbor Way, Reno, NV 89501'
+        return definition
+    before, after = reloaded_versions(tmp_path, change)
+    assert before != after
+    assert make_key(b"%PDF", 'ZZ', before) != make_key(b"%PDF", 'ZZ', after)
+
+def test_sold_to_edit_changes_the_version(tmp_path):
+    def change(definition):
+        definition['sold_to_info']['Sold To'] = '100300'
+        return definition
+    before, after = reloaded_versions(tmp_path, change)
+    assert before != after
+
+def test_prompt_edit_changes_the_version(tmp_path):
+    def change(definition):
+        definition['extract_prompt'] = "Extract every field from: {retrieved_text}"
+        return definition
+    before, after = reloaded_versions(tmp_path, change)
+    assert before != after
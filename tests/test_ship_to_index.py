@@ -0,0 +1,59 @@
+import random
+import re
+import pytest
+from benchmarks.bench_ship_to_index import make_ship_to_info, make_query, full_scan
+from ship_to_index import ShipToIndex, get_ship_to_index, clear_ship_to_indexes
+
+@pytest.fixture(scope='module')
+def ship_info():
+    return make_ship_to_info(400, seed=7)
+
+@pytest.fixture(scope='module')
+def index(ship_info):
+    return ShipToIndex(ship_info)
+
+def test_indexed_match_equals_the_full_scan(ship_info, index):
+    rng = random.Random(11)
+    keys = list(ship_info)
+    for _ in range(25):
+        query = make_query(ship_info[rng.choice(keys)], rng)
+        assert index.find_best_match(query) == full_scan(query, ship_info), query
+
+def test_exact_address_matches_its_key(ship_info, index):
+    for key in list(ship_info)[::40]:
+        assert index.find_best_match(ship_info[key]) == key
+
+def test_unrelated_text_matches_nothing(ship_info, index):
+    query = "zzzz qqqq xxxx"
+    assert index.find_best_match(query) == full_scan(query, ship_info) == "N/A"
+
+def quoted_addresses(text, addresses):
+    normalized_text = " ".join(text.split()).lower()
+    return {
+        address for address in addresses
+        if re.search(r'(?<!\w)' + re.escape(" ".join(address.split()).lower()) + r'(?!\w)', normalized_text)
+    }
+
+def test_quoted_candidates_keep_every_quoted_address(ship_info, index):
+    rng = random.Random(5)
+    addresses = list(ship_info.values())
+    for _ in range(20):
+        quoted = rng.choice(addresses)
+        text = f"PURCHASE ORDER\nShip to:\n{quoted}\nBill to: PO Box 12, Springfield"
+        normalized_text = " ".join(text.split()).lower()
+        candidates = index.quoted_candidates(normalized_text)
+        assert quoted_addresses(text, candidates) == quoted_addresses(text, addresses)
+
+def test_index_is_rebuilt_when_the_entries_change():
+    clear_ship_to_indexes()
+    ship_info = make_ship_to_info(50, seed=3)
+    index = get_ship_to_index(ship_info)
+    assert get_ship_to_index(ship_info) is index
+    ship_info["NEW"] = "1 Harbor Way, Reno, NV 89501"
+    assert get_ship_to_index(ship_info) is not index
+
+def test_cleared_indexes_are_rebuilt():
+    ship_info = make_ship_to_info(50, seed=3)
+    index = get_ship_to_index(ship_info)
+    clear_ship_to_indexes()
+    assert get_ship_to_index(ship_info) is not index
@@ -0,0 +1,178 @@
+import asyncio
+import threading
+import time
+import pytest
+import single_flight as single_flight_module
+from single_flight import SingleFlight, IdempotencyStore
+
+def test_concurrent_identical_calls_run_once():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'result'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('key', compute)))
+    leader.start()
+    assert started.wait(5)
+    waiters = [threading.Thread(target=lambda: results.append(flight.do('key', compute))) for _ in range(4)]
+    for waiter in waiters:
+        waiter.start()
+    deadline = time.monotonic() + 5
+    while flight.coalesced < 4:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader] + waiters:
+        thread.join(5)
+
+    assert results == ['result'] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {'in_flight': 0, 'leaders': 1, 'coalesced': 4}
+
+def test_different_keys_are_not_coalesced():
+    flight = SingleFlight()
+    assert flight.do('a', lambda: 1) == 1
+    assert flight.do('b', lambda: 2) == 2
+    assert flight.stats()['leaders'] == 2
+
+def test_later_calls_run_again():
+    flight = SingleFlight()
+    calls = []
+    flight.do('key', calls.append, 1)
+    flight.do('key', calls.append, 2)
+    assert calls == [1, 2]
+
+def test_error_is_raised_to_the_waiters():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def compute():
+        started.set()
+        release.wait(5)
+        raise ValueError("extraction failed")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do('key', compute)
+        except ValueError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call)]
+    threads[0].start()
+    assert started.wait(5)
+    threads += [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads[1:]:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while flight.coalesced < 3:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert errors == ["extraction failed"] * 4
+    assert flight.stats()['in_flight'] == 0
+
+def test_concurrent_identical_tasks_run_once():
+    flight = SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'result'
+
+    async def main():
+        return await asyncio.gather(*(flight.do_async('key', compute) for _ in range(5)))
+
+    assert asyncio.run(main()) == ['result'] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {'in_flight': 0, 'leaders': 1, 'coalesced': 4}
+
+def test_task_error_is_raised_to_the_waiters():
+    flight = SingleFlight()
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise ValueError("extraction failed")
+
+    async def main():
+        return await asyncio.gather(*(flight.do_async('key', compute) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert [type(result) for result in results] == [ValueError] * 3
+    assert flight.stats()['in_flight'] == 0
+
+def test_cancelled_waiter_does_not_cancel_the_call():
+    flight = SingleFlight()
+
+    async def compute():
+        await asyncio.sleep(0.02)
+        return 'result'
+
+    async def main():
+        leader = asyncio.create_task(flight.do_async('key', compute))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flight.do_async('key', compute))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        return await leader, waiter
+
+    result, waiter = asyncio.run(main())
+    assert result == 'result'
+    assert waiter.cancelled()
+
+def test_stored_response_is_returned():
+    store = IdempotencyStore(ttl=60)
+    store.set('key', 'fingerprint', 200, {'ok': True})
+    assert store.get('key') == ('fingerprint', 200, {'ok': True})
+    assert store.get('other') is None
+
+def test_stored_response_expires_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(single_flight_module.time, 'monotonic', lambda: now[0])
+    store = IdempotencyStore(ttl=60)
+    store.set('key', 'fingerprint', 200, {'ok': True})
+    now[0] += 60
+    assert store.get('key') is not None
+    now[0] += 1
+    assert store.get('key') is None
+    assert store.stats() == {'entries': 0}
+
+def test_oldest_responses_are_dropped_past_max_entries():
+    store = IdempotencyStore(max_entries=2)
+    for key in ('a', 'b', 'c'):
+        store.set(key, key, 200, {})
+    assert store.get('a') is None
+    assert store.get('b') is not None
+    assert store.stats() == {'entries': 2}
+
+@pytest.fixture
+def client():
+    po_app = pytest.importorskip('po_app')
+    return po_app.app.test_client()
+
+def test_reused_key_with_a_different_body_is_rejected(client):
+    headers = {'Idempotency-Key': 'test-reused-key'}
+    first = client.post('/api/process-purchase-order', data={'customer': 'B'}, headers=headers)
+    assert first.status_code == 400
+
+    replay = client.post('/api/process-purchase-order', data={'customer': 'B'}, headers=headers)
+    assert replay.status_code == 400
+    assert replay.get_json() == first.get_json()
+    assert replay.headers['Idempotent-Replayed'] == 'true'
+
+    conflict = client.post('/api/process-purchase-order', data={'customer': 'C'}, headers=headers)
+    assert conflict.status_code == 422
+    assert 'different request' in conflict.get_json()['error']
@@ -0,0 +1,90 @@
+import json
+import pytest
+from streaming import LineItemParser, format_event
+
+def feed_all(chunks):
+    parser = LineItemParser()
+    completed = []
+    for chunk in chunks:
+        completed.extend(parser.feed(chunk))
+    return parser, completed
+
+def chunked(text, size):
+    return [text[index:index + size] for index in range(0, len(text), size)]
+
+ARRAY_ANSWER = json.dumps([
+    {"Material Number": "M-1", "Quantity": "10 KG"},
+    {"Material Number": "M-2", "Quantity": "20 KG"},
+])
+
+OBJECT_ANSWER = json.dumps({
+    "Purchase Order Number": "4500012345",
+    "Line Items": [
+        {"Material Number": "M-1", "Quantity": "10 KG"},
+        {"Material Number": "M-2", "Quantity": "20 KG"},
+    ],
+    "Notes": "after the lines",
+})
+
+@pytest.mark.parametrize("size", [1, 2, 7, len(ARRAY_ANSWER)])
+def test_array_items_split_across_chunks(size):
+    parser, completed = feed_all(chunked(ARRAY_ANSWER, size))
+    assert completed == [(None, item) for item in json.loads(ARRAY_ANSWER)]
+    assert parser.completed == 2
+
+@pytest.mark.parametrize("size", [1, 3, 16])
+def test_object_items_carry_headers_written_before_them(size):
+    _, completed = feed_all(chunked(OBJECT_ANSWER, size))
+    headers = {"Purchase Order Number": "4500012345"}
+    assert completed == [(headers, item) for item in json.loads(OBJECT_ANSWER)["Line Items"]]
+
+def test_item_is_returned_by_the_chunk_that_completes_it():
+    parser = LineItemParser()
+    assert parser.feed('[{"Material Number": "M-1", "Qua') == []
+    assert parser.feed('ntity": "10 KG"}') == [(None, {"Material Number": "M-1", "Quantity": "10 KG"})]
+    assert parser.feed(', {"Material Number": "M-2"') == []
+    assert parser.feed('}]') == [(None, {"Material Number": "M-2"})]
+
+def test_escaped_quotes_and_braces_inside_strings():
+    items = [
+        {"Description": 'Drum 55 gal "blue" {lined} [steel]', "Quantity": "1 KG"},
+        {"Description": "ends with a backslash \\", "Quantity": "2 KG"},
+        {"Description": '\\"}]', "Quantity": "3 KG"},
+    ]
+    answer = json.dumps(items)
+    for size in (1, 5, len(answer)):
+        _, completed = feed_all(chunked(answer, size))
+        assert completed == [(None, item) for item in items]
+
+def test_braces_in_header_strings_do_not_open_the_line_items():
+    answer = json.dumps({"Notes": "see [1] and {2}", "Lines": [{"Material Number": "M-1"}]})
+    _, completed = feed_all(chunked(answer, 4))
+    assert completed == [({"Notes": "see [1] and {2}"}, {"Material Number": "M-1"})]
+
+def test_nested_objects_are_returned_whole():
+    answer = json.dumps([{"Material Number": "M-1", "Price": {"Amount": 5, "Currency": "USD"}}])
+    _, completed = feed_all(chunked(answer, 3))
+    assert completed == [(None, json.loads(answer)[0])]
+
+def test_text_around_the_json_is_ignored():
+    answer = 'Here are the lines:\n```json\n' + ARRAY_ANSWER + '\n```\nLet me know if {anything} else is needed.'
+    parser, completed = feed_all(chunked(answer, 6))
+    assert completed == [(None, item) for item in json.loads(ARRAY_ANSWER)]
+    assert parser.completed == 2
+
+def test_trailing_text_after_an_object_answer():
+    _, completed = feed_all(chunked(OBJECT_ANSWER + '\nNote: quantities in {KG}.', 5))
+    assert len(completed) == 2
+
+def test_invalid_line_item_raises_value_error():
+    parser = LineItemParser()
+    with pytest.raises(ValueError):
+        parser.feed('[{"Material Number": M-1}]')
+
+def test_format_event_as_server_sent_event():
+    assert format_event('line', {'a': 1}) == 'event: line\ndata: {"a": 1}\n\n'
+
+def test_format_event_as_ndjson():
+    line = format_event('done', {'lines': 2}, ndjson=True)
+    assert line.endswith("\n")
+    assert json.loads(line) == {'event': 'done', 'data': {'lines': 2}}
@@ -1,6 +1,13 @@
 from difflib import SequenceMatcher
 from datetime import datetime
 import json
+import os
+
+# Ship-to dictionaries larger than this are matched through ship_to_index
+SHIP_TO_INDEX_MIN_ENTRIES = int(os.environ.get('SHIP_TO_INDEX_MIN_ENTRIES', 200))
+
+# Fields every customer extraction is normalized to
+CANONICAL_FIELDS = ["Purchase Order Number", "Quantity", "Required Delivery Date", "Material Number", "Deliver to"]
 
 def allowed_file(filename, allowed_extensions={'pdf'}):
     """Check if the file has an allowed extension."""
@@ -8,6 +15,11 @@ def allowed_file(filename, allowed_extensions={'pdf'}):
 
 def find_best_match(deliver_to, ship_info, threshold=0.3):
     """Find the best matching ship-to code for a delivery address."""
+    # Large ship-to master data is matched through its n-gram index, numpy is only loaded then
+    if len(ship_info) > SHIP_TO_INDEX_MIN_ENTRIES:
+        from ship_to_index import get_ship_to_index
+        return get_ship_to_index(ship_info).find_best_match(deliver_to, threshold)
+    
     best_match = None
     highest_ratio = 0.0
     for key, value in ship_info.items():
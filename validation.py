@@ -0,0 +1,63 @@
+"""
+Checks of a post-processed extraction against the canonical schema, shared by
+field repair and the cascade so a field is valid or invalid for both.
+"""
+import os
+from datetime import datetime
+from difflib import SequenceMatcher
+from utils import CANONICAL_FIELDS
+
+# Minimum similarity of the extracted delivery address to the ship-to entry it was matched to
+SHIP_TO_MATCH_THRESHOLD = float(os.environ.get('SHIP_TO_MATCH_THRESHOLD', 0.5))
+
+def field_is_valid(field, info, customer_module, deliver_to_address=None, ship_to_threshold=SHIP_TO_MATCH_THRESHOLD):
+    """
+    Check one field of a post-processed extraction.
+
+    Args:
+        field: The canonical field name
+        info: The output of post_process_extracted_info
+        customer_module: The customer module the extraction was made for
+        deliver_to_address: The delivery address as extracted, before it was
+            replaced by its ship-to code, if known
+        ship_to_threshold: Minimum similarity of that address to the matched ship-to entry
+
+    Returns:
+        bool: Dates are YYYY-MM-DD, quantities numeric and converted to KG,
+        ship-to codes known and close to the extracted address, other fields not empty
+    """
+    value = str(info.get(field) or "").strip()
+    if field == "Required Delivery Date":
+        try:
+            datetime.strptime(value, "%Y-%m-%d")
+        except ValueError:
+            return False
+        return True
+    if field == "Quantity":
+        try:
+            float(value.replace(",", ""))
+        except ValueError:
+            return False
+        return info.get("Unit") == "KG"
+    if field == "Deliver to":
+        ship_to_info = customer_module.ship_to_info
+        if not ship_to_info:
+            return True
+        if value not in ship_to_info:
+            return False
+        return deliver_to_address is None or SequenceMatcher(None, deliver_to_address, ship_to_info[value]).ratio() >= ship_to_threshold
+    return bool(value)
+
+def failed_fields(info, customer_module, extracted=None):
+    """
+    Return the canonical fields of a post-processed extraction that fail validation.
+
+    Args:
+        info: The output of post_process_extracted_info
+        customer_module: The customer module the extraction was made for
+        extracted: The field values before post-processing, for the ship-to similarity check
+    """
+    deliver_to_address = (extracted or {}).get("Deliver to")
+    if deliver_to_address is not None:
+        deliver_to_address = str(deliver_to_address)
+    return [field for field in CANONICAL_FIELDS if not field_is_valid(field, info, customer_module, deliver_to_address)]